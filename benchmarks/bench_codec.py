@@ -0,0 +1,60 @@
+# coding: utf-8
+"""
+Compare per-line hex decoding/encoding with the batch codec.
+
+    python benchmarks/bench_codec.py
+"""
+
+import os
+import sys
+import binascii
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gor.base import Gor, GorMessage, gor_hex_data  # noqa: E402
+from gor.callback import SimpleCallbackContainer  # noqa: E402
+from gor.codec import decode_lines, encode_payloads  # noqa: E402
+
+
+def build_chunk(body_size: int, count: int) -> bytes:
+    lines = []
+    for i in range(count):
+        payload = b'1 %024x 1600000000000000000 0\nPOST /api HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s' % (
+            i, body_size, b'x' * body_size)
+        lines.append(binascii.hexlify(payload))
+    return b'\n'.join(lines) + b'\n'
+
+
+def main():
+    gor = Gor(SimpleCallbackContainer())
+    print('%10s %16s %16s %16s %16s' % (
+        'body size', 'decode line(us)', 'decode batch(us)', 'encode line(us)', 'encode batch(us)'))
+    for body_size in (64, 1024, 16 * 1024, 256 * 1024):
+        count = max(8, min(512, 4 * 1024 * 1024 // (body_size * 4)))
+        chunk = build_chunk(body_size, count)
+        messages = [gor.parse_message(line) for line in chunk.splitlines()]
+        number = 20
+
+        def decode_line():
+            return [gor.parse_message(line) for line in chunk.split(b'\n') if line]
+
+        def decode_batch():
+            lines, buf, offsets = decode_lines(chunk)
+            return [GorMessage.from_payload(buf, start, end) for start, end in offsets]
+
+        def encode_line():
+            return ''.join(gor_hex_data(msg) for msg in messages)
+
+        def encode_batch():
+            return encode_payloads([msg.payload for msg in messages])
+
+        results = []
+        for func in (decode_line, decode_batch, encode_line, encode_batch):
+            best = min(timeit.repeat(func, number=number, repeat=3))
+            results.append(best / number / count * 1e6)
+        print('%10d %16.2f %16.2f %16.2f %16.2f' % ((body_size,) + tuple(results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+Compare the header index with the byte-by-byte scanner it replaced.
+
+    python benchmarks/bench_headers.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gor.http_message import HeaderIndex  # noqa: E402
+
+
+def scan_http_header(payload: bytes, name: str):
+    current_line = 0
+    idx = 0
+    header = {
+        'start': -1,
+        'end': -1,
+        'value_start': -1,
+    }
+    name = name.encode()
+    while idx < len(payload):
+        c = payload[idx]
+        if c == ord('\n'):
+            current_line += 1
+            idx += 1
+            header['end'] = idx
+
+            if current_line > 0 and header['start'] > 0 and header['value_start'] > 0:
+                if payload[header['start']:header['value_start']-1].lower() == name.lower():
+                    header['value'] = payload[header['value_start']:header['end']].strip().decode()
+                    header['name'] = name.lower().decode()
+                    return header
+
+            header['start'] = -1
+            header['value_start'] = -1
+            continue
+        elif c == ord('\r'):
+            idx += 1
+            continue
+        elif c == ord(':'):
+            if header['value_start'] == -1:
+                idx += 1
+                header['value_start'] = idx
+                continue
+        if header['start'] == -1:
+            header['start'] = idx
+        idx += 1
+    return None
+
+
+def build_payload(n_headers: int) -> bytes:
+    lines = [b'GET /api/v1/items?id=1 HTTP/1.1']
+    for i in range(n_headers):
+        lines.append(b'X-Header-%d: value-%d' % (i, i))
+    lines += [b'Cookie: a=b; session=abcdef', b'User-Agent: bench', b'Content-Length: 5', b'', b'hello']
+    return b'\r\n'.join(lines)
+
+
+LOOKUPS = ['Host', 'Cookie', 'User-Agent', 'Content-Length', 'X-Missing']
+
+
+def lookup_scanner(payload):
+    for name in LOOKUPS:
+        scan_http_header(payload, name)
+
+
+def lookup_index(payload):
+    index = HeaderIndex(payload)
+    for name in LOOKUPS:
+        index.find(name)
+
+
+def main():
+    print('%8s %14s %14s %8s' % ('headers', 'scanner (us)', 'index (us)', 'speedup'))
+    for n_headers in (4, 16, 64):
+        payload = build_payload(n_headers)
+        number = 2000
+        scanner = min(timeit.repeat(lambda: lookup_scanner(payload), number=number, repeat=3)) / number
+        index = min(timeit.repeat(lambda: lookup_index(payload), number=number, repeat=3)) / number
+        print('%8d %14.2f %14.2f %7.1fx' % (n_headers, scanner * 1e6, index * 1e6, scanner / index))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# coding: utf-8
+"""
+Pipe a synthetic GoReplay stream through every middleware implementation
+with representative callbacks and report throughput, per message latency
+percentiles from input to output, callback latency percentiles (of the
+slowest callback channel) and peak RSS.
+
+    python benchmarks/bench_middleware.py --count 20000 --body-size 1024
+
+``--transport`` feeds the middlewares through a file, a named pipe or a Unix
+socket instead of stdin/stdout, to compare transports.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import binascii
+import socket
+import resource
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from traffic import write_traffic  # noqa: E402
+
+
+IMPLEMENTATIONS = ('AsyncioGor', 'MultiProcessGor', 'ThreadPoolGor')
+TRANSPORTS = ('stdio', 'file', 'fifo', 'unix')
+# hex characters kept of each line to match inputs and outputs, enough for
+# the type and the id of the meta line
+HEAD_SIZE = 128
+# lines written to the middleware at once, stamped with the same time
+SEND_BATCH = 16
+
+
+def on_request(proxy, msg, **kwargs):
+    proxy.on('response', on_response, idx=msg.id, once=True, req=msg)
+    msg.http = proxy.set_http_header(msg.http, 'X-Replayed', '1')
+    return msg
+
+
+def on_response(proxy, msg, **kwargs):
+    proxy.on('replay', on_replay, idx=kwargs['req'].id, once=True, req=kwargs['req'], resp=msg)
+    return msg
+
+
+def on_replay(proxy, msg, **kwargs):
+    if proxy.http_status(kwargs['resp'].http) == proxy.http_status(msg.http):
+        proxy.decompress_gzip_body(msg.http)
+    return msg
+
+
+def run_middleware(impl: str, stats_file: str, concurrency: int, input: str = None, output: str = None):
+    """
+    Body of the child process: run `impl` on `input`, writing to `output`,
+    both transport specs defaulting to stdin/stdout
+    """
+    import gor.middleware
+    proxy = getattr(gor.middleware, impl)(concurrency=concurrency, stats_interval=3600,
+                                          stats_file=stats_file, channel_ttl=60, input=input, output=output)
+    proxy.on('request', on_request)
+    proxy.run()
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    with open(stats_file + '.rss', 'w') as f:
+        json.dump({'self': usage, 'children': children}, f)
+
+
+def _key(head: bytes):
+    meta = binascii.unhexlify(head[:len(head) & ~1]).split(b'\n', 1)[0]
+    return tuple(meta.split(b' ', 2)[:2])
+
+
+class LatencyProbe(object):
+    """
+    Time every message from the moment its line is written to the
+    middleware to the moment its output line is read back, input and output
+    lines being matched by message type and id
+    """
+
+    def __init__(self, traffic: str):
+        self.traffic = traffic
+        # (time, heads of the lines written at that time)
+        self.sent = []
+        # (time, head of the line read)
+        self.received = []
+
+    def send(self, write, close):
+        with open(self.traffic, 'rb') as src:
+            batch = []
+            for line in src:
+                batch.append(line)
+                if len(batch) == SEND_BATCH:
+                    self._send(write, batch)
+                    batch = []
+            if batch:
+                self._send(write, batch)
+        close()
+
+    def _send(self, write, batch):
+        self.sent.append((time.perf_counter(), [line[:HEAD_SIZE] for line in batch]))
+        write(b''.join(batch))
+
+    def receive(self, stream):
+        received = self.received
+        for line in stream:
+            received.append((time.perf_counter(), line[:HEAD_SIZE]))
+
+    def percentiles(self):
+        """
+        :return: the p50 and p99 latencies in microseconds
+        """
+        sent = {}
+        for stamp, heads in self.sent:
+            for head in heads:
+                sent[_key(head)] = stamp
+        latencies = sorted(stamp - sent[key] for stamp, key in ((s, _key(h)) for s, h in self.received)
+                           if key in sent)
+        if not latencies:
+            return 0.0, 0.0
+        return (latencies[len(latencies) // 2] * 1e6,
+                latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6)
+
+
+def _write_all(stream):
+    def write(data):
+        stream.write(data)
+        stream.flush()
+    return write
+
+
+def _feed_fifo(probe: LatencyProbe, path: str):
+    with open(path, 'wb') as dst:
+        probe.send(_write_all(dst), lambda: None)
+
+
+def _drain_fifo(probe: LatencyProbe, path: str):
+    with open(path, 'rb') as src:
+        probe.receive(src)
+
+
+def _serve_unix(probe: LatencyProbe, server: socket.socket):
+    conn = server.accept()[0]
+    sender = threading.Thread(target=probe.send, args=(conn.sendall, lambda: conn.shutdown(socket.SHUT_WR)))
+    sender.start()
+    # read the middleware output until it closes its end
+    with conn.makefile('rb') as src:
+        probe.receive(src)
+    sender.join()
+    conn.close()
+
+
+def bench(impl: str, traffic: str, lines: int, concurrency: int, transport: str = 'stdio') -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        stats_file = os.path.join(tmp, 'stats.json')
+        cmd = [sys.executable, __file__, '--run', impl, '--stats-file', stats_file,
+               '--concurrency', str(concurrency)]
+        probe = LatencyProbe(traffic)
+        threads, server, proc = [], None, None
+        started = time.perf_counter()
+        if transport == 'stdio':
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            threads = [threading.Thread(target=probe.send, args=(_write_all(proc.stdin), proc.stdin.close)),
+                       threading.Thread(target=probe.receive, args=(proc.stdout,))]
+        elif transport == 'file':
+            # read straight from the file, there is no send time to measure from
+            cmd += ['--input', 'file:' + traffic, '--output', 'file:' + os.devnull]
+        elif transport == 'fifo':
+            paths = os.path.join(tmp, 'in.fifo'), os.path.join(tmp, 'out.fifo')
+            for path in paths:
+                os.mkfifo(path)
+            cmd += ['--input', 'fifo:' + paths[0], '--output', 'fifo:' + paths[1]]
+            threads = [threading.Thread(target=_feed_fifo, args=(probe, paths[0])),
+                       threading.Thread(target=_drain_fifo, args=(probe, paths[1]))]
+        elif transport == 'unix':
+            path = os.path.join(tmp, 'gor.sock')
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+            cmd += ['--input', 'unix:' + path, '--output', 'unix:' + path]
+            threads = [threading.Thread(target=_serve_unix, args=(probe, server))]
+        for thread in threads:
+            thread.start()
+        if proc is None:
+            subprocess.run(cmd, stdin=subprocess.DEVNULL, check=True)
+        for thread in threads:
+            thread.join()
+        if proc is not None and proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        elapsed = time.perf_counter() - started
+        if server is not None:
+            server.close()
+        with open(stats_file) as f:
+            stats = json.load(f)
+        with open(stats_file + '.rss') as f:
+            rss = json.load(f)
+    latency = probe.percentiles() if probe.sent else None
+    callbacks = [h for name, h in stats['histograms'].items() if name.startswith('callback.')]
+    count = sum(h['count'] for h in callbacks) or 1
+    return {
+        'impl': impl,
+        'transport': transport,
+        'msg_per_s': lines / elapsed,
+        # input to output time of every message, None without send times
+        'latency_p50_us': latency[0] if latency else None,
+        'latency_p99_us': latency[1] if latency else None,
+        # percentiles of the slowest callback channel
+        'callback_p50_us': max(h['p50_us'] for h in callbacks) if callbacks else 0.0,
+        'callback_p99_us': max(h['p99_us'] for h in callbacks) if callbacks else 0.0,
+        'callback_mean_us': sum(h['total'] for h in callbacks) / count * 1e6,
+        'parse_p99_us': stats['histograms'].get('parse', {}).get('p99_us', 0.0),
+        'peak_rss_mb': max(rss['self'], rss['children']) / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=20000, help='number of requests')
+    parser.add_argument('--body-size', type=int, default=1024)
+    parser.add_argument('--gzip-ratio', type=float, default=0.2)
+    parser.add_argument('--chunked-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--impl', action='append', choices=IMPLEMENTATIONS)
+    parser.add_argument('--transport', action='append', choices=TRANSPORTS)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--stats-file', help=argparse.SUPPRESS)
+    parser.add_argument('--input', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run_middleware(args.run, args.stats_file, args.concurrency, args.input, args.output)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        traffic = os.path.join(tmp, 'traffic.gor')
+        lines = write_traffic(traffic, args.count, body_size=args.body_size, gzip_ratio=args.gzip_ratio,
+                              chunked_ratio=args.chunked_ratio, seed=args.seed)
+        results = [bench(impl, traffic, lines, args.concurrency, transport)
+                   for transport in args.transport or ('stdio',)
+                   for impl in args.impl or IMPLEMENTATIONS]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('%d messages, body size %d' % (lines, args.body_size))
+    print('%-16s %-9s %12s %14s %14s %14s %12s' % (
+        'impl', 'transport', 'msg/s', 'p50(us)', 'p99(us)', 'cb p99(us)', 'rss(MB)'))
+    for r in results:
+        latency = ['%14.0f' % v if v is not None else '%14s' % '-'
+                   for v in (r['latency_p50_us'], r['latency_p99_us'])]
+        print('%-16s %-9s %12.0f %s %s %14.0f %12.1f' % (
+            r['impl'], r['transport'], r['msg_per_s'], latency[0], latency[1], r['callback_p99_us'],
+            r['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Generate a synthetic GoReplay hex stream: every request is followed by its
+response and replay, response bodies are optionally gzipped and/or sent
+with chunked transfer encoding.
+
+    python benchmarks/traffic.py --count 10000 --body-size 1024 > traffic.gor
+"""
+
+import sys
+import gzip
+import random
+import argparse
+import binascii
+
+
+PATHS = (b'/api/v1/users', b'/api/v1/orders?page=2', b'/static/app.js', b'/search?q=gor&lang=en')
+
+
+def chunked(body: bytes, size: int = 4096) -> bytes:
+    parts = []
+    for i in range(0, len(body), size):
+        part = body[i:i + size]
+        parts.append(b'%x\r\n%s\r\n' % (len(part), part))
+    parts.append(b'0\r\n\r\n')
+    return b''.join(parts)
+
+
+def build_request(rnd: random.Random, body_size: int) -> bytes:
+    path = rnd.choice(PATHS)
+    headers = [
+        b'Host: example.com',
+        b'User-Agent: gor-bench/1.0',
+        b'Accept: */*',
+        b'Cookie: session=%016x; theme=dark' % rnd.getrandbits(64),
+    ]
+    if rnd.random() < 0.3:
+        body = b'{"data": "%s"}' % (b'x' * max(0, body_size - 12))
+        headers.append(b'Content-Type: application/json')
+        headers.append(b'Content-Length: %d' % len(body))
+        return b'POST %s HTTP/1.1\r\n%s\r\n\r\n%s' % (path, b'\r\n'.join(headers), body)
+    return b'GET %s HTTP/1.1\r\n%s\r\n\r\n' % (path, b'\r\n'.join(headers))
+
+
+def build_response(rnd: random.Random, body_size: int, gzip_ratio: float, chunked_ratio: float) -> bytes:
+    body = b'{"items": [%s]}' % b', '.join(b'%d' % rnd.randint(0, 10 ** 6) for _ in range(max(1, body_size // 8)))
+    body = body[:body_size] if len(body) > body_size else body
+    headers = [b'Content-Type: application/json', b'Server: bench']
+    if rnd.random() < gzip_ratio:
+        body = gzip.compress(body, compresslevel=1)
+        headers.append(b'Content-Encoding: gzip')
+        # compressed bodies are always streamed, as most servers do
+        headers.append(b'Transfer-Encoding: chunked')
+        body = chunked(body)
+    elif rnd.random() < chunked_ratio:
+        headers.append(b'Transfer-Encoding: chunked')
+        body = chunked(body)
+    else:
+        headers.append(b'Content-Length: %d' % len(body))
+    status = b'200 OK' if rnd.random() < 0.95 else b'404 Not Found'
+    return b'HTTP/1.1 %s\r\n%s\r\n\r\n%s' % (status, b'\r\n'.join(headers), body)
+
+
+def generate(count: int, body_size: int = 1024, gzip_ratio: float = 0.2,
+             chunked_ratio: float = 0.2, seed: int = 0):
+    """
+    :return: an iterator over hex encoded lines, `count` requests each
+        followed by its response and replay
+    """
+    rnd = random.Random(seed)
+    timestamp = 1600000000000000000
+    for i in range(count):
+        _id = b'%024x' % rnd.getrandbits(96)
+        request = build_request(rnd, body_size)
+        response = build_response(rnd, body_size, gzip_ratio, chunked_ratio)
+        timestamp += rnd.randint(10 ** 5, 10 ** 7)
+        for _type, http, latency in ((b'1', request, 0),
+                                     (b'2', response, rnd.randint(10 ** 5, 10 ** 8)),
+                                     (b'3', response, rnd.randint(10 ** 5, 10 ** 8))):
+            payload = b'%s %s %d %d\n%s' % (_type, _id, timestamp, latency, http)
+            yield binascii.hexlify(payload) + b'\n'
+
+
+def write_traffic(path: str, *args, **kwargs) -> int:
+    """
+    Write a generated stream to `path`
+    :return: number of lines written
+    """
+    lines = 0
+    with open(path, 'wb') as f:
+        for line in generate(*args, **kwargs):
+            f.write(line)
+            lines += 1
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000, help='number of requests')
+    parser.add_argument('--body-size', type=int, default=1024)
+    parser.add_argument('--gzip-ratio', type=float, default=0.2)
+    parser.add_argument('--chunked-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args()
+    kwargs = dict(body_size=args.body_size, gzip_ratio=args.gzip_ratio,
+                  chunked_ratio=args.chunked_ratio, seed=args.seed)
+    if args.output == '-':
+        out = sys.stdout.buffer
+        for line in generate(args.count, **kwargs):
+            out.write(line)
+    else:
+        write_traffic(args.output, args.count, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,202 @@
 # coding: utf-8
 
+import io
+import os
 import sys
+import stat
+import time
 import logging
 import asyncio
 
 from .base import Gor
+from .codec import split_lines
+from .overflow import DROP_NEWEST, DROP_OLDEST
 from .callback import SimpleCallbackContainer
 
 
+class _ExecutorReader(object):
+    """
+    Fallback reader for stdin objects which can't be attached to the event
+    loop as a pipe, e.g. regular files or in-memory streams. Each read runs in
+    the default executor so the loop is never blocked.
+    """
+
+    def __init__(self, stream, loop):
+        self.stream = getattr(stream, 'buffer', stream)
+        self.loop = loop
+
+    async def read(self, n: int) -> bytes:
+        data = await self.loop.run_in_executor(None, self.stream.read, n)
+        if isinstance(data, str):
+            data = data.encode()
+        return data
+
+
 class AsyncioGor(Gor):
 
     def __init__(self, *args, **kwargs):
-        chan_container = SimpleCallbackContainer()
+        chan_container = SimpleCallbackContainer(**kwargs)
         super(AsyncioGor, self).__init__(chan_container, *args, **kwargs)
         self.q = asyncio.Queue()
         self.concurrency = kwargs.get('concurrency', 2)
+        self.max_inflight = kwargs.get('max_inflight', 64)
         self.tasks = []
         self.queues = []
+        self._flush_handle = None
+        self._expire_handle = None
+        self._error = None
 
     async def _worker(self, queue):
+        inflight = asyncio.Semaphore(self.max_inflight)
+        # message id -> task processing the latest message with that id
+        tails = {}
         while True:
-            try:
-                msg = await queue.get()
-                self.emit(msg)
-            finally:
-                queue.task_done()
+            msg = await queue.get()
+            if not tails and not self.chan_container.has_coroutines:
+                raw_line = msg.raw_line
+                payload = msg.payload_view if raw_line is None else None
+                try:
+                    self.emit(msg)
+                except Exception:
+                    self._callback_error(raw_line, payload)
+                finally:
+                    queue.task_done()
+                self._schedule_flush()
+                continue
+            await inflight.acquire()
+            task = self.io_loop.create_task(
+                self._process(msg, tails.get(msg.id), inflight, queue))
+            tails[msg.id] = task
+            task.add_done_callback(
+                lambda t, idx=msg.id: tails.pop(idx) if tails.get(idx) is t else None)
 
-    async def _stdin_reader(self):
-        while True:
-            try:
+    async def _process(self, msg, prev, inflight, queue):
+        raw_line = msg.raw_line
+        payload = msg.payload_view if raw_line is None else None
+        try:
+            if prev is not None:
+                # messages sharing an id are processed in order
+                await asyncio.wait([prev])
+            await self.emit_async(msg)
+        except Exception:
+            self._callback_error(raw_line, payload)
+        finally:
+            inflight.release()
+            queue.task_done()
+        self._schedule_flush()
+
+    def _passthrough(self, msg):
+        super(AsyncioGor, self)._passthrough(msg)
+        self._schedule_flush()
+
+    def _passthrough_line(self, line: bytes):
+        super(AsyncioGor, self)._passthrough_line(line)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is None and self.writer.pending:
+            self._flush_handle = self.io_loop.call_later(self.writer.timeout(), self._flush_output)
+
+    def _flush_output(self):
+        self._flush_handle = None
+        self.writer.flush_if_due()
+        self._schedule_flush()
+
+    def _expire_timer(self):
+        self.expire()
+        self._expire_handle = self.io_loop.call_later(self.expire_interval, self._expire_timer)
+
+    async def _open_stdin(self):
+        stream = self.input if self.input is not None else sys.stdin
+        try:
+            mode = os.fstat(stream.fileno()).st_mode
+            if not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or stat.S_ISCHR(mode)):
+                return _ExecutorReader(stream, self.io_loop)
+            reader = asyncio.StreamReader(limit=self.read_size)
+            protocol = asyncio.StreamReaderProtocol(reader)
+            await self.io_loop.connect_read_pipe(lambda: protocol, stream)
+            return reader
+        except (AttributeError, ValueError, OSError, NotImplementedError, io.UnsupportedOperation):
+            # the input is not a pipe, socket or character device
+            return _ExecutorReader(stream, self.io_loop)
+
+    async def _read_payloads(self, read_payloads):
+        try:
+            while True:
+                batch = await self.io_loop.run_in_executor(None, read_payloads)
+                if not batch:
+                    return
+                yield batch
+                await asyncio.sleep(0)
+        finally:
+            self._close_recorder()
+
+    async def _read_chunks(self, reader):
+        read_payloads = getattr(self.input, 'read_payloads', None)
+        if read_payloads is not None:
+            # decoded payloads, e.g. from a capture stream
+            async for batch in self._read_payloads(read_payloads):
+                yield batch
+            return
+        pending = b''
+        try:
+            while True:
+                if self.stats is not None:
+                    started = time.perf_counter()
+                    chunk = await reader.read(self.read_size)
+                    self.stats.observe('read', time.perf_counter() - started)
+                else:
+                    chunk = await reader.read(self.read_size)
+                if not chunk:
+                    if pending.strip():
+                        yield pending
+                    return
+                lines, pending = split_lines(pending, chunk)
+                if lines:
+                    yield lines
+                # give worker coroutines a chance to run between chunks
                 await asyncio.sleep(0)
-                line = sys.stdin.readline()
-            except KeyboardInterrupt:
-                await self._wait_task_queues()
-                self._stop()
-                break
-            if not line:
-                await self._wait_task_queues()
-                self._stop()
-                break
-            msg = self.parse_message(line)
-            h = hash(msg.id) % len(self.queues)
-            await self.queues[h].put(msg)
+        finally:
+            self._close_recorder()
+
+    async def _stdin_reader(self):
+        try:
+            reader = await self._open_stdin()
+            async for chunk in self._read_chunks(reader):
+                for msg in self.filter_messages(self.sample_messages(chunk)):
+                    queue = self.queues[hash(msg.id) % len(self.queues)]
+                    if queue.full():
+                        action = self.overflow.on_full()
+                        if action == DROP_NEWEST:
+                            continue
+                        if action == DROP_OLDEST:
+                            queue.get_nowait()
+                            queue.task_done()
+                            queue.put_nowait(msg)
+                            continue
+                    await queue.put(msg)
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            # stop the loop and have `run` raise it, instead of hanging
+            self._error = e
+            self._stop()
+            return
+        await self._wait_task_queues()
+        self._stop()
 
     async def _run(self):
-        for _ in range(self.concurrency):
-            q = asyncio.Queue()
+        for i in range(self.concurrency):
+            q = asyncio.Queue(self.queue_size)
             self.queues.append(q)
             t = self.io_loop.create_task(self._worker(q))
             self.tasks.append(t)
+            if self.stats is not None:
+                self.stats.gauge('queue.%d' % i, q.qsize)
+        if self.stats_reporter is not None:
+            self.stats_reporter.start()
+        if self._needs_expiry():
+            self._expire_handle = self.io_loop.call_later(self.expire_interval, self._expire_timer)
 
         stdin_reader_task = self.io_loop.create_task(self._stdin_reader())
         self.tasks.append(stdin_reader_task)
@@ -58,14 +206,33 @@ class AsyncioGor(Gor):
             await queue.join()
 
     def _stop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+            self._expire_handle = None
+        self._close_correlations()
+        self.writer.flush()
+        self._close_output()
+        if self.stats_reporter is not None:
+            self.stats_reporter.stop()
         for t in self.tasks:
             t.cancel()
-        self.io_loop.stop()
+        # let the cancellations be delivered before the loop stops
+        self.io_loop.call_soon(self.io_loop.stop)
 
     def _set_event_loop(self):
         if sys.version_info.major == 3 and sys.version_info.minor < 10:
             # less than 3.10.0
-            self.io_loop = asyncio.get_event_loop()
+            try:
+                self.io_loop = asyncio.get_event_loop()
+            except RuntimeError:
+                # no loop set yet in a thread other than the main one
+                self.io_loop = None
+            if self.io_loop is None or self.io_loop.is_closed():
+                self.io_loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.io_loop)
         else:
             # equal or greater than 3.10.0
             try:
@@ -81,3 +248,5 @@ class AsyncioGor(Gor):
             self.io_loop.run_forever()
         except Exception:
             logging.error("exception in run_sync", exc_info=True)
+        if self._error is not None:
+            raise self._error
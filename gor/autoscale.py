@@ -0,0 +1,168 @@
+# coding: utf-8
+
+import time
+import bisect
+import hashlib
+from collections import OrderedDict
+
+
+# types a message id goes through before its worker is released
+ALL_TYPES = frozenset('123')
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=4).digest(), 'little')
+
+
+class HashRing(object):
+    """
+    Consistent hash ring of worker slots, adding or removing a slot only
+    moves the ids of about one slot in ``len(ring)``
+    """
+
+    def __init__(self, nodes=(), replicas: int = 64):
+        self.replicas = replicas
+        self.points = []
+        self.nodes = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: int):
+        for i in range(self.replicas):
+            point = _point('%d-%d' % (node, i))
+            pos = bisect.bisect(self.points, point)
+            self.points.insert(pos, point)
+            self.nodes.insert(pos, node)
+
+    def remove(self, node: int):
+        keep = [(p, n) for p, n in zip(self.points, self.nodes) if n != node]
+        self.points = [p for p, _ in keep]
+        self.nodes = [n for _, n in keep]
+
+    def get(self, key: int) -> int:
+        """
+        :param key: a 32 bits hash of the message id
+        """
+        pos = bisect.bisect(self.points, key)
+        return self.nodes[pos if pos < len(self.nodes) else 0]
+
+    def __contains__(self, node: int):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(set(self.nodes))
+
+
+class StickyRouter(object):
+    """
+    Route message ids to worker slots through a `HashRing`, pinning each id
+    to its first slot until its request, response and replay went through,
+    or it was not seen for `ttl` seconds, so resizing the ring never splits
+    the messages of an id across workers
+    """
+
+    def __init__(self, ring: HashRing, ttl: float = 60, max_ids: int = 100000):
+        self.ring = ring
+        self.ttl = ttl
+        self.max_ids = max_ids
+        # id -> [slot, last seen, types seen]
+        self.ids = OrderedDict()
+        self.pins = {}
+        self.now = time.monotonic()
+
+    def route(self, _id: str, _type: str) -> int:
+        entry = self.ids.get(_id)
+        if entry is None:
+            slot = self.ring.get(hash(_id) & 0xFFFFFFFF)
+            entry = self.ids[_id] = [slot, self.now, {_type}]
+            self.pins[slot] = self.pins.get(slot, 0) + 1
+            if len(self.ids) > self.max_ids:
+                self._unpin(self.ids.popitem(last=False)[1])
+            return slot
+        self.ids.move_to_end(_id)
+        entry[1] = self.now
+        entry[2].add(_type)
+        if entry[2] >= ALL_TYPES:
+            self._unpin(self.ids.pop(_id))
+        return entry[0]
+
+    def _unpin(self, entry):
+        self.pins[entry[0]] -= 1
+
+    def tick(self, now: float = None):
+        """
+        Set the current time and release the ids not seen for `ttl` seconds
+        """
+        self.now = time.monotonic() if now is None else now
+        deadline = self.now - self.ttl
+        ids = self.ids
+        while ids:
+            entry = next(iter(ids.values()))
+            if entry[1] > deadline:
+                break
+            ids.popitem(last=False)
+            self._unpin(entry)
+
+    def pinned(self, slot: int) -> int:
+        """
+        :return: the number of ids pinned to `slot`
+        """
+        return self.pins.get(slot, 0)
+
+
+class Autoscaler(object):
+    """
+    Decide when `MultiProcessGor` adds or retires a worker, from the mean
+    depth of the worker queues and the latency of messages through workers.
+
+    :param min_workers: workers kept at the lowest load
+    :param max_workers: workers started at most
+    :param interval: seconds between two decisions
+    :param cooldown: seconds to wait after resizing before the next resize
+    :param up_depth: queue depth, in messages, above which a worker is added
+    :param down_depth: queue depth below which a worker is retired
+    :param up_latency: latency, in seconds, above which a worker is added
+    :param down_latency: latency below which a worker may be retired
+    :param sticky_ttl: seconds an id stays pinned to its worker without
+        all its messages seen
+    :param max_ids: ids pinned at most
+    """
+
+    def __init__(self, min_workers: int = 1, max_workers: int = 8, interval: float = 5, cooldown: float = 30,
+                 up_depth: int = 1000, down_depth: int = 10, up_latency: float = None,
+                 down_latency: float = None, sticky_ttl: float = 60, max_ids: int = 100000):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError('expected 1 <= min_workers <= max_workers')
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.cooldown = cooldown
+        self.up_depth = up_depth
+        self.down_depth = down_depth
+        self.up_latency = up_latency
+        self.down_latency = down_latency
+        self.sticky_ttl = sticky_ttl
+        self.max_ids = max_ids
+        self.last_resize = None
+
+    def decide(self, workers: int, depth: float, latency: float = None, now: float = None) -> int:
+        """
+        :param workers: number of active workers
+        :param depth: mean number of messages waiting in their queues
+        :param latency: recent time through a worker, None if not measured
+        :return: 1 to add a worker, -1 to retire one, 0 to keep the pool
+        """
+        now = time.monotonic() if now is None else now
+        if self.last_resize is not None and now - self.last_resize < self.cooldown:
+            return 0
+        busy = depth >= self.up_depth or (
+            self.up_latency is not None and latency is not None and latency >= self.up_latency)
+        idle = depth <= self.down_depth and (
+            self.down_latency is None or latency is None or latency <= self.down_latency)
+        if busy and workers < self.max_workers:
+            self.last_resize = now
+            return 1
+        if idle and not busy and workers > self.min_workers:
+            self.last_resize = now
+            return -1
+        return 0
@@ -1,44 +1,276 @@
 # coding: utf-8
 
-import re
 import sys
-import gzip
+import time
+import logging
 import binascii
 import datetime
+import operator
+import itertools
 import traceback
-from urllib.parse import quote_plus, urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs
 from typing import Dict
 
+from .body import BODY_CHUNK_SIZE, iter_body, iter_chunked
+from .codec import decode_lines, split_lines
+from .capture import CaptureWriter
+from .compare import Comparator
+from .correlation import CorrelationStore
+from .rules import RuleSet, PASS
+from .sampling import Sampler
+from .overflow import OverflowPolicy
+from .stats import Stats, StatsReporter
+from .transport import open_input, open_output
+from .writer import BatchWriter
+from .http_message import HeaderIndex, set_query_param
+
+
+READ_SIZE = 256 * 1024
+
+
+def gor_hex_bytes(data) -> bytes:
+    return binascii.hexlify(data.payload) + b'\n'
+
 
 def gor_hex_data(data):
-    data = b''.join(
-        map(lambda x: binascii.hexlify(x)
-            if isinstance(x, bytes) else binascii.hexlify(x.encode()),
-            [data.raw_meta, '\n', data.http])) + b'\n'
-    return data.decode('utf-8')
+    return gor_hex_bytes(data).decode('utf-8')
 
 
 def decode_chunked(chunked_data: bytes) -> bytes:
-    result = b''
-    while chunked_data != b'':
-        chunked_size_sep = chunked_data.index(b"\r\n")
-        offset = int(chunked_data[:chunked_size_sep], 16)
-        if offset == 0:
-            break
-        chunked_data = chunked_data[chunked_size_sep + 2:]
-        result += chunked_data[:offset]
-        chunked_data = chunked_data[offset+2:]
-    return result
+    return b''.join(iter_chunked(chunked_data))
 
 
 class GorMessage(object):
+    """
+    A GoReplay message backed by one decoded ``meta\\nhttp`` buffer. The meta
+    line, the HTTP start line and the header/body offsets are parsed lazily on
+    first access and cached, accessors never copy the payload more than once.
+
+    `raw_line` keeps the hex encoded input line the message was parsed from,
+    if any, so it can be written back as is. Replacing `http` or `raw_meta`
+    drops it, a message still holding its `raw_line` is unmodified.
+
+    Messages parsed from one input chunk share its decoded buffer and
+    `raw_line` is a view on the chunk itself, so a message kept after its
+    callbacks returned keeps the whole chunk alive; `detach` copies its own
+    bytes out.
+    """
+
+    __slots__ = ('raw_line', '_buf', '_start', '_hstart', '_end', '_lazy_meta',
+                 '_id', '_type', '_meta', '_raw_meta', '_http',
+                 '_line_end', '_head_end', '_first_line', '_headers')
 
     def __init__(self, _id, _type, meta, raw_meta, http):
-        self.id = _id
-        self.type = _type
-        self.meta = meta
-        self.raw_meta = raw_meta
-        self.http = http
+        self._id = _id
+        self._type = _type
+        self._meta = meta
+        self._raw_meta = raw_meta
+        self._lazy_meta = False
+        self.raw_line = None
+        self._set_http(http)
+
+    @classmethod
+    def from_payload(cls, buf: bytes, start: int = 0, end: int = None) -> 'GorMessage':
+        """
+        Build a message on top of ``buf[start:end]`` without copying it
+        """
+        if end is None:
+            end = len(buf)
+        meta_end = buf.index(b'\n', start, end)
+        # make sure the meta line carries at least a type and an id
+        buf.index(b' ', start, meta_end)
+        msg = cls.__new__(cls)
+        msg._buf = buf
+        msg._start = start
+        msg._hstart = meta_end + 1
+        msg._end = end
+        msg._lazy_meta = True
+        msg.raw_line = None
+        msg._id = msg._type = msg._meta = msg._raw_meta = msg._http = None
+        msg._line_end = msg._head_end = msg._first_line = msg._headers = None
+        return msg
+
+    def __reduce__(self):
+        return GorMessage.from_payload, (self.payload,)
+
+    def detach(self) -> 'GorMessage':
+        """
+        Copy the payload and `raw_line` out of the input chunk they share
+        with the other messages of that chunk
+        :return: the message itself
+        """
+        if self.raw_line is not None and not isinstance(self.raw_line, bytes):
+            self.raw_line = bytes(self.raw_line)
+        start = self._start
+        if start or self._end != len(self._buf):
+            self._buf = self._buf[start:self._end]
+            self._start = 0
+            self._hstart -= start
+            self._end -= start
+            if self._line_end is not None:
+                self._line_end -= start
+                if self._head_end != -1:
+                    self._head_end -= start
+        return self
+
+    def _parse_meta(self):
+        raw_meta = self._buf[self._start:self._hstart - 1].decode()
+        meta = raw_meta.split(' ')
+        self._raw_meta = raw_meta
+        self._meta = meta
+        self._type, self._id = meta[0], meta[1]
+        self._lazy_meta = False
+
+    def _set_http(self, http: bytes):
+        self._http = http
+        self._buf = http
+        self._start = self._hstart = 0
+        self._end = len(http) if http is not None else 0
+        self._line_end = self._head_end = self._first_line = self._headers = None
+
+    @property
+    def id(self) -> str:
+        if self._lazy_meta:
+            self._parse_meta()
+        return self._id
+
+    @id.setter
+    def id(self, value: str):
+        if self._lazy_meta:
+            self._parse_meta()
+        self._id = value
+
+    @property
+    def type(self) -> str:
+        if self._lazy_meta:
+            self._parse_meta()
+        return self._type
+
+    @type.setter
+    def type(self, value: str):
+        if self._lazy_meta:
+            self._parse_meta()
+        self._type = value
+
+    @property
+    def meta(self):
+        if self._lazy_meta:
+            self._parse_meta()
+        return self._meta
+
+    @meta.setter
+    def meta(self, value):
+        if self._lazy_meta:
+            self._parse_meta()
+        self._meta = value
+
+    @property
+    def raw_meta(self) -> str:
+        if self._lazy_meta:
+            self._parse_meta()
+        return self._raw_meta
+
+    @raw_meta.setter
+    def raw_meta(self, value: str):
+        if self._lazy_meta:
+            self._parse_meta()
+        self._raw_meta = value
+        # the buffer no longer covers the meta line, only the http part
+        self._start = self._hstart
+        self.raw_line = None
+
+    @property
+    def http(self) -> bytes:
+        if self._http is None:
+            self._http = self._buf[self._hstart:self._end]
+        return self._http
+
+    @http.setter
+    def http(self, value: bytes):
+        if self._lazy_meta:
+            self._parse_meta()
+        self._set_http(value)
+        self.raw_line = None
+
+    @property
+    def payload(self) -> bytes:
+        """
+        The decoded ``meta\\nhttp`` bytes, shared with the input buffer when
+        neither meta nor http has been replaced
+        """
+        if self._start < self._hstart:
+            return self._buf[self._start:self._end]
+        raw_meta = self.raw_meta
+        if not isinstance(raw_meta, bytes):
+            raw_meta = raw_meta.encode()
+        return raw_meta + b'\n' + self.http
+
+    @property
+    def payload_view(self) -> memoryview:
+        """
+        Same as `payload`, without copying out of a shared input buffer
+        """
+        if self._start < self._hstart:
+            return memoryview(self._buf)[self._start:self._end]
+        return memoryview(self.payload)
+
+    def _parse_head(self):
+        buf, hstart, end = self._buf, self._hstart, self._end
+        line_end = buf.find(b'\r\n', hstart, end)
+        if line_end == -1:
+            line_end = end
+        self._line_end = line_end
+        self._head_end = buf.find(b'\r\n\r\n', hstart, end)
+
+    def _parse_first_line(self):
+        if self._line_end is None:
+            self._parse_head()
+        parts = self._buf[self._hstart:self._line_end].split(b' ', 2)
+        self._first_line = [p.decode() for p in parts] + [''] * (3 - len(parts))
+
+    @property
+    def http_method(self) -> str:
+        if self._first_line is None:
+            self._parse_first_line()
+        return self._first_line[0]
+
+    @property
+    def http_path(self) -> str:
+        if self._first_line is None:
+            self._parse_first_line()
+        return self._first_line[1]
+
+    @property
+    def http_status(self) -> str:
+        """
+        HTTP response have status code in same position as `path` for requests
+        """
+        return self.http_path
+
+    @property
+    def headers(self) -> HeaderIndex:
+        """
+        Case-insensitive header index of the http payload, built once
+        """
+        if self._headers is None:
+            self._headers = HeaderIndex(self.http)
+        return self._headers
+
+    @property
+    def http_body_view(self) -> memoryview:
+        if self._line_end is None:
+            self._parse_head()
+        if self._head_end == -1:
+            return memoryview(b'')
+        return memoryview(self._buf)[self._head_end + 4:self._end]
+
+    @property
+    def http_body(self) -> bytes:
+        if self._line_end is None:
+            self._parse_head()
+        if self._head_end == -1:
+            return b''
+        return self._buf[self._head_end + 4:self._end]
 
 
 class Gor(object):
@@ -46,46 +278,370 @@ class Gor(object):
     def __init__(self, chan_container, *args, **kwargs):
         self.stderr = sys.stderr
         self.chan_container = chan_container
+        self._last_headers = None
+        self.read_size = kwargs.get('read_size', READ_SIZE)
+        output = kwargs.get('output')
+        # an output opened from a `gor.transport` spec is closed once done
+        self._transport_output = None
+        # socket connections of this middleware, by path, shared by its
+        # input and output
+        self._sockets = {}
+        if isinstance(output, str):
+            output = self._transport_output = open_output(output, self._sockets)
+        self.writer = BatchWriter(
+            stream=output,
+            batch_size=kwargs.get('output_batch_size', 64),
+            max_latency_us=kwargs.get('output_max_latency_us', 1000))
+        self.stats = None
+        self.stats_reporter = None
+        if kwargs.get('stats_interval'):
+            self.stats = Stats()
+            self.stats_reporter = StatsReporter(self.stats, kwargs['stats_interval'], kwargs.get('stats_file'))
+        self.chan_container.stats = self.stats
+        rules = kwargs.get('rules')
+        if isinstance(rules, str):
+            rules = RuleSet.load(rules)
+        elif rules is not None and not isinstance(rules, RuleSet):
+            rules = RuleSet(rules)
+        self.rules = rules
+        comparator = kwargs.get('compare')
+        if isinstance(comparator, dict):
+            comparator = Comparator(**comparator)
+        self.comparator = comparator
+        if comparator is not None:
+            comparator.stats = self.stats
+        self.correlations = []
+        sampler = kwargs.get('sampling')
+        if isinstance(sampler, dict):
+            sampler = Sampler(**sampler)
+        self.sampler = sampler
+        if sampler is not None:
+            sampler.stats = self.stats
+        # binary stream read instead of stdin, e.g. a `gor.capture.CaptureStream`,
+        # or a `gor.transport` spec such as ``unix:/path``
+        self.input = kwargs.get('input')
+        if isinstance(self.input, str):
+            self.input = open_input(self.input, self.read_size, self._sockets)
+        self.recorder = CaptureWriter(kwargs['record']) if kwargs.get('record') else None
+        # bound of each worker queue, in messages, 0 for unbounded
+        self.queue_size = kwargs.get('queue_size', 10000)
+        self.overflow = OverflowPolicy(kwargs.get('overflow', 'block'), kwargs.get('overflow_sample', 10))
+        self.overflow.stats = self.stats
+        # seconds between two runs of `expire` by the engines
+        self.expire_interval = kwargs.get('expire_interval', 1.0)
 
     def run(self):
         raise NotImplementedError
 
-    def on(self, chan, callback, idx=None, **kwargs):
+    def _read_chunks(self):
+        """
+        Read the input, stdin by default, in chunks of up to `read_size` bytes
+        :return: an iterator over runs of complete hex lines, or over
+            ``(buffer, offsets)`` batches of decoded payloads for an input
+            with a ``read_payloads`` method such as a capture stream
+        """
+        stream = self.input if self.input is not None else sys.stdin
+        stream = getattr(stream, 'buffer', stream)
+        if hasattr(stream, 'read_payloads'):
+            return self._read_payloads(stream.read_payloads)
+        return self._read_lines(getattr(stream, 'read1', stream.read))
+
+    def _read_payloads(self, read_payloads):
+        try:
+            while True:
+                batch = read_payloads()
+                if not batch:
+                    return
+                yield batch
+        finally:
+            self._close_recorder()
+
+    def _read_lines(self, read):
+        pending = b''
+        try:
+            while True:
+                if self.stats is not None:
+                    started = time.perf_counter()
+                    chunk = read(self.read_size)
+                    self.stats.observe('read', time.perf_counter() - started)
+                else:
+                    chunk = read(self.read_size)
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if not chunk:
+                    if pending.strip():
+                        yield pending
+                    return
+                lines, pending = split_lines(pending, chunk)
+                if lines:
+                    yield lines
+        finally:
+            self._close_recorder()
+
+    def _close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _close_output(self):
+        """
+        Close the output transport after the last flush, letting a reader on
+        the other end of a socket or named pipe see the end of the stream
+        """
+        if self._transport_output is not None:
+            self._transport_output.close()
+
+    def on(self, chan, callback, idx=None, once=False, **kwargs):
+        """
+        Register `callback` on `chan`, or on the `chan` of message `idx` only
+        :param once: remove the callback after it fired once
+        """
+        if idx is not None:
+            chan = chan + '#' + idx
+
+        self.chan_container.add(chan, callback, once=once, **kwargs)
+        return self
+
+    def off(self, chan, idx=None):
         if idx is not None:
             chan = chan + '#' + idx
 
-        self.chan_container.add(chan, callback, **kwargs)
+        self.chan_container.remove(chan)
         return self
 
+    def _needs_expiry(self) -> bool:
+        return self.chan_container.ttl is not None or self.comparator is not None or bool(self.correlations)
+
+    def expire(self, now: float = None):
+        """
+        Evict the per-id channels past `channel_ttl` and fire the correlation
+        entries past their `ttl`, run every `expire_interval` seconds by the
+        engines so they go even when no message arrives any more
+        """
+        self.chan_container.expire(now)
+        if self.comparator is not None:
+            self.comparator.store.expire(now)
+        for store in self.correlations:
+            store.expire(now)
+
+    def correlate(self, callback, **kwargs) -> CorrelationStore:
+        """
+        Call ``callback(proxy, correlation)`` once the request, response and
+        replay of a message id have all arrived, see `CorrelationStore` for
+        the options
+        """
+        store = CorrelationStore(callback, **kwargs)
+        store.gor = self
+        store.stats = self.stats
+        self.correlations.append(store)
+        return store
+
+    def _correlate(self, msg):
+        if self.comparator is not None:
+            self.comparator.add(msg)
+        for store in self.correlations:
+            store.add(msg)
+
+    def _close_correlations(self):
+        """
+        Fire the entries still waiting for parts, at shutdown
+        """
+        if self.comparator is not None:
+            self.comparator.store.close()
+        for store in self.correlations:
+            store.close()
+
     def emit(self, msg):
-        chan_prefix_map = {
-            '1': 'request',
-            '2': 'response',
-            '3': 'replay',
-        }
-        chan_prefix = chan_prefix_map[msg.type]
-        resp = msg
-        for chan_id in ['message', chan_prefix, chan_prefix + '#' + msg.id]:
-            r = self.chan_container.do_callback(self, chan_id, msg)
-            if r:
-                resp = r
-        if resp:
-            sys.stdout.write(gor_hex_data(resp))
-            sys.stdout.flush()
-
-    def parse_message(self, line: bytes) -> bytes:
+        if self.comparator is not None or self.correlations:
+            self._correlate(msg)
+        handled, resp = self.chan_container.dispatch(self, msg)
+        if self.stats is not None:
+            started = time.perf_counter()
+            self._output(msg, handled, resp)
+            self.stats.observe('output', time.perf_counter() - started)
+        else:
+            self._output(msg, handled, resp)
+
+    async def emit_async(self, msg):
+        """
+        Same as `emit`, awaiting coroutine callbacks
+        """
+        if self.comparator is not None or self.correlations:
+            self._correlate(msg)
+        handled, resp = await self.chan_container.dispatch_async(self, msg)
+        if self.stats is not None:
+            started = time.perf_counter()
+            self._output(msg, handled, resp)
+            self.stats.observe('output', time.perf_counter() - started)
+        else:
+            self._output(msg, handled, resp)
+
+    def _callback_error(self, raw_line, payload):
+        """
+        Log the exception raised by a callback of a message and write the
+        message out as it came in, the policy of every engine
+        :param raw_line: the input line of the message, taken before its
+            callbacks ran, None if it was not parsed from a hex line
+        :param payload: the decoded payload of the message, taken before its
+            callbacks ran, used when `raw_line` is None
+        """
+        logging.error("exception in callback", exc_info=True)
+        if self.stats is not None:
+            self.stats.incr('errors.callback')
+        if raw_line is not None:
+            self._passthrough_line(raw_line)
+        else:
+            self.writer.write_payload(payload)
+
+    def _output(self, msg, handled, resp):
+        if not handled:
+            resp = msg
+        if not resp:
+            return
+        if resp.raw_line is not None:
+            # no callback modified the message, pass the input line through
+            self.writer.write(resp.raw_line, b'\n')
+        else:
+            self.writer.write_payload(resp.payload)
+
+    def parse_message(self, line: bytes) -> GorMessage:
         try:
-            payload = binascii.unhexlify(line.strip())
-            meta_pos = payload.index(b'\n')
-            meta = payload[:meta_pos].decode()
-            meta_arr = meta.split(' ')
-            p_type, p_id = meta_arr[0], meta_arr[1]
-            raw = payload[meta_pos+1:]
-            return GorMessage(p_id, p_type, meta_arr, meta, raw)
+            line = line.strip()
+            if not isinstance(line, bytes):
+                line = line.encode()
+            msg = GorMessage.from_payload(binascii.unhexlify(line))
+            # decode the meta line here, where a bad one is reported
+            msg._parse_meta()
+            msg.raw_line = line
+            return msg
         except Exception as e:
             self.stderr.write('Error while parsing incoming request: "%s" %s' % (line, e))
             traceback.print_exc(file=sys.stderr)
 
+    def parse_messages(self, chunk: bytes):
+        """
+        Parse a chunk of complete hex lines, decoding them in one step, or a
+        ``(buffer, offsets)`` batch of decoded payloads
+        :return: a list of the parsed messages
+        """
+        if self.stats is None:
+            messages = self._parse_chunk(chunk)
+        else:
+            started = time.perf_counter()
+            messages = self._parse_chunk(chunk)
+            self.stats.observe('parse', time.perf_counter() - started)
+            self.stats.incr('messages', len(messages))
+        if self.recorder is not None:
+            for msg in messages:
+                self.recorder.write(msg.payload_view)
+        return messages
+
+    def sample_messages(self, chunk: bytes):
+        """
+        Parse a chunk of complete hex lines, the lines left out by the
+        `sampling` stage are written out as they are, without being decoded
+        :return: an iterable of the parsed messages, in input order
+        """
+        if self.sampler is None:
+            return self.parse_messages(chunk)
+        return self._sample_messages(chunk)
+
+    def _sample_messages(self, chunk: bytes):
+        self.sampler.tick()
+        if isinstance(chunk, tuple):
+            buf, offsets = chunk
+            keep = self.sampler.keep_payload
+            items = ((keep(memoryview(buf)[start:end]), (start, end)) for start, end in offsets)
+            join = lambda run: (buf, run)
+        else:
+            keep = self.sampler.keep
+            items = ((keep(line), line) for line in map(bytes.strip, chunk.split(b'\n')) if line)
+            join = b'\n'.join
+        # runs of kept lines are dispatched in input order with the runs of
+        # lines left out
+        for kept, run in itertools.groupby(items, key=operator.itemgetter(0)):
+            run = [item for _, item in run]
+            if kept:
+                yield from self.parse_messages(join(run))
+            elif self.rules is not None:
+                # drop and rewrite rules apply to them all the same
+                for msg in self._filter_messages(self.parse_messages(join(run))):
+                    self._passthrough(msg)
+            elif isinstance(chunk, tuple):
+                for start, end in run:
+                    if self.recorder is not None:
+                        self.recorder.write(memoryview(buf)[start:end])
+                    self._passthrough(GorMessage.from_payload(buf, start, end))
+            else:
+                for line in run:
+                    if self.recorder is not None:
+                        self.recorder.write(binascii.unhexlify(line))
+                    self._passthrough_line(line)
+
+    def filter_messages(self, messages):
+        """
+        Apply the filter/rewrite `rules` to parsed messages, messages dropped
+        or passed through by a rule are consumed here
+        :return: an iterable of the messages to dispatch, in input order
+        """
+        if self.rules is None:
+            return messages
+        return self._filter_messages(messages)
+
+    def _filter_messages(self, messages):
+        apply = self.rules.apply
+        stats = self.stats
+        for msg in messages:
+            verdict = apply(msg)
+            if verdict is None:
+                yield msg
+                continue
+            if stats is not None:
+                stats.incr('rules.' + verdict)
+            if verdict == PASS:
+                self._passthrough(msg)
+
+    def _passthrough(self, msg):
+        """
+        Output `msg` without dispatching it
+        """
+        if msg.raw_line is not None:
+            self._passthrough_line(msg.raw_line)
+        else:
+            self.writer.write_payload(msg.payload)
+
+    def _passthrough_line(self, line: bytes):
+        """
+        Output a hex input line as it is
+        """
+        self.writer.write(line, b'\n')
+
+    def _parse_chunk(self, chunk: bytes):
+        if isinstance(chunk, tuple):
+            # payloads decoded already, the messages have no input line
+            buf, offsets = chunk
+            lines = [None] * len(offsets)
+        else:
+            try:
+                lines, buf, offsets = decode_lines(chunk)
+            except ValueError:
+                # report the faulty lines one by one
+                messages = (self.parse_message(line) for line in chunk.split(b'\n') if line.strip())
+                return [msg for msg in messages if msg]
+        messages = []
+        for line, (start, end) in zip(lines, offsets):
+            try:
+                msg = GorMessage.from_payload(buf, start, end)
+                # a meta line which is not UTF-8 is reported here rather
+                # than on the first access to `msg.id`
+                msg._parse_meta()
+            except ValueError as e:
+                line = bytes(line) if line is not None else buf[start:end]
+                self.stderr.write('Error while parsing incoming request: "%s" %s' % (line, e))
+                continue
+            msg.raw_line = line
+            messages.append(msg)
+        return messages
+
     def http_method(self, payload: bytes) -> str:
         pend = payload.index(b' ')
         return payload[:pend].decode()
@@ -106,18 +662,8 @@ class Gor(object):
         return query_dict.get(name)
 
     def set_http_path_param(self, payload: bytes, name: str, value: str) -> bytes:
-        path_qs = self.http_path(payload)
-        new_path = re.sub(name + '=([^&$]+)',
-                          name + '=' + quote_plus(value),
-                          path_qs)
-        if new_path == path_qs:
-            if '?' not in new_path:
-                new_path += '?'
-            else:
-                new_path += '&'
-            new_path += name + '=' + quote_plus(value)
-        new_path = new_path.encode()
-        return self.set_http_path(payload, new_path)
+        new_path = set_query_param(self.http_path(payload), name, value)
+        return self.set_http_path(payload, new_path.encode())
 
     def http_status(self, payload: bytes) -> str:
         '''
@@ -128,76 +674,49 @@ class Gor(object):
     def set_http_status(self, payload: bytes, new_status: str) -> bytes:
         return self.set_http_path(payload, new_status)
 
+    def _header_index(self, payload: bytes) -> HeaderIndex:
+        # helpers are usually called several times in a row on the same
+        # payload, so the index of the last one is kept around
+        index = self._last_headers
+        if index is None or index.payload is not payload:
+            index = HeaderIndex(payload)
+            self._last_headers = index
+        return index
+
     def http_headers(self, payload: bytes) -> Dict[str, str]:
         """
         Parse the payload and return http headers in a map
         :param payload: the http payload to inspect
         :return: a map mapping from key to value of each http header item
         """
-        start_index = payload.index(b"\r\n")
-        end_index = payload.index(b"\r\n\r\n")
-        if end_index == -1:
-            end_index = len(payload)
-        headers = {}
-        for item in payload[start_index+2:end_index].split(b"\r\n"):
-            sep_index = item.index(b":")
-            key = item[:sep_index].decode()
-            value = item[sep_index+1:].lstrip().decode()
-            headers[key] = value
-        return headers
+        return dict(self._header_index(payload).items())
 
     def http_header(self, payload: bytes, name: str) -> Dict[str, str]:
-        current_line = 0
-        idx = 0
-        header = {
-            'start': -1,
-            'end': -1,
-            'value_start': -1,
+        header = self._header_index(payload).find(name)
+        if header is None:
+            return None
+        return {
+            'start': header.start,
+            'end': header.end,
+            'value_start': header.value_start,
+            'value': header.value,
+            'name': name.lower(),
         }
-        name = name.encode()
-        while idx < len(payload):
-            c = payload[idx]
-            if c == ord('\n'):
-                current_line += 1
-                idx += 1
-                header['end'] = idx
-
-                if current_line > 0 and header['start'] > 0 and header['value_start'] > 0:
-                    if payload[header['start']:header['value_start']-1].lower() == name.lower():
-                        header['value'] = payload[header['value_start']:header['end']].strip().decode()
-                        header['name'] = name.lower().decode()
-                        return header
-
-                header['start'] = -1
-                header['value_start'] = -1
-                continue
-            elif c == ord('\r'):
-                idx += 1
-                continue
-            elif c == ord(':'):
-                if header['value_start'] == -1:
-                    idx += 1
-                    header['value_start'] = idx
-                    continue
-            if header['start'] == -1:
-                header['start'] = idx
-            idx += 1
-        return None
 
     def set_http_header(self, payload: bytes, name: str, value: str) -> bytes:
-        header = self.http_header(payload, name)
+        header = self._header_index(payload).find(name)
         if header is None:
             header_start = payload.index(b'\n') + 1
             return payload[:header_start] + name.encode() + b': ' + value.encode() + b'\r\n' + payload[header_start:]
         else:
-            return payload[:header['value_start']] + b' ' + value.encode() + b'\r\n' + payload[header['end']:]
+            return payload[:header.value_start] + b' ' + value.encode() + b'\r\n' + payload[header.end:]
 
     def delete_http_header(self, payload: bytes, name: str) -> bytes:
-        header = self.http_header(payload, name)
+        header = self._header_index(payload).find(name)
         if header is None:
             return payload
         else:
-            return payload[:header['start']] + payload[header['end']:]
+            return payload[:header.start] + payload[header.end:]
 
     def http_body(self, payload: bytes) -> bytes:
         if b'\r\n\r\n' not in payload:
@@ -211,36 +730,41 @@ class Gor(object):
         else:
             return payload[:payload.index(b'\r\n\r\n')+4] + new_body
 
+    def _http_cookies(self, payload: bytes):
+        cookies = self._header_index(payload).get('Cookie') or ''
+        return [item for item in cookies.split('; ') if item]
+
     def http_cookie(self, payload: bytes, name: str) -> str:
-        cookie_data = self.http_header(payload, 'Cookie')
-        cookies = cookie_data.get('value') or ''
-        for item in cookies.split('; '):
+        for item in self._http_cookies(payload):
             if item.startswith(name + '='):
                 return item[item.index('=')+1:]
         return None
 
     def set_http_cookie(self, payload: bytes, name: str, value: str) -> bytes:
-        cookie_data = self.http_header(payload, 'Cookie')
-        cookies = cookie_data.get('value') or ''
-        cookies = list(filter(lambda x: not x.startswith(name + '='), cookies.split('; ')))
+        cookies = [x for x in self._http_cookies(payload) if not x.startswith(name + '=')]
         cookies.append(name + '=' + value)
         return self.set_http_header(payload, 'Cookie', '; '.join(cookies))
 
     def delete_http_cookie(self, payload: bytes, name: str) -> bytes:
-        cookie_data = self.http_header(payload, 'Cookie')
-        cookies = cookie_data.get('value') or ''
-        cookies = list(filter(lambda x: not x.startswith(name + '='), cookies.split('; ')))
+        cookies = [x for x in self._http_cookies(payload) if not x.startswith(name + '=')]
         return self.set_http_header(payload, 'Cookie', '; '.join(cookies))
 
-    def decompress_gzip_body(self, payload: bytes) -> bytes:
-        headers = self.http_headers(payload)
-        transfer_encoding = headers.get('Transfer-Encoding')
-        content_encoding  = headers.get('Content-Encoding')
-        body = self.http_body(payload)
-        if content_encoding == 'gzip':
-            if transfer_encoding.lower() == 'chunked':
-                data = decode_chunked(body)
-            else:
-                data = body
-            return gzip.decompress(data)
-        return body
+    def iter_http_body(self, payload: bytes, chunk_size: int = BODY_CHUNK_SIZE, max_size: int = None):
+        """
+        Decode the body of `payload` incrementally, see `gor.body.iter_body`
+        :return: an iterator over pieces of the decoded body
+        """
+        index = self._header_index(payload)
+        if index.body_start == -1:
+            return iter(())
+        return iter_body(payload, index.body_start,
+                         content_encoding=index.get('Content-Encoding'),
+                         transfer_encoding=index.get('Transfer-Encoding'),
+                         chunk_size=chunk_size, max_size=max_size)
+
+    def decompress_gzip_body(self, payload: bytes, max_size: int = None) -> bytes:
+        """
+        :return: the body of `payload` with its transfer and content
+            encodings (gzip, deflate) removed
+        """
+        return b''.join(self.iter_http_body(payload, max_size=max_size))
@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import zlib
+
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunked(data: bytes, start: int = 0):
+    """
+    Walk a chunked transfer encoded body by offset
+    :param data: the buffer holding the body
+    :param start: offset of the body in `data`
+    :return: an iterator over memoryview slices of `data`, one per chunk,
+        a truncated last chunk is yielded as far as it goes
+    """
+    view = memoryview(data)
+    end = len(data)
+    pos = start
+    while pos < end:
+        sep = data.find(b'\r\n', pos)
+        if sep == -1:
+            return
+        # chunk extensions, if any, follow the size after a ';'
+        size = int(bytes(view[pos:sep]).split(b';', 1)[0], 16)
+        if size == 0:
+            return
+        pos = sep + 2
+        yield view[pos:min(pos + size, end)]
+        pos += size + 2
+
+
+def _decompressor(encoding: str, first: bytes):
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # "deflate" should be zlib wrapped, some servers send raw deflate
+        if len(first) >= 2 and first[0] & 0x0f == 8 and (first[0] << 8 | first[1]) % 31 == 0:
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+    return None
+
+
+def iter_body(data: bytes, start: int = 0, content_encoding: str = None, transfer_encoding: str = None,
+              chunk_size: int = BODY_CHUNK_SIZE, max_size: int = None):
+    """
+    Decode a body step by step, without holding the whole encoded or decoded
+    body. gzip and deflate are decompressed, other content encodings (br,
+    compress...) are passed through as they are.
+    :param data: the buffer holding the body
+    :param start: offset of the body in `data`
+    :param chunk_size: maximum size of each decompressed piece
+    :param max_size: raise ValueError once more than `max_size` bytes are decoded
+    :return: an iterator over pieces of the decoded body
+    """
+    if transfer_encoding and transfer_encoding.strip().lower() == 'chunked':
+        pieces = iter_chunked(data, start)
+    else:
+        pieces = iter((memoryview(data)[start:],))
+    encoding = (content_encoding or '').strip().lower()
+    decompressor = None
+    size = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        if decompressor is None and encoding:
+            decompressor = _decompressor(encoding, piece[:2])
+        if decompressor is None:
+            outputs = (piece,)
+        else:
+            outputs = _decompress(decompressor, piece, chunk_size)
+        for out in outputs:
+            size += len(out)
+            if max_size is not None and size > max_size:
+                raise ValueError('decoded body exceeds %d bytes' % max_size)
+            yield out
+        if decompressor is not None and decompressor.eof:
+            return
+    if decompressor is not None:
+        out = decompressor.flush()
+        if out:
+            size += len(out)
+            if max_size is not None and size > max_size:
+                raise ValueError('decoded body exceeds %d bytes' % max_size)
+            yield out
+
+
+def _decompress(decompressor, data, chunk_size: int):
+    while data:
+        out = decompressor.decompress(data, chunk_size)
+        data = decompressor.unconsumed_tail
+        if out:
+            yield out
+        if decompressor.eof:
+            return
@@ -1,14 +1,54 @@
 # coding: utf-8
 
 import sys
-from datetime import datetime
+import time
+import inspect
+import threading
+from collections import OrderedDict
 from typing import Callable
 
 
+TYPE_CHANNELS = {
+    '1': 'request',
+    '2': 'response',
+    '3': 'replay',
+}
+
+
+def _stats_name(chan: str) -> str:
+    if '#' in chan:
+        chan = chan[:chan.index('#')] + '#id'
+    return 'callback.' + chan
+
+
 class CallbackContainer(object):
+    """
+    Registry of channel callbacks.
+
+    Per-id channels (``chan#id``) are tracked in an expiry index ordered by
+    creation time. They are evicted once older than `channel_ttl` seconds or
+    when more than `max_channels` of them are registered; `on_channel_evict`
+    is called with the channel name and its callbacks for every channel
+    evicted without having fired.
+
+    The registry is shared by the threads of `ThreadPoolGor`, `lock` guards
+    every change to it; callbacks and `on_channel_evict` run outside of it.
+    """
 
     def __init__(self, *args, **kwargs):
         self.ch = None
+        self.ttl = kwargs.get('channel_ttl')
+        self.max_channels = kwargs.get('max_channels')
+        self.on_evict = kwargs.get('on_channel_evict')
+        # message type -> [(chan, callback entry)] of its static channels
+        self.handlers = {t: [] for t in TYPE_CHANNELS}
+        self.has_coroutines = False
+        self.stats = None
+        # chan -> [created, fired]
+        self.expiry = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
 
     def init_container(self):
         raise NotImplementedError
@@ -16,40 +56,199 @@ class CallbackContainer(object):
     def ensure_chan(self, chan: str):
         raise NotImplementedError
 
-    def add(self, chan: str, callback: Callable, **kwargs):
-        self.ensure_chan(chan)
-        self.ch[chan].append({
-            'created': datetime.now(),
-            'callback': callback,
-            'kwargs': kwargs,
-         })
+    def add(self, chan: str, callback: Callable, once: bool = False, **kwargs):
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            self.ensure_chan(chan)
+            self.ch[chan].append({
+                'created': now,
+                'callback': callback,
+                'kwargs': kwargs,
+                'once': once,
+             })
+            if inspect.iscoroutinefunction(callback):
+                self.has_coroutines = True
+            if '#' in chan:
+                if chan not in self.expiry:
+                    self.expiry[chan] = [now, False]
+                self._expire(now, evicted)
+            else:
+                self._build_handlers()
+        self._notify(evicted)
+
+    def remove(self, chan: str):
+        with self.lock:
+            self._remove(chan)
+
+    def _remove(self, chan: str):
+        self.ch.pop(chan, None)
+        if '#' in chan:
+            self.expiry.pop(chan, None)
+        else:
+            self._build_handlers()
+
+    def _build_handlers(self):
+        handlers = {}
+        for msg_type, type_chan in TYPE_CHANNELS.items():
+            handlers[msg_type] = [(chan, entry)
+                                  for chan in ('message', type_chan)
+                                  for entry in self.ch.get(chan, ())]
+        self.handlers = handlers
+
+    def expire(self, now: float = None):
+        """
+        Evict per-id channels which outlived `channel_ttl` or exceed `max_channels`
+        """
+        if self.ttl is None and self.max_channels is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        evicted = []
+        with self.lock:
+            self._expire(now, evicted)
+        self._notify(evicted)
+
+    def _expire(self, now: float, evicted: list):
+        if self.ttl is None and self.max_channels is None:
+            return
+        expiry = self.expiry
+        while expiry:
+            chan, (created, fired) = next(iter(expiry.items()))
+            over_count = self.max_channels is not None and len(expiry) > self.max_channels
+            over_ttl = self.ttl is not None and now - created > self.ttl
+            if not (over_count or over_ttl):
+                break
+            channels = self.ch.pop(chan, None)
+            expiry.pop(chan, None)
+            self.expired += 1
+            if not fired:
+                self.evicted += 1
+                if self.on_evict is not None:
+                    evicted.append((chan, channels))
+
+    def _notify(self, evicted: list):
+        for chan, channels in evicted:
+            self.on_evict(chan, channels)
 
     def do_callback(self, gor, chan_id: str, msg) -> str:
         resp = ''
-        if self.ch.get(chan_id):
-            for channel in self.ch[chan_id]:
+        channels = self.ch.get(chan_id)
+        if channels:
+            fired_once = []
+            for channel in channels:
                 r = channel['callback'](gor, msg, **channel['kwargs'])
                 if r:
                     resp = r
+                if channel['once']:
+                    fired_once.append(channel)
+            with self.lock:
+                state = self.expiry.get(chan_id)
+                if state is not None:
+                    state[1] = True
+                if fired_once:
+                    self._discard(chan_id, fired_once)
         return resp
 
-
-class MultiProcessCallbackContainer(CallbackContainer):
-
-    def __init__(self, manager, *args, **kwargs):
-        super(CallbackContainer, self).__init__(*args, **kwargs)
-        self.manager = manager
-        self.ch = self.manager.dict()
-
-    def ensure_chan(self, chan: str):
-        self.ch.setdefault(chan, self.manager.list())
+    def _channels(self, msg):
+        """
+        :return: the (chan, callback entry) pairs to run for `msg`: its
+            `message`, type and per-id callbacks in that order
+        """
+        handlers = self.handlers[msg.type]
+        if self.expiry:
+            chan_id = TYPE_CHANNELS[msg.type] + '#' + msg.id
+            with self.lock:
+                channels = self.ch.get(chan_id)
+                if channels:
+                    handlers = handlers + [(chan_id, channel) for channel in channels]
+                    # fired from now on, even if evicted before its callbacks return
+                    self.expiry[chan_id][1] = True
+        return handlers
+
+    def _fired(self, channels):
+        fired_once = None
+        for chan, channel in channels:
+            if channel['once']:
+                fired_once = fired_once or {}
+                fired_once.setdefault(chan, []).append(channel)
+        if fired_once:
+            with self.lock:
+                for chan, fired in fired_once.items():
+                    self._discard(chan, fired)
+
+    def dispatch(self, gor, msg):
+        """
+        Run the callbacks of `msg`
+        :return: a tuple of whether any callback ran and the message to output
+        """
+        channels = self._channels(msg)
+        if not channels:
+            return False, msg
+        resp = msg
+        stats = self.stats
+        for chan, channel in channels:
+            if stats is not None:
+                started = time.perf_counter()
+                r = channel['callback'](gor, msg, **channel['kwargs'])
+                stats.observe(_stats_name(chan), time.perf_counter() - started)
+            else:
+                r = channel['callback'](gor, msg, **channel['kwargs'])
+            if r:
+                if self.has_coroutines and inspect.isawaitable(r):
+                    r.close()
+                    raise TypeError('coroutine callback on %s requires AsyncioGor' % chan)
+                resp = r
+        self._fired(channels)
+        return True, resp
+
+    async def dispatch_async(self, gor, msg):
+        """
+        Same as `dispatch`, awaiting coroutine callbacks one after another
+        """
+        channels = self._channels(msg)
+        if not channels:
+            return False, msg
+        resp = msg
+        stats = self.stats
+        for chan, channel in channels:
+            if stats is not None:
+                started = time.perf_counter()
+            r = channel['callback'](gor, msg, **channel['kwargs'])
+            if inspect.isawaitable(r):
+                r = await r
+            if stats is not None:
+                stats.observe(_stats_name(chan), time.perf_counter() - started)
+            if r:
+                resp = r
+        self._fired(channels)
+        return True, resp
+
+    def _discard(self, chan_id: str, fired):
+        channels = [c for c in self.ch.get(chan_id, ()) if not any(c is f for f in fired)]
+        if channels:
+            self.ch[chan_id] = channels
+            if '#' not in chan_id:
+                self._build_handlers()
+        else:
+            self._remove(chan_id)
 
 
 class SimpleCallbackContainer(CallbackContainer):
 
     def __init__(self, *args, **kwargs):
-        super(CallbackContainer, self).__init__(*args, **kwargs)
+        super(SimpleCallbackContainer, self).__init__(*args, **kwargs)
         self.ch = {}
 
     def ensure_chan(self, chan: str):
         self.ch.setdefault(chan, [])
+
+
+class MultiProcessCallbackContainer(SimpleCallbackContainer):
+    """
+    Process local registry for MultiProcessGor. Channels registered before
+    `run` are copied into every worker when it is forked and looked up
+    locally. Per-id channels registered from a callback stay in the worker
+    owning that id, messages sharing an id are always routed to the same
+    worker.
+    """
@@ -0,0 +1,356 @@
+# coding: utf-8
+"""
+Binary capture files of GoReplay traffic.
+
+A capture holds the decoded ``meta\\nhttp`` payload of every message,
+length prefixed, followed by an index of the offset, timestamp and id of each
+record, so a capture can be memory-mapped and read from any message id or
+point in time. Record one from a live middleware with ``record=path``, or
+from a hex stream with::
+
+    python -m gor.capture record traffic.gorcap < traffic.gor
+
+and replay it through a middleware with `replay`.
+"""
+
+import io
+import sys
+import mmap
+import time
+import bisect
+import struct
+import argparse
+
+from .codec import decode_lines, encode_payloads, split_lines
+
+
+MAGIC = b'GORCAP1\0'
+INDEX_MAGIC = b'GORIDX1\0'
+RECORD = struct.Struct('<I')
+# offset, timestamp in nanoseconds and id size of a record
+INDEX_ENTRY = struct.Struct('<QqH')
+# index offset, record count, magic
+FOOTER = struct.Struct('<QQ8s')
+
+
+def _meta(payload) -> (bytes, int):
+    """
+    :return: the id and timestamp of a payload
+    """
+    line_end = bytes(payload[:256]).find(b'\n')
+    meta = bytes(payload[:line_end if line_end != -1 else 256]).split(b' ')
+    _id = meta[1] if len(meta) > 1 else b''
+    try:
+        timestamp = int(meta[2])
+    except (IndexError, ValueError):
+        timestamp = 0
+    return _id, timestamp
+
+
+class CaptureWriter(object):
+    """
+    Append payloads to a capture file, the index is written by `close`
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.offset = len(MAGIC)
+        self.index = []
+
+    def write(self, payload):
+        """
+        :param payload: the decoded ``meta\\nhttp`` bytes of one message
+        """
+        _id, timestamp = _meta(payload)
+        self.index.append(INDEX_ENTRY.pack(self.offset, timestamp, len(_id)) + _id)
+        self.file.write(RECORD.pack(len(payload)))
+        self.file.write(payload)
+        self.offset += RECORD.size + len(payload)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write(b''.join(self.index))
+        self.file.write(FOOTER.pack(self.offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader(object):
+    """
+    Memory-mapped view of a capture file. The index is read from the end of
+    the file, or rebuilt by scanning the records of a capture which was not
+    closed properly.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('%s is not a gor capture file' % path)
+        self.offsets = []
+        self.timestamps = []
+        self.ids = {}
+        if not self._load_index():
+            self._scan()
+        self.sorted = all(a <= b for a, b in zip(self.timestamps, self.timestamps[1:]))
+
+    def _add(self, offset: int, timestamp: int, _id: bytes):
+        self.ids.setdefault(_id.decode(), len(self.offsets))
+        self.offsets.append(offset)
+        self.timestamps.append(timestamp)
+
+    def _load_index(self) -> bool:
+        size = len(self.map)
+        if size < len(MAGIC) + FOOTER.size:
+            return False
+        index_offset, count, magic = FOOTER.unpack_from(self.map, size - FOOTER.size)
+        if magic != INDEX_MAGIC:
+            return False
+        pos = index_offset
+        for _ in range(count):
+            offset, timestamp, id_size = INDEX_ENTRY.unpack_from(self.map, pos)
+            pos += INDEX_ENTRY.size
+            self._add(offset, timestamp, self.map[pos:pos + id_size])
+            pos += id_size
+        self.end = index_offset
+        return True
+
+    def _scan(self):
+        pos, size = len(MAGIC), len(self.map)
+        while pos + RECORD.size <= size:
+            length = RECORD.unpack_from(self.map, pos)[0]
+            if pos + RECORD.size + length > size:
+                # a record cut short by a crash
+                break
+            _id, timestamp = _meta(self.map[pos + RECORD.size:pos + RECORD.size + 256])
+            self._add(pos, timestamp, _id)
+            pos += RECORD.size + length
+        self.end = pos
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i: int) -> memoryview:
+        """
+        :return: the payload of record `i`, a view on the mapped file
+        """
+        offset = self.offsets[i]
+        length = RECORD.unpack_from(self.map, offset)[0]
+        return memoryview(self.map)[offset + RECORD.size:offset + RECORD.size + length]
+
+    def payloads(self, start: int, stop: int):
+        """
+        :return: one buffer holding the payloads of records `start` to
+            `stop`, copied out of the mapped file at once, and the
+            ``(start, end)`` offsets of every payload within it
+        """
+        first = self.offsets[start]
+        last = self.offsets[stop - 1]
+        buf = self.map[first:last + RECORD.size + RECORD.unpack_from(self.map, last)[0]]
+        offsets = []
+        for offset in self.offsets[start:stop]:
+            pos = offset - first
+            offsets.append((pos + RECORD.size, pos + RECORD.size + RECORD.unpack_from(buf, pos)[0]))
+        return buf, offsets
+
+    def find_id(self, _id: str) -> int:
+        """
+        :return: the position of the first record of message `_id`
+        """
+        return self.ids[_id]
+
+    def find_time(self, timestamp: int) -> int:
+        """
+        :param timestamp: nanoseconds since the epoch, as in GoReplay meta
+        :return: the position of the first record at or after `timestamp`
+        """
+        if self.sorted:
+            return bisect.bisect_left(self.timestamps, timestamp)
+        for i, ts in enumerate(self.timestamps):
+            if ts >= timestamp:
+                return i
+        return len(self)
+
+    def stream(self, start: int = 0, stop: int = None, speed: float = None, batch: int = 256) -> 'CaptureStream':
+        """
+        :param speed: replay at `speed` times the original pace, as fast as
+            possible if None
+        :return: a binary stream of hex lines, usable as middleware input,
+            middlewares read its decoded payloads with `read_payloads`
+        """
+        return CaptureStream(self, start, len(self) if stop is None else stop, speed, batch)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureStream(io.RawIOBase):
+    """
+    Hex encoded GoReplay lines of a range of capture records, read in batches
+    of `batch` records, or up to the next record due when paced.
+    `read_payloads` reads the same batches without hex encoding them.
+    """
+
+    def __init__(self, reader: CaptureReader, start: int, stop: int, speed: float = None, batch: int = 256):
+        self.reader = reader
+        self.pos = start
+        self.stop = stop
+        self.speed = speed
+        self.batch = batch
+        self.started = None
+        self.first_timestamp = reader.timestamps[start] if start < stop else 0
+        self.pending = b''
+        # position of the next byte of `pending` to read
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def _next_range(self) -> int:
+        """
+        :return: the end of the next batch of records, once it is due
+        """
+        end = min(self.pos + self.batch, self.stop)
+        if self.speed:
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            elapsed = (now - self.started) * self.speed * 1e9
+            due = self.first_timestamp + elapsed
+            timestamps = self.reader.timestamps
+            if timestamps[self.pos] > due:
+                time.sleep((timestamps[self.pos] - due) / self.speed / 1e9)
+                due = timestamps[self.pos]
+            # everything due by now, at least one record
+            end = max(self.pos + 1, min(end, bisect.bisect_right(timestamps, due, self.pos, end)))
+        return end
+
+    def read_payloads(self):
+        """
+        :return: the next batch as one buffer of decoded payloads and their
+            ``(start, end)`` offsets, as `CaptureReader.payloads`, or None
+            after the last record
+        """
+        if self.pos >= self.stop:
+            return None
+        end = self._next_range()
+        batch = self.reader.payloads(self.pos, end)
+        self.pos = end
+        return batch
+
+    def read(self, n: int = -1) -> bytes:
+        while self.offset >= len(self.pending) and self.pos < self.stop:
+            end = self._next_range()
+            self.pending = encode_payloads([self.reader[i] for i in range(self.pos, end)])
+            self.offset = 0
+            self.pos = end
+        start = self.offset
+        self.offset = len(self.pending) if n is None or n < 0 else min(len(self.pending), start + n)
+        return self.pending[start:self.offset]
+
+    read1 = read
+
+
+def replay(proxy, path: str, start_id: str = None, start_time: int = None, count: int = None,
+           speed: float = None):
+    """
+    Run `proxy` on the records of capture `path` instead of stdin
+    :param start_id: start at the first record of this message id
+    :param start_time: start at this timestamp, in nanoseconds
+    :param count: number of records to replay, all the remaining ones if None
+    :param speed: replay at `speed` times the original pace, as fast as
+        possible if None
+    """
+    with CaptureReader(path) as reader:
+        proxy.input = reader.stream(*_range(reader, start_id, start_time, count), speed=speed)
+        proxy.run()
+
+
+def _range(reader: CaptureReader, start_id: str = None, start_time: int = None, count: int = None):
+    start = 0
+    if start_id is not None:
+        start = reader.find_id(start_id)
+    elif start_time is not None:
+        start = reader.find_time(start_time)
+    return start, len(reader) if count is None else min(len(reader), start + count)
+
+
+def record(path: str, stream=None) -> int:
+    """
+    Convert a hex GoReplay stream, stdin by default, to a capture file
+    :return: the number of records written
+    """
+    stream = stream or getattr(sys.stdin, 'buffer', sys.stdin)
+    pending = b''
+    with CaptureWriter(path) as writer:
+        while True:
+            chunk = stream.read(256 * 1024)
+            if not chunk:
+                break
+            lines, pending = split_lines(pending, chunk)
+            if lines:
+                _write_lines(writer, lines)
+        if pending.strip():
+            _write_lines(writer, pending)
+        return len(writer.index)
+
+
+def _write_lines(writer: CaptureWriter, lines: bytes):
+    _, buf, offsets = decode_lines(lines)
+    for start, end in offsets:
+        writer.write(buf[start:end])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GoReplay capture files')
+    sub = parser.add_subparsers(dest='command')
+    rec = sub.add_parser('record', help='convert a hex stream read from stdin to a capture')
+    rec.add_argument('path')
+    info = sub.add_parser('info', help='describe a capture')
+    info.add_argument('path')
+    dump = sub.add_parser('dump', help='write records of a capture to stdout as a hex stream')
+    dump.add_argument('path')
+    dump.add_argument('--start-id')
+    dump.add_argument('--start-time', type=int)
+    dump.add_argument('--count', type=int)
+    dump.add_argument('--speed', type=float)
+    args = parser.parse_args()
+    if args.command == 'record':
+        print('%d records' % record(args.path))
+    elif args.command == 'info':
+        with CaptureReader(args.path) as reader:
+            print('%d records, %d ids' % (len(reader), len(reader.ids)))
+            if len(reader):
+                print('from %d to %d' % (min(reader.timestamps), max(reader.timestamps)))
+    elif args.command == 'dump':
+        with CaptureReader(args.path) as reader:
+            start, stop = _range(reader, args.start_id, args.start_time, args.count)
+            stream = reader.stream(start, stop, args.speed)
+            out = sys.stdout.buffer
+            while True:
+                data = stream.read()
+                if not data:
+                    break
+                out.write(data)
+                out.flush()
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# coding: utf-8
+
+import time
+import queue
+import ctypes
+import struct
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover, python < 3.8
+    shared_memory = None
+
+
+_HEADER = struct.Struct('<I')
+_FLAG_MORE = 1 << 31
+_WRAP = 0xFFFFFFFF
+_CTL_SIZE = 64
+
+# control words at the start of the shared memory block
+_HEAD, _TAIL, _PRODUCER_WAITING, _PUT_COUNT, _GET_COUNT, _SKIP, _SKIPPED = range(7)
+
+
+class RingBuffer(object):
+    """
+    Single producer, single consumer channel over a shared memory ring.
+
+    Records are length prefixed and copied straight into the shared block, no
+    pickling or pipe copies involved. Records larger than a quarter of the
+    ring are split into fragments, and `put` blocks while the ring is full so
+    a slow consumer pushes back on the producer.
+    """
+
+    def __init__(self, size: int = 4 * 1024 * 1024):
+        self.capacity = size
+        self.max_fragment = size // 4 - _HEADER.size
+        self.shm = shared_memory.SharedMemory(create=True, size=_CTL_SIZE + size)
+        self.items = multiprocessing.Semaphore(0)
+        self.space = multiprocessing.Event()
+        self._attach()
+        for i in range(_CTL_SIZE // 8):
+            self._ctl[i] = 0
+
+    def _attach(self):
+        self._ctl = self.shm.buf[:_CTL_SIZE].cast('Q')
+        self._data = self.shm.buf[_CTL_SIZE:_CTL_SIZE + self.capacity]
+
+    def __getstate__(self):
+        return self.shm.name, self.capacity, self.items, self.space
+
+    def __setstate__(self, state):
+        name, self.capacity, self.items, self.space = state
+        self.max_fragment = self.capacity // 4 - _HEADER.size
+        self.shm = shared_memory.SharedMemory(name=name)
+        self._attach()
+
+    def __len__(self):
+        """
+        Number of records put but not consumed yet, records to be skipped
+        excluded
+        """
+        ctl = self._ctl
+        return ctl[_PUT_COUNT] - ctl[_GET_COUNT] - (ctl[_SKIP] - ctl[_SKIPPED])
+
+    def wait_below(self, count: int):
+        """
+        Block the producer until less than `count` records are pending
+        """
+        ctl = self._ctl
+        while len(self) >= count:
+            self.space.clear()
+            ctl[_PRODUCER_WAITING] = 1
+            if len(self) >= count:
+                self.space.wait(0.01)
+            ctl[_PRODUCER_WAITING] = 0
+
+    def skip_oldest(self):
+        """
+        Producer side: have the consumer discard the oldest pending record.
+        The consumer checks `should_skip` after each `get`, so it still sees
+        the record, e.g. to account for its sequence number.
+        """
+        self._ctl[_SKIP] += 1
+
+    def should_skip(self) -> bool:
+        """
+        Consumer side: whether the record just read was dropped by the producer
+        """
+        ctl = self._ctl
+        if ctl[_SKIP] > ctl[_SKIPPED]:
+            ctl[_SKIPPED] += 1
+            return True
+        return False
+
+    def _reserve(self, need: int) -> int:
+        ctl, cap = self._ctl, self.capacity
+        while True:
+            head = ctl[_HEAD]
+            to_end = cap - head % cap
+            waste = 0 if to_end >= need else to_end
+            if cap - (head - ctl[_TAIL]) >= need + waste:
+                break
+            self.space.clear()
+            ctl[_PRODUCER_WAITING] = 1
+            if cap - (head - ctl[_TAIL]) < need + waste:
+                # the timeout covers a wakeup lost between the check and the wait
+                self.space.wait(0.01)
+            ctl[_PRODUCER_WAITING] = 0
+        if waste:
+            if waste >= _HEADER.size:
+                _HEADER.pack_into(self._data, head % cap, _WRAP)
+            head += waste
+        return head
+
+    def _put_fragment(self, parts, size: int, more: bool):
+        need = _HEADER.size + size
+        head = self._reserve(need)
+        pos = head % self.capacity
+        _HEADER.pack_into(self._data, pos, size | _FLAG_MORE if more else size)
+        pos += _HEADER.size
+        for part in parts:
+            self._data[pos:pos + len(part)] = part
+            pos += len(part)
+        self._ctl[_HEAD] = head + need
+        self.items.release()
+
+    def put(self, *parts):
+        """
+        Append one record made of the concatenation of `parts`, blocking while
+        the ring is full. An empty record is a valid record.
+        """
+        size = sum(len(p) for p in parts)
+        if size <= self.max_fragment:
+            self._put_fragment(parts, size, False)
+        else:
+            data = memoryview(b''.join(parts))
+            step = self.max_fragment
+            for offset in range(0, size, step):
+                chunk = data[offset:offset + step]
+                self._put_fragment((chunk,), len(chunk), offset + step < size)
+        self._ctl[_PUT_COUNT] += 1
+
+    def _get_fragment(self, timeout):
+        if not self.items.acquire(timeout=timeout):
+            raise queue.Empty
+        ctl, cap = self._ctl, self.capacity
+        tail = ctl[_TAIL]
+        pos = tail % cap
+        to_end = cap - pos
+        if to_end < _HEADER.size or _HEADER.unpack_from(self._data, pos)[0] == _WRAP:
+            tail += to_end
+            pos = 0
+        header = _HEADER.unpack_from(self._data, pos)[0]
+        size = header & ~_FLAG_MORE
+        data = bytes(self._data[pos + _HEADER.size:pos + _HEADER.size + size])
+        ctl[_TAIL] = tail + _HEADER.size + size
+        if ctl[_PRODUCER_WAITING]:
+            self.space.set()
+        return data, bool(header & _FLAG_MORE)
+
+    def get(self, timeout: float = None) -> bytes:
+        """
+        Pop the next record, raise `queue.Empty` if none arrives within `timeout`
+        """
+        data, more = self._get_fragment(timeout)
+        if more:
+            chunks = [data]
+            while more:
+                data, more = self._get_fragment(None)
+                chunks.append(data)
+            data = b''.join(chunks)
+        self._ctl[_GET_COUNT] += 1
+        return data
+
+    def close(self):
+        self._ctl.release()
+        self._data.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class QueueChannel(object):
+    """
+    Channel with the same interface as `RingBuffer` on top of a
+    multiprocessing queue, used where shared memory is not available.
+    """
+
+    def __init__(self, size: int = 0):
+        self.queue = multiprocessing.Queue()
+        # a ctypes type, Python 3.6 has no 'q'/'Q' typecodes
+        self.skip = multiprocessing.Value(ctypes.c_ulonglong, 0, lock=False)
+        self.skipped = multiprocessing.Value(ctypes.c_ulonglong, 0, lock=False)
+
+    def __len__(self):
+        try:
+            size = self.queue.qsize()
+        except NotImplementedError:  # pragma: no cover, macOS
+            return 0
+        return max(0, size - (self.skip.value - self.skipped.value))
+
+    def wait_below(self, count: int):
+        while len(self) >= count:
+            time.sleep(0.001)
+
+    def skip_oldest(self):
+        self.skip.value += 1
+
+    def should_skip(self) -> bool:
+        if self.skip.value > self.skipped.value:
+            self.skipped.value += 1
+            return True
+        return False
+
+    def put(self, *parts):
+        self.queue.put(b''.join(parts))
+
+    def get(self, timeout: float = None) -> bytes:
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        pass
+
+    def unlink(self):
+        pass
+
+
+def make_channel(kind: str = 'shm', size: int = 4 * 1024 * 1024):
+    if kind == 'shm' and shared_memory is not None:
+        return RingBuffer(size)
+    return QueueChannel(size)
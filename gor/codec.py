@@ -0,0 +1,62 @@
+# coding: utf-8
+
+import binascii
+
+
+def split_lines(pending: bytes, chunk: bytes):
+    """
+    Split input read in arbitrary chunks into runs of complete lines
+    :return: the complete lines of ``pending + chunk`` and the incomplete rest
+    """
+    end = chunk.rfind(b'\n')
+    if end == -1:
+        return b'', pending + chunk
+    if end == len(chunk) - 1:
+        lines = pending + chunk if pending else chunk
+        return lines, b''
+    return pending + chunk[:end + 1], chunk[end + 1:]
+
+
+def decode_lines(chunk: bytes):
+    """
+    Decode a chunk of newline separated hex lines in one step, the line
+    breaks are removed so the whole chunk is decoded into a single buffer
+    :param chunk: hex lines, separated by ``\\n``
+    :return: memoryviews of the hex lines in `chunk`, the decoded buffer and
+        the ``(start, end)`` offsets of every line within that buffer
+    """
+    if b'\r' in chunk or b' ' in chunk:
+        chunk = chunk.replace(b'\r', b'').replace(b' ', b'')
+    # rather than ``bytes.fromhex``, which only skips line breaks from 3.7 on
+    buf = binascii.unhexlify(chunk.replace(b'\n', b''))
+    view = memoryview(chunk)
+    lines = []
+    offsets = []
+    find = chunk.find
+    pos = start = 0
+    size = len(chunk)
+    while start < size:
+        end = find(b'\n', start)
+        if end == -1:
+            end = size
+        if end > start:
+            if (end - start) & 1:
+                raise ValueError('odd-length hex line')
+            lines.append(view[start:end])
+            line_size = (end - start) >> 1
+            offsets.append((pos, pos + line_size))
+            pos += line_size
+        start = end + 1
+    if pos != len(buf):
+        raise ValueError('malformed hex lines')
+    return lines, buf, offsets
+
+
+def encode_payloads(payloads) -> bytes:
+    """
+    Hex encode a batch of payloads into one block of output
+    :return: one hex line per payload, each terminated by ``\\n``
+    """
+    parts = [binascii.hexlify(payload) for payload in payloads]
+    parts.append(b'')
+    return b'\n'.join(parts)
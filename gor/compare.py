@@ -0,0 +1,212 @@
+# coding: utf-8
+
+import json
+import random
+import hashlib
+import threading
+
+from .body import iter_body
+from .correlation import CorrelationStore
+
+
+class Comparator(object):
+    """
+    Pair responses and replays by message id and compare their status,
+    selected headers and bodies, without any user callback. Bodies are
+    compared after removing transfer and content encodings: equal raw bodies
+    are a match right away, otherwise the decoded bodies are hashed and only
+    bodies whose hashes differ are diffed, structurally for JSON bodies.
+
+    Results are counted in `counts`, and in `stats` when set, differing
+    pairs are sampled into `samples` and appended as JSON lines to
+    `report_path`.
+
+    :param headers: names of the headers to compare
+    :param ignore_fields: JSON keys, or dotted paths such as ``data.0.ts``,
+        left out of body comparisons
+    :param sample_rate: probability for a differing pair to be reported
+    :param max_samples: number of reports kept in `samples`
+    :param max_body_size: decoded bodies larger than this are compared by
+        hash only
+    :param max_pending: number of unpaired messages kept, the least
+        recently updated ones are dropped beyond it
+    :param max_pending_bytes: memory budget of the unpaired messages
+    :param ttl: seconds an unpaired message is kept
+    """
+
+    def __init__(self, headers=(), ignore_fields=(), compare_body: bool = True, sample_rate: float = 1.0,
+                 max_samples: int = 100, report_path: str = None, max_body_size: int = 16 * 1024 * 1024,
+                 max_pending: int = 100000, max_pending_bytes: int = 256 * 1024 * 1024, ttl: float = 60):
+        self.headers = list(headers)
+        self.ignore_fields = frozenset(ignore_fields)
+        self.compare_body = compare_body
+        self.sample_rate = sample_rate
+        self.max_samples = max_samples
+        self.report_path = report_path
+        self.max_body_size = max_body_size
+        self.stats = None
+        self.store = CorrelationStore(self._paired, parts=('response', 'replay'), ttl=ttl,
+                                      max_entries=max_pending, max_bytes=max_pending_bytes)
+        self.counts = dict.fromkeys(('compared', 'match', 'status', 'headers', 'body', 'unpaired'), 0)
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def add(self, msg):
+        """
+        Feed a response or replay, the pair is compared once both arrived
+        """
+        self.store.add(msg)
+
+    def _paired(self, gor, entry):
+        if not entry.complete:
+            with self.lock:
+                self._incr('unpaired')
+            return
+        result = self.compare(entry.parts['response'], entry.parts['replay'])
+        with self.lock:
+            self._record(result)
+
+    def _incr(self, name: str):
+        self.counts[name] += 1
+        if self.stats is not None:
+            self.stats.incr('compare.' + name)
+
+    def _record(self, result: dict) -> dict:
+        self._incr('compared')
+        differs = False
+        for name in ('status', 'headers', 'body'):
+            if name in result:
+                differs = True
+                self._incr(name)
+        if not differs:
+            self._incr('match')
+        elif random.random() < self.sample_rate:
+            if len(self.samples) < self.max_samples:
+                self.samples.append(result)
+            if self.report_path:
+                with open(self.report_path, 'a') as f:
+                    f.write(json.dumps(result, default=repr) + '\n')
+        return result
+
+    def compare(self, resp, replay) -> dict:
+        """
+        :return: a dict holding the id and, for each of ``status``,
+            ``headers`` and ``body`` that differ, a description of the
+            difference
+        """
+        result = {'id': resp.id}
+        if resp.http_status != replay.http_status:
+            result['status'] = [resp.http_status, replay.http_status]
+        if self.headers:
+            a, b = resp.headers, replay.headers
+            diff = {}
+            for name in self.headers:
+                if a.get(name) != b.get(name):
+                    diff[name] = [a.get(name), b.get(name)]
+            if diff:
+                result['headers'] = diff
+        if self.compare_body:
+            diff = self.compare_bodies(resp, replay)
+            if diff is not None:
+                result['body'] = diff
+        return result
+
+    def compare_bodies(self, resp, replay):
+        """
+        :return: None if the bodies are equal, a description of the
+            difference otherwise
+        """
+        if resp.http_body_view == replay.http_body_view:
+            return None
+        if _digest(resp) == _digest(replay):
+            return None
+        a = _decode(resp, self.max_body_size)
+        b = _decode(replay, self.max_body_size)
+        if a is None or b is None:
+            return {'reason': 'body too large to diff'}
+        if _is_json(resp) or _is_json(replay):
+            try:
+                a_json, b_json = json.loads(a), json.loads(b)
+            except ValueError:
+                pass
+            else:
+                diff = json_diff(a_json, b_json, self.ignore_fields)
+                return diff or None
+        offset = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+        return {'size': [len(a), len(b)], 'offset': offset}
+
+    def summary(self) -> dict:
+        return {'counts': dict(self.counts), 'pending': len(self.store), 'samples': list(self.samples)}
+
+
+def _body_pieces(msg):
+    index = msg.headers
+    if index.body_start == -1:
+        return iter(())
+    return iter_body(msg.http, index.body_start,
+                     content_encoding=index.get('Content-Encoding'),
+                     transfer_encoding=index.get('Transfer-Encoding'))
+
+
+def _digest(msg) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        for piece in _body_pieces(msg):
+            h.update(piece)
+    except Exception:
+        # a body which cannot be decoded is compared as it is
+        return hashlib.blake2b(msg.http_body_view, digest_size=16).digest()
+    return h.digest()
+
+
+def _decode(msg, max_size: int) -> bytes:
+    """
+    :return: the decoded body, None if it is larger than `max_size`
+    """
+    pieces, size = [], 0
+    try:
+        for piece in _body_pieces(msg):
+            size += len(piece)
+            if size > max_size:
+                return None
+            pieces.append(piece)
+    except Exception:
+        return bytes(msg.http_body_view)
+    return b''.join(pieces)
+
+
+def _is_json(msg) -> bool:
+    return 'json' in (msg.headers.get('Content-Type') or '')
+
+
+def json_diff(a, b, ignore=frozenset(), path: str = '', limit: int = 20, diff: list = None) -> list:
+    """
+    Compare two decoded JSON documents
+    :param ignore: keys, or dotted paths, to leave out
+    :return: up to `limit` differences as ``{'path', 'response', 'replay'}``
+    """
+    if diff is None:
+        diff = []
+    if len(diff) >= limit:
+        return diff
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in sorted(set(a) | set(b)):
+            sub = path + '.' + key if path else key
+            if key in ignore or sub in ignore:
+                continue
+            if key not in a or key not in b:
+                diff.append({'path': sub, 'response': a.get(key), 'replay': b.get(key)})
+            else:
+                json_diff(a[key], b[key], ignore, sub, limit, diff)
+            if len(diff) >= limit:
+                break
+    elif isinstance(a, list) and isinstance(b, list):
+        for i, (x, y) in enumerate(zip(a, b)):
+            json_diff(x, y, ignore, '%s.%d' % (path, i) if path else str(i), limit, diff)
+            if len(diff) >= limit:
+                break
+        if len(a) != len(b) and len(diff) < limit:
+            diff.append({'path': path + '.length' if path else 'length', 'response': len(a), 'replay': len(b)})
+    elif a != b or type(a) is not type(b):
+        diff.append({'path': path, 'response': a, 'replay': b})
+    return diff
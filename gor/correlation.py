@@ -0,0 +1,185 @@
+# coding: utf-8
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .callback import TYPE_CHANNELS
+
+
+PART_TYPES = {name: _type for _type, name in TYPE_CHANNELS.items()}
+# rough per entry and per part bookkeeping cost, in bytes
+ENTRY_OVERHEAD = 200
+
+
+class PartSummary(object):
+    """
+    Compact record of a message: its first line, selected headers and a hash
+    of its raw body instead of the payload
+    """
+
+    __slots__ = ('id', 'type', 'meta', 'first_line', 'headers', 'body_hash', 'body_size')
+
+    def __init__(self, msg, headers=()):
+        self.id = msg.id
+        self.type = msg.type
+        self.meta = msg.meta
+        # method and path of a request, protocol and status of a response
+        self.first_line = (msg.http_method, msg.http_path)
+        index = msg.headers if headers else None
+        self.headers = {name: index.get(name) for name in headers} if headers else {}
+        body = msg.http_body_view
+        self.body_hash = hashlib.blake2b(body, digest_size=16).digest()
+        self.body_size = len(body)
+
+    def size(self) -> int:
+        return 64 + sum(len(k) + len(v or '') for k, v in self.headers.items()) + sum(map(len, self.first_line))
+
+
+class Correlation(object):
+    """
+    The parts of one message id received so far, `parts` maps channel names
+    (request, response, replay) to what the store keeps of each message
+    """
+
+    __slots__ = ('id', 'created', 'updated', 'parts', 'size', 'complete')
+
+    def __init__(self, _id: str, created: float):
+        self.id = _id
+        self.created = created
+        # time of the last part, entries are ordered by it
+        self.updated = created
+        self.parts = {}
+        self.size = ENTRY_OVERHEAD
+        self.complete = False
+
+
+class CorrelationStore(object):
+    """
+    Collect the request, response and replay of each message id and call
+    ``callback(gor, correlation)`` once all `parts` have arrived, or with
+    ``correlation.complete`` False when an entry got no new part for `ttl`
+    seconds or is evicted, least recently updated first, to stay within
+    `max_entries` and `max_bytes`.
+
+    :param keep: what is stored of each message, ``'message'`` for a copy
+        of the message, ``'summary'`` for a `PartSummary`, or a callable
+        taking the message
+    :param headers: headers kept by ``'summary'``
+    :param fire_partial: also call `callback` for incomplete entries
+    """
+
+    def __init__(self, callback, parts=('request', 'response', 'replay'), ttl: float = 60,
+                 max_entries: int = 100000, max_bytes: int = 256 * 1024 * 1024, keep='message',
+                 headers=(), fire_partial: bool = True):
+        self.callback = callback
+        self.types = frozenset(PART_TYPES[p] for p in parts)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.headers = tuple(headers)
+        self.fire_partial = fire_partial
+        self.gor = None
+        self.stats = None
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.counts = dict.fromkeys(('complete', 'expired', 'evicted'), 0)
+        self.lock = threading.Lock()
+
+    def _store(self, msg):
+        if self.keep == 'message':
+            # a copy, not a view on the whole input chunk
+            part = type(msg).from_payload(msg.payload)
+            return part, len(part.payload)
+        if self.keep == 'summary':
+            part = PartSummary(msg, self.headers)
+            return part, part.size()
+        part = self.keep(msg)
+        try:
+            return part, len(part)
+        except TypeError:
+            return part, ENTRY_OVERHEAD
+
+    def add(self, msg):
+        """
+        Record `msg` if its type is one of the expected parts, firing the
+        callback of its entry once complete
+        """
+        if msg.type not in self.types:
+            return
+        part, size = self._store(msg)
+        now = time.monotonic()
+        done = []
+        with self.lock:
+            entry = self.entries.get(msg.id)
+            if entry is None:
+                entry = self.entries[msg.id] = Correlation(msg.id, now)
+                self.bytes += entry.size
+            else:
+                self.entries.move_to_end(msg.id)
+                entry.updated = now
+            # a duplicate part replaces the previous one, its size stays
+            # accounted until the entry leaves the store
+            entry.parts[TYPE_CHANNELS[msg.type]] = part
+            entry.size += size
+            self.bytes += size
+            if len(entry.parts) == len(self.types):
+                del self.entries[msg.id]
+                self.bytes -= entry.size
+                entry.complete = True
+                self._done('complete', entry, done)
+            self._expire(now, done)
+        self._fire(done)
+
+    def _expire(self, now: float, done: list):
+        entries = self.entries
+        deadline = now - self.ttl
+        while entries:
+            entry = next(iter(entries.values()))
+            if entry.updated <= deadline:
+                reason = 'expired'
+            elif len(entries) > self.max_entries or self.bytes > self.max_bytes:
+                reason = 'evicted'
+            else:
+                break
+            entries.popitem(last=False)
+            self.bytes -= entry.size
+            self._done(reason, entry, done)
+
+    def _done(self, reason: str, entry: Correlation, done: list):
+        self.counts[reason] += 1
+        if self.stats is not None:
+            self.stats.incr('correlation.' + reason)
+        if entry.complete or self.fire_partial:
+            done.append(entry)
+
+    def expire(self, now: float = None):
+        """
+        Fire the entries which got no new part for `ttl` seconds
+        """
+        done = []
+        with self.lock:
+            self._expire(time.monotonic() if now is None else now, done)
+        self._fire(done)
+
+    def close(self):
+        """
+        Fire every pending entry as incomplete
+        """
+        done = []
+        with self.lock:
+            for entry in self.entries.values():
+                self._done('expired', entry, done)
+            self.entries.clear()
+            self.bytes = 0
+        self._fire(done)
+
+    def _fire(self, done: list):
+        # callbacks run outside the lock, they may feed the store again
+        for entry in done:
+            self.callback(self.gor, entry)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,265 @@
+# coding: utf-8
+
+import re
+from urllib.parse import quote_plus, urlparse, parse_qs
+
+
+def set_query_param(path_qs: str, name: str, value: str) -> str:
+    """
+    Replace the value of query param `name` in `path_qs`, or append it
+    """
+    new_path = re.sub(name + '=([^&$]+)',
+                      name + '=' + quote_plus(value),
+                      path_qs)
+    if new_path == path_qs:
+        if '?' not in new_path:
+            new_path += '?'
+        else:
+            new_path += '&'
+        new_path += name + '=' + quote_plus(value)
+    return new_path
+
+
+class HttpHeader(object):
+
+    __slots__ = ('name', 'value', 'start', 'value_start', 'end', 'changed')
+
+    def __init__(self, name: str, value: str, start: int = -1, value_start: int = -1, end: int = -1):
+        self.name = name
+        self.value = value
+        self.start = start
+        self.value_start = value_start
+        self.end = end
+        self.changed = False
+
+
+class HeaderIndex(object):
+    """
+    Case-insensitive index over the header block of an HTTP payload, built in
+    a single pass with ``bytes.find``. Edits are recorded on the index and the
+    payload is serialized back once with :meth:`to_bytes`.
+    """
+
+    __slots__ = ('payload', 'headers', 'index', 'added', 'dirty', 'head_start', 'body_start')
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.headers = []
+        self.index = {}
+        self.added = []
+        self.dirty = False
+
+        self.body_start = -1
+
+        line_end = payload.find(b'\n')
+        self.head_start = len(payload) if line_end == -1 else line_end + 1
+        pos = self.head_start
+        while True:
+            end = payload.find(b'\n', pos)
+            if end == -1:
+                break
+            end += 1
+            sep = payload.find(b':', pos, end)
+            if sep == -1:
+                # an empty line ends the header block
+                if not payload[pos:end].strip():
+                    self.body_start = end
+                    break
+            else:
+                name = payload[pos:sep].decode()
+                header = HttpHeader(name, payload[sep+1:end].strip().decode(), pos, sep + 1, end)
+                self.headers.append(header)
+                self.index.setdefault(name.lower(), []).append(header)
+            pos = end
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.index
+
+    def find(self, name: str) -> HttpHeader:
+        """
+        :return: the first header called `name`, or None
+        """
+        headers = self.index.get(name.lower())
+        return headers[0] if headers else None
+
+    def get(self, name: str, default: str = None) -> str:
+        headers = self.index.get(name.lower())
+        return headers[0].value if headers else default
+
+    def items(self):
+        for header in self.added[::-1]:
+            yield header.name, header.value
+        for header in self.headers:
+            if header.value is not None:
+                yield header.name, header.value
+
+    def set(self, name: str, value: str):
+        """
+        Replace the value of the first header called `name`, new headers are
+        inserted right after the start line
+        """
+        header = self.find(name)
+        if header is None:
+            header = HttpHeader(name, value)
+            self.added.append(header)
+            self.index[name.lower()] = [header]
+        else:
+            header.value = value
+        header.changed = True
+        self.dirty = True
+
+    def delete(self, name: str):
+        headers = self.index.get(name.lower())
+        if not headers:
+            return
+        header = headers.pop(0)
+        if not headers:
+            del self.index[name.lower()]
+        if header.start == -1:
+            self.added.remove(header)
+        else:
+            header.value = None
+            header.changed = True
+        self.dirty = True
+
+    def to_bytes(self, start_line: bytes = None, body: bytes = None) -> bytes:
+        """
+        Serialize the payload with all recorded header edits applied
+        :param start_line: replacement for the first line, including its line break
+        :param body: replacement for the body
+        """
+        if not self.dirty and start_line is None and body is None:
+            return self.payload
+        payload = self.payload
+        parts = [payload[:self.head_start] if start_line is None else start_line]
+        for header in self.added[::-1]:
+            parts.append(header.name.encode() + b': ' + header.value.encode() + b'\r\n')
+        run_start = self.head_start
+        for header in self.headers:
+            if not header.changed:
+                continue
+            parts.append(payload[run_start:header.start])
+            if header.value is not None:
+                parts.append(payload[header.start:header.value_start] + b' ' + header.value.encode() + b'\r\n')
+            run_start = header.end
+        if body is None:
+            parts.append(payload[run_start:])
+        elif self.body_start == -1:
+            parts += [payload[run_start:], b'\r\n\r\n', body]
+        else:
+            parts += [payload[run_start:self.body_start], body]
+        return b''.join(parts)
+
+
+class HttpMessage(object):
+    """
+    Editor for an HTTP payload such as ``GorMessage.http``. Changes to the
+    start line, query params, headers, cookies and body are only recorded,
+    :meth:`to_bytes` rebuilds the payload in one join and recomputes
+    Content-Length once if the body was replaced.
+
+        req = HttpMessage(msg.http)
+        req.path = '/v2' + req.path
+        req.set_header('X-Replayed', '1')
+        req.set_cookie('session', 'test')
+        req.body = b'{}'
+        msg.http = req.to_bytes()
+    """
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.headers = HeaderIndex(payload)
+        first_line = payload[:self.headers.head_start]
+        stripped = first_line.rstrip(b'\r\n')
+        self._line_break = first_line[len(stripped):]
+        parts = stripped.split(b' ', 2)
+        self._first_line = [p.decode() for p in parts] + [''] * (3 - len(parts))
+        self._first_line_changed = False
+        self._body = None
+
+    def _set_first_line(self, pos: int, value):
+        if isinstance(value, bytes):
+            value = value.decode()
+        self._first_line[pos] = value
+        self._first_line_changed = True
+
+    @property
+    def method(self) -> str:
+        return self._first_line[0]
+
+    @method.setter
+    def method(self, value: str):
+        self._set_first_line(0, value)
+
+    @property
+    def path(self) -> str:
+        return self._first_line[1]
+
+    @path.setter
+    def path(self, value: str):
+        self._set_first_line(1, value)
+
+    @property
+    def status(self) -> str:
+        """
+        HTTP response have status code in same position as `path` for requests
+        """
+        return self._first_line[1]
+
+    @status.setter
+    def status(self, value: str):
+        self._set_first_line(1, value)
+
+    def path_param(self, name: str):
+        return parse_qs(urlparse(self.path).query).get(name)
+
+    def set_path_param(self, name: str, value: str):
+        self.path = set_query_param(self.path, name, value)
+
+    def header(self, name: str, default: str = None) -> str:
+        return self.headers.get(name, default)
+
+    def set_header(self, name: str, value: str):
+        self.headers.set(name, value)
+
+    def delete_header(self, name: str):
+        self.headers.delete(name)
+
+    def _cookies(self):
+        cookies = self.headers.get('Cookie') or ''
+        return [item for item in cookies.split('; ') if item]
+
+    def cookie(self, name: str) -> str:
+        for item in self._cookies():
+            if item.startswith(name + '='):
+                return item[item.index('=')+1:]
+        return None
+
+    def set_cookie(self, name: str, value: str):
+        cookies = [x for x in self._cookies() if not x.startswith(name + '=')]
+        cookies.append(name + '=' + value)
+        self.headers.set('Cookie', '; '.join(cookies))
+
+    def delete_cookie(self, name: str):
+        cookies = [x for x in self._cookies() if not x.startswith(name + '=')]
+        self.headers.set('Cookie', '; '.join(cookies))
+
+    @property
+    def body(self) -> bytes:
+        if self._body is not None:
+            return self._body
+        if self.headers.body_start == -1:
+            return b''
+        return self.payload[self.headers.body_start:]
+
+    @body.setter
+    def body(self, value: bytes):
+        self._body = value
+
+    def to_bytes(self) -> bytes:
+        start_line = None
+        if self._first_line_changed:
+            start_line = ' '.join(p for p in self._first_line if p).encode() + self._line_break
+        if self._body is not None:
+            self.headers.set('Content-Length', str(len(self._body)))
+        return self.headers.to_bytes(start_line, self._body)
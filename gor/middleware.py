@@ -2,3 +2,4 @@
 
 from .asyncio_impl import AsyncioGor
 from .multiprocess_impl import MultiProcessGor
+from .threadpool_impl import ThreadPoolGor
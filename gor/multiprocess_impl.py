@@ -1,65 +1,304 @@
 # coding: utf-8
 
-import sys
+import time
+import pickle
+import struct
+import binascii
+import threading
+import queue as queue_mod
 import multiprocessing
 
-from .base import Gor
+from .base import Gor, GorMessage
+from .channel import make_channel
+from .stats import Stats
+from .autoscale import Autoscaler, HashRing, StickyRouter
+from .writer import Reassembler, SequencedWriter, iter_results, STATS_SEQ
+from .overflow import DROP_NEWEST, DROP_OLDEST
 from .callback import MultiProcessCallbackContainer
 
 
-EXIT_MSG = ""
+EXIT_MSG = b""
+# sequence number prefixed to every message handed to a worker
+SEQ = struct.Struct('<Q')
+
 
 class MultiProcessGor(Gor):
 
     def __init__(self, *args, **kwargs):
-        chan_container = MultiProcessCallbackContainer(multiprocessing.Manager())
+        chan_container = MultiProcessCallbackContainer(**kwargs)
         super(MultiProcessGor, self).__init__(chan_container, *args, **kwargs)
         self.concurrency = kwargs.get('concurrency', 2)
+        self.channel = kwargs.get('channel', 'shm')
+        self.channel_size = kwargs.get('channel_size', 4 * 1024 * 1024)
+        self.output = Reassembler(self.writer,
+                                  ordered=kwargs.get('ordered', False),
+                                  window=kwargs.get('reorder_window', 1024))
+        self.seq = 0
         self.workers = []
         self.queues = []
+        self.results = []
+        self.collectors = []
+        autoscaler = kwargs.get('autoscale')
+        if isinstance(autoscaler, dict):
+            autoscaler = Autoscaler(**autoscaler)
+        self.autoscaler = autoscaler
+        self.router = None
+        if autoscaler is not None:
+            self.concurrency = min(max(self.concurrency, autoscaler.min_workers), autoscaler.max_workers)
+            self.router = StickyRouter(HashRing(range(self.concurrency)), autoscaler.sticky_ttl,
+                                       autoscaler.max_ids)
+        # worker slots no longer taking new ids, and those idle out of the
+        # ring; with an autoscaler `max_workers` workers are forked upfront,
+        # before any thread starts, and resizing only moves slots in and out
+        # of the ring, so no process is forked or joined while threads run
+        self.draining = set()
+        self.parked = set()
+        # send time of sampled sequence numbers, for the autoscaler latency
+        self._sent = {}
+        self._latencies = []
+        # wakes the flusher thread up once the parent queued output itself
+        self._flush_wanted = threading.Event()
+        self._stopped = threading.Event()
 
     def _stdin_reader(self):
+        next_check = time.monotonic() + self.autoscaler.interval if self.autoscaler is not None else None
+        try:
+            for chunk in self._read_chunks():
+                if next_check is not None:
+                    self.router.tick()
+                    if self.router.now >= next_check:
+                        self._autoscale()
+                        next_check = self.router.now + self.autoscaler.interval
+                for msg in self.filter_messages(self.sample_messages(chunk)):
+                    if not self.chan_container.ch and self.comparator is None and not self.correlations:
+                        # no callback registered, nothing to hand to a worker
+                        self._passthrough(msg)
+                        continue
+                    # messages with the same id must be processed in serializable way
+                    if self.router is None:
+                        queue = self.queues[hash(msg.id) % len(self.queues)]
+                    else:
+                        queue = self.queues[self.router.route(msg.id, msg.type)]
+                    if self.queue_size and len(queue) >= self.queue_size:
+                        action = self.overflow.on_full()
+                        if action == DROP_NEWEST:
+                            continue
+                        if action == DROP_OLDEST:
+                            # the worker discards it, still reporting its sequence number
+                            queue.skip_oldest()
+                        else:
+                            queue.wait_below(self.queue_size)
+                    seq = self.seq
+                    self.seq += 1
+                    if self.router is not None and not seq & 63:
+                        self._sent[seq] = time.monotonic()
+                    queue.put(SEQ.pack(seq), msg.payload_view)
+        except KeyboardInterrupt:
+            pass
+        self._stop()
+
+    def _active(self):
+        return [i for i in range(len(self.queues)) if i not in self.draining and i not in self.parked]
+
+    def _autoscale(self):
+        """
+        Park the drained workers, then add or drain one worker depending on
+        the load. A drained worker leaves the hash ring at once but is only
+        parked once no id is pinned to it any more.
+        """
+        for i in list(self.draining):
+            if self.router.pinned(i) == 0:
+                self.draining.discard(i)
+                self.parked.add(i)
+        active = self._active()
+        depth = sum(len(self.queues[i]) for i in active) / len(active)
+        latencies, self._latencies = self._latencies, []
+        latency = sorted(latencies)[int(len(latencies) * 0.9)] if latencies else None
+        decision = self.autoscaler.decide(len(active), depth, latency, self.router.now)
+        if decision > 0:
+            # a parked worker, or one still draining which keeps its pinned ids
+            slot = min(self.parked or self.draining)
+            self.parked.discard(slot)
+            self.draining.discard(slot)
+            self.router.ring.add(slot)
+        elif decision < 0:
+            slot = active[-1]
+            self.router.ring.remove(slot)
+            self.draining.add(slot)
+        if decision and self.stats is not None:
+            self.stats.incr('autoscale.up' if decision > 0 else 'autoscale.down')
+
+    def _passthrough(self, msg):
+        if msg.raw_line is not None:
+            self._passthrough_line(msg.raw_line)
+        else:
+            self._passthrough_line(binascii.hexlify(msg.payload))
+
+    def _passthrough_line(self, line: bytes):
+        seq = self.seq
+        self.seq += 1
+        self.output.add(((seq, (line, b'\n')),))
+        self._flush_wanted.set()
+
+    def _flusher(self):
+        """
+        Flush the output on its latency bound while no worker result comes
+        in to wake a collector up, e.g. for lines passed through by the parent
+        """
+        while True:
+            self._flush_wanted.wait()
+            self._flush_wanted.clear()
+            timeout = self.output.timeout()
+            while timeout is not None and not self._stopped.is_set():
+                self._stopped.wait(timeout)
+                self.output.flush_if_due()
+                timeout = self.output.timeout()
+            if self._stopped.is_set():
+                return
+
+    def _worker(self, queue, results):
+        # worker output is handed back to the parent, the only process
+        # writing to stdout
+        self.writer = SequencedWriter(results, batch_size=self.writer.batch_size,
+                                      max_latency_us=self.writer.max_latency * 1e6)
+        next_report = None
+        if self.stats is not None:
+            # stats are collected per worker and merged by the parent
+            self.stats = self.chan_container.stats = Stats()
+            if self.comparator is not None:
+                self.comparator.stats = self.stats
+            for store in self.correlations:
+                store.stats = self.stats
+            next_report = time.monotonic() + self.stats_reporter.interval
+        # per-id channels registered here are expired here
+        next_expire = time.monotonic() + self.expire_interval if self._needs_expiry() else None
         while True:
+            timeout = self.writer.timeout()
+            if next_report is not None or next_expire is not None:
+                now = time.monotonic()
+                if next_report is not None and now >= next_report:
+                    self.writer.write_stats(pickle.dumps(self.stats.snapshot()))
+                    next_report = now + self.stats_reporter.interval
+                if next_expire is not None and now >= next_expire:
+                    self.expire(now)
+                    next_expire = now + self.expire_interval
+                timeout = self.writer.timeout()
+                for deadline in (next_report, next_expire):
+                    if deadline is not None:
+                        timeout = deadline - now if timeout is None else min(timeout, deadline - now)
             try:
-                line = sys.stdin.readline()
+                data = queue.get(timeout=timeout)
+            except queue_mod.Empty:
+                self.writer.flush_if_due()
+                continue
             except KeyboardInterrupt:
-                self._stop()
                 break
-            if not line:
-                self._stop()
+            if data == EXIT_MSG:
                 break
-            msg = self.parse_message(line)
-            if msg:
-                # messages with the same id must be processed in serializable way
-                index = hash(msg.id) % len(self.queues)
-                self.queues[index].put(msg)
+            seq = SEQ.unpack_from(data)[0]
+            self.writer.seq = seq
+            if queue.should_skip():
+                # dropped by the parent's overflow policy
+                self.writer.write()
+                continue
+            try:
+                self.emit(GorMessage.from_payload(data, SEQ.size))
+            except Exception:
+                # the payload in `data` is left as it came in
+                self._callback_error(None, memoryview(data)[SEQ.size:])
+            if self.writer.last_seq != seq:
+                # let the parent know this message has no output
+                self.writer.write()
+        self._close_correlations()
+        if self.stats is not None:
+            self.writer.write_stats(pickle.dumps(self.stats.snapshot()))
+        self.writer.flush()
+        results.put(EXIT_MSG)
 
-    def _worker(self, queue):
+    def _collector(self, results):
         while True:
             try:
-                msg = queue.get()
-            except KeyboardInterrupt:
-                break
-            try:
-                if msg == EXIT_MSG:
-                    return
-                self.emit(msg)
-            finally:
-                queue.task_done()
+                batch = results.get(timeout=self.output.timeout())
+            except queue_mod.Empty:
+                self.output.flush_if_due()
+                continue
+            if batch == EXIT_MSG:
+                return
+            items = iter_results(batch)
+            if self.stats_reporter is not None:
+                items = self._filter_stats(items)
+            if self.router is not None:
+                items = self._track_latency(items)
+            self.output.add(items)
+
+    def _track_latency(self, results):
+        now = time.monotonic()
+        for seq, data in results:
+            sent = self._sent.pop(seq, None)
+            if sent is not None:
+                self._latencies.append(now - sent)
+            yield seq, data
+
+    def _filter_stats(self, results):
+        for seq, data in results:
+            if seq == STATS_SEQ:
+                self.stats_reporter.update(pickle.loads(data))
+            else:
+                yield seq, data
 
     def _stop(self):
         for queue in self.queues:
             queue.put(EXIT_MSG)
-            queue.join()
+
+    def _start_worker(self) -> int:
+        """
+        Fork a worker, its collector thread is started by `run` once every
+        worker is forked
+        :return: the slot of the new worker
+        """
+        i = len(self.queues)
+        # decoded payloads are handed to the workers through shared memory
+        # rings, falling back to multiprocessing queues where unavailable
+        queue = make_channel(self.channel, self.channel_size)
+        results = make_channel(self.channel, self.channel_size)
+        worker = multiprocessing.Process(target=self._worker, args=(queue, results))
+        collector = threading.Thread(target=self._collector, args=(results,), daemon=True)
+        self.queues.append(queue)
+        self.results.append(results)
+        self.workers.append(worker)
+        self.collectors.append(collector)
+        if self.stats is not None:
+            self.stats.gauge('queue.%d' % i, queue.__len__)
+        worker.start()
+        return i
 
     def run(self):
-        for i in range(self.concurrency):
-            queue = multiprocessing.JoinableQueue()
-            worker = multiprocessing.Process(target=self._worker, args=(queue,))
-            self.queues.append(queue)
-            self.workers.append(worker)
-        for worker in self.workers:
-            worker.start()
-        self._stdin_reader()
-        for worker in self.workers:
-            worker.join()
+        # fork before starting any thread, a child forked while another
+        # thread holds a lock would inherit it locked
+        workers = self.autoscaler.max_workers if self.autoscaler is not None else self.concurrency
+        for i in range(workers):
+            self._start_worker()
+        self.parked.update(range(self.concurrency, workers))
+        for collector in self.collectors:
+            collector.start()
+        if self.stats_reporter is not None:
+            self.stats_reporter.start()
+        flusher = threading.Thread(target=self._flusher, name='gor-flusher', daemon=True)
+        flusher.start()
+        try:
+            self._stdin_reader()
+            for worker in self.workers:
+                worker.join()
+            for collector in self.collectors:
+                collector.join()
+            self._stopped.set()
+            self._flush_wanted.set()
+            flusher.join()
+            self.output.close()
+            self._close_output()
+            if self.stats_reporter is not None:
+                self.stats_reporter.stop()
+        finally:
+            for channel in self.queues + self.results:
+                channel.close()
+                channel.unlink()
@@ -0,0 +1,53 @@
+# coding: utf-8
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+SAMPLE = 'sample'
+
+POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, SAMPLE)
+
+
+class OverflowPolicy(object):
+    """
+    What to do with a message arriving while its worker queue is full:
+
+    - ``block``: wait for room, which stops reading stdin and pushes back on
+      GoReplay through the pipe
+    - ``drop_newest``: drop the incoming message
+    - ``drop_oldest``: drop the oldest queued message to make room
+    - ``sample``: keep one message in `sample` (waiting for room for it) and
+      drop the others
+
+    `dropped` and `delayed` count the messages dropped and those the reader
+    had to wait for.
+    """
+
+    def __init__(self, policy: str = BLOCK, sample: int = 10):
+        if policy not in POLICIES:
+            raise ValueError('unknown overflow policy %r, expected one of %s' % (policy, ', '.join(POLICIES)))
+        self.policy = policy
+        self.sample = max(1, sample)
+        self.stats = None
+        self.dropped = 0
+        self.delayed = 0
+        self._overflows = 0
+
+    def on_full(self) -> str:
+        """
+        :return: `BLOCK`, `DROP_NEWEST` or `DROP_OLDEST`, the action to take
+            for a message arriving while its queue is full
+        """
+        action = self.policy
+        if action == SAMPLE:
+            self._overflows += 1
+            action = BLOCK if self._overflows % self.sample == 0 else DROP_NEWEST
+        if action == BLOCK:
+            self.delayed += 1
+            name = 'overflow.delayed'
+        else:
+            self.dropped += 1
+            name = 'overflow.dropped'
+        if self.stats is not None:
+            self.stats.incr(name)
+        return action
@@ -0,0 +1,190 @@
+# coding: utf-8
+
+import re
+import json
+from urllib.parse import urlparse, parse_qs
+
+from .http_message import HttpMessage
+
+
+TYPES = {'request': '1', 'response': '2', 'replay': '3'}
+
+DROP = 'drop'
+PASS = 'pass'
+REWRITE = 'rewrite'
+
+
+class Rule(object):
+    """
+    One compiled rule, see `RuleSet` for the config format
+    """
+
+    __slots__ = ('name', 'types', 'line', 'line_regex', 'headers', 'query', 'action', 'rewrite', 'then')
+
+    def __init__(self, config: dict, index: int = 0):
+        match = config.get('match', {})
+        self.name = config.get('name', 'rule%d' % index)
+        types = match.get('type', 'request')
+        if isinstance(types, str):
+            types = [types]
+        self.types = [TYPES.get(t, t) for t in types]
+        self.line = _line_pattern(match)
+        self.line_regex = re.compile(self.line)
+        self.headers = [(name, _value_matcher(value)) for name, value in match.get('header', {}).items()]
+        self.query = [(name, _value_matcher(value)) for name, value in match.get('query', {}).items()]
+        self.action = config.get('action', PASS)
+        if self.action not in (DROP, PASS, REWRITE):
+            raise ValueError('unknown action %r in rule %s' % (self.action, self.name))
+        self.rewrite = config.get('rewrite', {})
+        self.then = config.get('then', 'continue')
+
+    def match_rest(self, msg) -> bool:
+        """
+        Check the header and query conditions, the line was matched already
+        """
+        if self.headers:
+            index = msg.headers
+            for name, matcher in self.headers:
+                if not matcher(index.get(name)):
+                    return False
+        if self.query:
+            params = parse_qs(urlparse(msg.http_path).query)
+            for name, matcher in self.query:
+                values = params.get(name)
+                if not matcher(values[0] if values else None):
+                    return False
+        return True
+
+    def apply_rewrite(self, msg):
+        req = HttpMessage(msg.http)
+        rewrite = self.rewrite
+        if 'method' in rewrite:
+            req.method = rewrite['method']
+        if 'path_prefix' in rewrite:
+            old, new = rewrite['path_prefix']
+            if req.path.startswith(old):
+                req.path = new + req.path[len(old):]
+        if 'path' in rewrite:
+            req.path = rewrite['path']
+        for name, value in rewrite.get('set_query', {}).items():
+            req.set_path_param(name, value)
+        for name, value in rewrite.get('set_header', {}).items():
+            req.set_header(name, value)
+        for name in rewrite.get('delete_header', []):
+            req.delete_header(name)
+        msg.http = req.to_bytes()
+
+
+def _line_pattern(match: dict) -> str:
+    methods = match.get('method')
+    if isinstance(methods, str):
+        methods = [methods]
+    pattern = '(?:%s) ' % '|'.join(re.escape(m) for m in methods) if methods else '[^ ]* '
+    if 'path_prefix' in match:
+        pattern += re.escape(match['path_prefix'])
+    elif 'path_regex' in match:
+        pattern += '(?:%s)' % match['path_regex']
+    elif not methods:
+        return ''
+    return pattern
+
+
+def _value_matcher(value):
+    if value is None:
+        return lambda v: v is None
+    if isinstance(value, dict):
+        if 'regex' in value:
+            regex = re.compile(value['regex'])
+            return lambda v: v is not None and regex.search(v) is not None
+        if 'prefix' in value:
+            prefix = value['prefix']
+            return lambda v: v is not None and v.startswith(prefix)
+        if value.get('present'):
+            return lambda v: v is not None
+        raise ValueError('unknown value condition %r' % value)
+    value = str(value)
+    return lambda v: v == value
+
+
+class RuleSet(object):
+    """
+    Filter and rewrite rules applied to every message before any callback
+    is dispatched. The first matching rule wins. Rules are loaded from a
+    JSON list, or a JSON object holding it under ``rules``:
+
+    .. code-block:: json
+
+        [
+            {"match": {"method": ["OPTIONS", "HEAD"]}, "action": "drop"},
+            {"match": {"path_prefix": "/static/"}, "action": "pass"},
+            {"match": {"path_prefix": "/api/v1/", "header": {"X-Debug": {"present": true}}},
+             "action": "rewrite",
+             "rewrite": {"path_prefix": ["/api/v1/", "/api/v2/"], "delete_header": ["X-Debug"]}}
+        ]
+
+    ``match`` accepts ``type`` (request, response or replay, defaults to
+    request), ``method``, ``path_prefix`` or ``path_regex`` (matched from the
+    start of the path), and ``header`` and ``query`` conditions whose values
+    are either exact strings, ``null`` for absent, or ``{"regex": ...}``,
+    ``{"prefix": ...}``, ``{"present": true}``. ``drop`` discards the message, ``pass`` outputs
+    it unchanged, both skip the callbacks. ``rewrite`` edits the message then
+    dispatches it, or outputs it right away with ``"then": "pass"``.
+
+    The method and path conditions of all rules of a message type are
+    compiled into one regular expression, so a message matching no rule
+    costs a single regex match on its request line.
+    """
+
+    def __init__(self, rules):
+        self.rules = [r if isinstance(r, Rule) else Rule(r, i) for i, r in enumerate(rules)]
+        self.matchers = {}
+        for _type in set(t for rule in self.rules for t in rule.types):
+            rules = [rule for rule in self.rules if _type in rule.types]
+            regex = re.compile('|'.join('(?P<r%d>%s)' % (i, rule.line) for i, rule in enumerate(rules)))
+            # group number of each alternative -> position of its rule
+            groups = {regex.groupindex['r%d' % i]: i for i in range(len(rules))}
+            self.matchers[_type] = (regex, groups, rules)
+
+    @classmethod
+    def load(cls, path: str) -> 'RuleSet':
+        with open(path) as f:
+            config = json.load(f)
+        if isinstance(config, dict):
+            config = config.get('rules', [])
+        return cls(config)
+
+    def match(self, msg) -> Rule:
+        """
+        :return: the first rule matching `msg`, or None
+        """
+        matcher = self.matchers.get(msg.type)
+        if matcher is None:
+            return None
+        regex, groups, rules = matcher
+        line = msg.http_method + ' ' + msg.http_path if msg.type == '1' else ''
+        m = regex.match(line)
+        if m is None:
+            return None
+        first = groups[m.lastindex]
+        rule = rules[first]
+        if rule.match_rest(msg):
+            return rule
+        # the first candidate failed on its headers or query, try the rest
+        for rule in rules[first + 1:]:
+            if rule.line_regex.match(line) and rule.match_rest(msg):
+                return rule
+        return None
+
+    def apply(self, msg) -> str:
+        """
+        Run the first rule matching `msg`
+        :return: `DROP` or `PASS` when the message must skip the callbacks,
+            None otherwise
+        """
+        rule = self.match(msg)
+        if rule is None:
+            return None
+        if rule.action == REWRITE:
+            rule.apply_rewrite(msg)
+            return PASS if rule.then == PASS else None
+        return rule.action
@@ -0,0 +1,172 @@
+# coding: utf-8
+
+import time
+import zlib
+import binascii
+from collections import OrderedDict
+
+
+# hex characters decoded to read the meta line and the request line
+HEAD_SIZE = 1024
+# resolution of the hash-of-id sampling rate
+SAMPLE_SCALE = 10000
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` messages per second on average, up to `burst` at once, a
+    rate of 0 allows none
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        if rate > 0:
+            self.burst = max(1.0, self.burst)
+        self.tokens = self.burst
+        self.updated = None
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def charge(self, now: float):
+        """
+        Spend a token even if none is left, for messages which must follow
+        an earlier decision
+        """
+        self._refill(now)
+        self.tokens -= 1
+
+
+def read_head(line: bytes):
+    """
+    Decode just enough of a hex line to read its meta and request line
+    :return: the type, the id and the path of the message, the path is None
+        for responses and replays
+    """
+    head = line[:HEAD_SIZE]
+    return parse_head(binascii.unhexlify(head[:len(head) & ~1]))
+
+
+def parse_head(head: bytes):
+    """
+    Same as `read_head`, on the start of a decoded payload
+    """
+    meta_end = head.find(b'\n')
+    meta = head[:meta_end].split(b' ', 2)
+    if meta_end == -1 or len(meta) < 2:
+        raise ValueError('no meta line')
+    path = None
+    if meta[0] == b'1':
+        first_line = head[meta_end + 1:].split(b' ', 2)
+        path = first_line[1] if len(first_line) > 1 else b''
+    return meta[0], meta[1], path
+
+
+class Sampler(object):
+    """
+    Decide from the head of a hex line, before it is decoded, whether a
+    message is dispatched to callbacks or written out untouched.
+
+    :param rate: fraction of ids kept, decided on a hash of the id so the
+        request, response and replay of an id are kept or left out together
+    :param paths: ``{path_prefix: rate}`` or ``{path_prefix: [rate, burst]}``,
+        token buckets limiting the requests per second under each prefix,
+        the longest matching prefix applies
+    :param max_rate: messages per second dispatched at most, all paths
+        included
+    :param burst: messages dispatched at once at most under `max_rate`
+    :param max_ids: rate limiting decisions remembered for the response and
+        replay of a request
+
+    `skipped` and `limited` count the messages left out by `rate` and by the
+    token buckets.
+    """
+
+    def __init__(self, rate: float = 1.0, paths: dict = None, max_rate: float = None, burst: float = None,
+                 max_ids: int = 100000):
+        self.threshold = int(rate * SAMPLE_SCALE)
+        buckets = []
+        for prefix, limit in (paths or {}).items():
+            limit = limit if isinstance(limit, (list, tuple)) else (limit,)
+            buckets.append((prefix.encode() if isinstance(prefix, str) else prefix, TokenBucket(*limit)))
+        self.paths = sorted(buckets, key=lambda b: -len(b[0]))
+        self.bucket = TokenBucket(max_rate, burst) if max_rate is not None else None
+        self.limits = bool(self.paths) or self.bucket is not None
+        self.max_ids = max_ids
+        self.decisions = OrderedDict()
+        self.stats = None
+        self.skipped = 0
+        self.limited = 0
+        self.now = time.monotonic()
+
+    def tick(self, now: float = None):
+        """
+        Set the time token buckets are refilled to, once per chunk
+        """
+        self.now = time.monotonic() if now is None else now
+
+    def keep(self, line: bytes) -> bool:
+        """
+        :return: whether the message of hex `line` is dispatched
+        """
+        try:
+            head = read_head(line)
+        except (ValueError, binascii.Error):
+            # let the parser report it
+            return True
+        return self._keep(*head)
+
+    def keep_payload(self, payload) -> bool:
+        """
+        :return: whether the message of decoded `payload` is dispatched
+        """
+        try:
+            head = parse_head(bytes(payload[:HEAD_SIZE >> 1]))
+        except ValueError:
+            return True
+        return self._keep(*head)
+
+    def _keep(self, _type: bytes, _id: bytes, path: bytes) -> bool:
+        if self.threshold < SAMPLE_SCALE and zlib.crc32(_id) % SAMPLE_SCALE >= self.threshold:
+            self._count('skipped')
+            return False
+        if not self.limits:
+            return True
+        if path is not None:
+            keep = self._admit(path)
+            self.decisions[_id] = keep
+            if len(self.decisions) > self.max_ids:
+                self.decisions.popitem(last=False)
+        else:
+            keep = self.decisions.get(_id)
+            if keep is None:
+                # the request was not seen
+                keep = self.bucket is None or self.bucket.take(self.now)
+            elif keep and self.bucket is not None:
+                self.bucket.charge(self.now)
+        if not keep:
+            self._count('limited')
+        return keep
+
+    def _admit(self, path: bytes) -> bool:
+        for prefix, bucket in self.paths:
+            if path.startswith(prefix):
+                if not bucket.take(self.now):
+                    return False
+                break
+        return self.bucket is None or self.bucket.take(self.now)
+
+    def _count(self, name: str):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.stats is not None:
+            self.stats.incr('sampling.' + name)
@@ -0,0 +1,199 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import time
+import threading
+
+
+class Histogram(object):
+    """
+    Latency histogram with power of two buckets in microseconds, cheap enough
+    to record every message.
+    """
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * 40
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1e6)
+        self.buckets[min(us.bit_length(), 39)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def snapshot(self) -> dict:
+        return {
+            'buckets': list(self.buckets),
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+        }
+
+
+def merge_histograms(snapshots) -> dict:
+    merged = Histogram().snapshot()
+    for snap in snapshots:
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], snap['buckets'])]
+        merged['count'] += snap['count']
+        merged['total'] += snap['total']
+        merged['max'] = max(merged['max'], snap['max'])
+    return merged
+
+
+def percentile(snap: dict, p: float) -> float:
+    """
+    :return: upper bound in microseconds of the bucket holding the `p`
+        percentile of a histogram snapshot
+    """
+    rank = snap['count'] * p / 100.0
+    seen = 0
+    for i, n in enumerate(snap['buckets']):
+        seen += n
+        if n and seen >= rank:
+            return float((1 << i) - 1) if i else 0.0
+    return 0.0
+
+
+class Stats(object):
+    """
+    Counters, latency histograms and queue depth gauges of one process.
+    Updates hold `lock`, being made from every thread of `ThreadPoolGor`,
+    and snapshots are taken from a reporter thread.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def incr(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    def gauge(self, name: str, func):
+        """
+        Register `func` to be sampled as gauge `name` on every snapshot
+        """
+        self.gauges[name] = func
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, func in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception:
+                pass
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: h.snapshot() for name, h in self.histograms.items()}
+        return {
+            'pid': os.getpid(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': gauges,
+        }
+
+
+def merge_snapshots(snapshots) -> dict:
+    counters, histograms, gauges = {}, {}, {}
+    for snap in snapshots:
+        for name, value in snap['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, hist in snap['histograms'].items():
+            histograms.setdefault(name, []).append(hist)
+        gauges.update(snap['gauges'])
+    return {
+        'counters': counters,
+        'histograms': {name: merge_histograms(h) for name, h in histograms.items()},
+        'gauges': gauges,
+    }
+
+
+class StatsReporter(object):
+    """
+    Periodically merge the local `Stats` with the latest snapshots received
+    from worker processes, and write a summary to stderr or, as JSON, to
+    `path`.
+    """
+
+    def __init__(self, stats: Stats, interval: float, path: str = None, stream=None):
+        self.stats = stats
+        self.interval = interval
+        self.path = path
+        self.stream = stream
+        self.remote = {}
+        self.last_messages = 0
+        self.last_time = time.time()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def update(self, snapshot: dict):
+        """
+        Record the latest cumulative snapshot of a worker process
+        """
+        self.remote[snapshot['pid']] = snapshot
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='gor-stats', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def summary(self) -> dict:
+        merged = merge_snapshots([self.stats.snapshot()] + list(self.remote.values()))
+        now = time.time()
+        messages = merged['counters'].get('messages', 0)
+        merged['rate'] = (messages - self.last_messages) / max(now - self.last_time, 1e-9)
+        self.last_messages, self.last_time = messages, now
+        for hist in merged['histograms'].values():
+            hist['p50_us'] = percentile(hist, 50)
+            hist['p99_us'] = percentile(hist, 99)
+            del hist['buckets']
+        return merged
+
+    def report(self):
+        summary = self.summary()
+        if self.path:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(summary, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+            return
+        lines = ['gor stats: %d messages, %.1f msg/s' % (
+            summary['counters'].get('messages', 0), summary['rate'])]
+        counters = ' '.join('%s=%d' % (k, v) for k, v in sorted(summary['counters'].items()) if k != 'messages')
+        if counters:
+            lines.append('  %s' % counters)
+        for name, hist in sorted(summary['histograms'].items()):
+            lines.append('  %-20s count=%-10d p50=%.0fus p99=%.0fus max=%.0fus' % (
+                name, hist['count'], hist['p50_us'], hist['p99_us'], hist['max'] * 1e6))
+        if summary['gauges']:
+            lines.append('  ' + ' '.join('%s=%s' % (k, v) for k, v in sorted(summary['gauges'].items())))
+        stream = self.stream or sys.stderr
+        stream.write('\n'.join(lines) + '\n')
+        stream.flush()
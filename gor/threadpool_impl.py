@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import queue
+import threading
+
+from .base import Gor
+from .writer import ThreadedWriter
+from .overflow import DROP_NEWEST, DROP_OLDEST
+from .callback import SimpleCallbackContainer
+
+
+class ThreadPoolGor(Gor):
+    """
+    Run callbacks in a pool of threads, for middlewares doing blocking I/O
+    through sync client libraries. Messages are sharded by id across per
+    thread queues, so a request, its response and replay are handled by the
+    same thread in order, and all output goes through one writer thread.
+    CPU bound callbacks scale with the threads on free-threaded builds only.
+    """
+
+    def __init__(self, *args, **kwargs):
+        chan_container = SimpleCallbackContainer(**kwargs)
+        super(ThreadPoolGor, self).__init__(chan_container, *args, **kwargs)
+        self.concurrency = kwargs.get('concurrency', 4)
+        self.workers = []
+        self.queues = []
+        self._stopped = threading.Event()
+        self._expiry = None
+
+    def _worker(self, q):
+        while True:
+            msg = q.get()
+            if msg is None:
+                return
+            raw_line = msg.raw_line
+            payload = msg.payload_view if raw_line is None else None
+            try:
+                self.emit(msg)
+            except Exception:
+                self._callback_error(raw_line, payload)
+
+    def _expire_loop(self):
+        while not self._stopped.wait(self.expire_interval):
+            self.expire()
+
+    def _stdin_reader(self):
+        try:
+            for chunk in self._read_chunks():
+                for msg in self.filter_messages(self.sample_messages(chunk)):
+                    q = self.queues[hash(msg.id) % len(self.queues)]
+                    if q.full():
+                        action = self.overflow.on_full()
+                        if action == DROP_NEWEST:
+                            continue
+                        if action == DROP_OLDEST:
+                            try:
+                                q.get_nowait()
+                            except queue.Empty:
+                                pass
+                    q.put(msg)
+        except KeyboardInterrupt:
+            pass
+        self._stop()
+
+    def _stop(self):
+        self._stopped.set()
+        if self._expiry is not None:
+            self._expiry.join()
+        for q in self.queues:
+            q.put(None)
+        for worker in self.workers:
+            worker.join()
+        self._close_correlations()
+        self.writer.close()
+        self._close_output()
+        if self.stats_reporter is not None:
+            self.stats_reporter.stop()
+
+    def run(self):
+        self.writer = ThreadedWriter(self.writer)
+        for i in range(self.concurrency):
+            q = queue.Queue(self.queue_size)
+            worker = threading.Thread(target=self._worker, args=(q,), name='gor-worker-%d' % i, daemon=True)
+            self.queues.append(q)
+            self.workers.append(worker)
+            if self.stats is not None:
+                self.stats.gauge('queue.%d' % i, q.qsize)
+        if self.stats_reporter is not None:
+            self.stats_reporter.start()
+        for worker in self.workers:
+            worker.start()
+        if self._needs_expiry():
+            self._expiry = threading.Thread(target=self._expire_loop, name='gor-expiry', daemon=True)
+            self._expiry.start()
+        self._stdin_reader()
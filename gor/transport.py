@@ -0,0 +1,254 @@
+# coding: utf-8
+"""
+Input and output transports of a middleware, selected with a spec string:
+
+- ``-`` or None: stdin/stdout, as used by GoReplay's ``--middleware``
+- ``unix:/path``: connect to a Unix domain socket, the same connection is
+  used when it is both the input and the output of one middleware
+- ``fifo:/path``: a named pipe, created if missing
+- ``file:/path`` or a plain path: a regular file, appended to as output
+
+Outputs write batches with vectored I/O (``writev``/``sendmsg``), without
+joining the chunks of a batch first.
+"""
+
+import os
+import sys
+import stat
+import select
+import socket
+import argparse
+import threading
+import binascii
+
+
+# iovec limit of a single writev call
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+
+def parse_spec(spec: str):
+    """
+    :return: a ``(kind, path)`` tuple, kind being stdio, unix, fifo or file
+    """
+    if spec is None or spec == '-':
+        return 'stdio', None
+    kind, sep, path = spec.partition(':')
+    if sep and kind in ('unix', 'fifo', 'file'):
+        return kind, path
+    return 'file', spec
+
+
+def _connect(path: str, sockets: dict = None) -> socket.socket:
+    sock = sockets.get(path) if sockets is not None else None
+    if sock is None or sock.fileno() == -1:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        if sockets is not None:
+            sockets[path] = sock
+    return sock
+
+
+def _fifo(path: str) -> str:
+    if not os.path.exists(path):
+        os.mkfifo(path)
+    elif not stat.S_ISFIFO(os.stat(path).st_mode):
+        raise ValueError('%s is not a named pipe' % path)
+    return path
+
+
+def open_input(spec: str, read_size: int = 256 * 1024, sockets: dict = None):
+    """
+    :param sockets: connections by path, shared with the `open_output` of
+        the same middleware, a new connection is made if None
+    :return: a binary stream to read GoReplay hex lines from, None for stdin
+    """
+    kind, path = parse_spec(spec)
+    if kind == 'stdio':
+        return None
+    if kind == 'unix':
+        return _connect(path, sockets).makefile('rb', buffering=read_size)
+    if kind == 'fifo':
+        return open(_fifo(path), 'rb', buffering=read_size)
+    return open(path, 'rb', buffering=read_size)
+
+
+def open_output(spec: str, sockets: dict = None):
+    """
+    :param sockets: connections by path, as for `open_input`
+    :return: an output with ``write``, ``writev`` and ``flush``, None for
+        stdout
+    """
+    kind, path = parse_spec(spec)
+    if kind == 'stdio':
+        return None
+    if kind == 'unix':
+        return SocketOutput(_connect(path, sockets))
+    if kind == 'fifo':
+        return FdOutput(os.open(_fifo(path), os.O_WRONLY))
+    return FdOutput(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644))
+
+
+def _writev_all(send, fd: int, chunks):
+    """
+    Write all `chunks` with the vectored `send`, resuming after partial
+    writes and waiting for a non-blocking descriptor to become writable
+    """
+    chunks = [memoryview(c) for c in chunks if len(c)]
+    # index of the first chunk not fully written
+    first = 0
+    while first < len(chunks):
+        try:
+            sent = send(chunks[first:first + IOV_MAX])
+        except BlockingIOError:
+            select.select([], [fd], [])
+            continue
+        while sent:
+            size = len(chunks[first])
+            if sent >= size:
+                sent -= size
+                first += 1
+            else:
+                chunks[first] = chunks[first][sent:]
+                sent = 0
+
+
+class FdOutput(object):
+    """
+    Output to a file descriptor, a named pipe or a regular file
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def write(self, data: bytes):
+        self.writev((data,))
+
+    def writev(self, chunks):
+        _writev_all(lambda bufs: os.writev(self.fd, bufs), self.fd, chunks)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SocketOutput(object):
+    """
+    Output to a connected stream socket
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def write(self, data: bytes):
+        self.writev((data,))
+
+    def writev(self, chunks):
+        _writev_all(self.sock.sendmsg, self.sock.fileno(), chunks)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def _message_id(line: bytes) -> bytes:
+    # the id is the second field of the meta line, decode just enough of it
+    head = line[:160]
+    head = head[:len(head) & ~1]
+    try:
+        return binascii.unhexlify(head).split(b' ', 2)[1]
+    except (binascii.Error, IndexError):
+        return b''
+
+
+class FanOut(object):
+    """
+    Spread a GoReplay hex stream over several middleware processes connected
+    to a Unix socket, messages sharing an id always going to the same one,
+    and merge their output. Each middleware runs with
+    ``input='unix:/path', output='unix:/path'``.
+    """
+
+    def __init__(self, path: str, clients: int, read_size: int = 256 * 1024):
+        self.path = path
+        self.clients = clients
+        self.read_size = read_size
+        self.lock = threading.Lock()
+
+    def _forward(self, conn: socket.socket, out):
+        stream = conn.makefile('rb', buffering=self.read_size)
+        pending = b''
+        while True:
+            chunk = stream.read1(self.read_size)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind(b'\n') + 1
+            pending = data[end:]
+            if end:
+                with self.lock:
+                    out.write(data[:end])
+                    out.flush()
+
+    def run(self, stdin=None, stdout=None):
+        stdin = stdin or sys.stdin.buffer
+        stdout = stdout or sys.stdout.buffer
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen(self.clients)
+        conns = [server.accept()[0] for _ in range(self.clients)]
+        readers = [threading.Thread(target=self._forward, args=(conn, stdout), daemon=True) for conn in conns]
+        for reader in readers:
+            reader.start()
+        outputs = [SocketOutput(conn) for conn in conns]
+        pending = b''
+        while True:
+            chunk = stdin.read1(self.read_size) if hasattr(stdin, 'read1') else stdin.read(self.read_size)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            batches = [[] for _ in conns]
+            for line in lines:
+                if line.strip():
+                    batches[hash(_message_id(line)) % len(conns)] += (line, b'\n')
+            for output, batch in zip(outputs, batches):
+                if batch:
+                    output.writev(batch)
+        if pending.strip():
+            outputs[hash(_message_id(pending)) % len(conns)].writev((pending, b'\n'))
+        for conn in conns:
+            conn.shutdown(socket.SHUT_WR)
+        for reader in readers:
+            reader.join()
+        for conn in conns:
+            conn.close()
+        server.close()
+        os.unlink(self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spread stdin over middlewares connected to a Unix socket')
+    parser.add_argument('path')
+    parser.add_argument('--clients', type=int, default=2)
+    args = parser.parse_args()
+    FanOut(args.path, args.clients).run()
+
+
+if __name__ == '__main__':
+    main()
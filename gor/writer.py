@@ -0,0 +1,258 @@
+# coding: utf-8
+
+import io
+import sys
+import time
+import queue
+import struct
+import binascii
+import threading
+
+from .codec import encode_payloads
+
+
+# sequence number and size of each result in a SequencedWriter batch
+RESULT_HEADER = struct.Struct('<QI')
+# sequence number of the stats snapshots workers send along their results
+STATS_SEQ = (1 << 64) - 1
+
+
+class BatchWriter(object):
+    """
+    Buffer encoded messages and write them to stdout in batches. A batch is
+    flushed as soon as it holds `batch_size` messages or its oldest message
+    has been waiting for `max_latency_us` microseconds, whichever comes first.
+    A `stream` with a ``writev`` method, such as the `gor.transport` outputs,
+    gets the chunks of a batch without joining them.
+    """
+
+    def __init__(self, stream=None, batch_size: int = 64, max_latency_us: int = 1000):
+        self.stream = stream
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency_us / 1e6
+        self.chunks = []
+        self.payloads = []
+        self.pending = 0
+        self.deadline = None
+
+    def write(self, *chunks: bytes):
+        """
+        Queue one already encoded message made of `chunks`
+        """
+        if self.payloads:
+            self._encode_payloads()
+        self.chunks.extend(chunks)
+        self._queued()
+
+    def write_payload(self, payload: bytes):
+        """
+        Queue one decoded payload, pending payloads are hex encoded together
+        """
+        self.payloads.append(payload)
+        self._queued()
+
+    def _encode_payloads(self):
+        self.chunks.append(encode_payloads(self.payloads))
+        self.payloads = []
+
+    def _queued(self):
+        self.pending += 1
+        if self.pending == 1:
+            self.deadline = time.monotonic() + self.max_latency
+        if self.pending >= self.batch_size or time.monotonic() >= self.deadline:
+            self.flush()
+
+    def timeout(self):
+        """
+        :return: seconds left before the pending batch must be flushed, or
+            None if nothing is pending
+        """
+        if not self.pending:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def flush_if_due(self):
+        if self.pending and time.monotonic() >= self.deadline:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.payloads:
+            self._encode_payloads()
+        chunks = self.chunks
+        self.chunks = []
+        self.pending = 0
+        self.deadline = None
+        writev = getattr(self.stream, 'writev', None)
+        if writev is not None:
+            writev(chunks)
+        else:
+            self._write_out(b''.join(chunks))
+
+    def _write_out(self, data: bytes):
+        stream = self.stream if self.stream is not None else sys.stdout
+        out = getattr(stream, 'buffer', stream)
+        if isinstance(out, io.TextIOBase):
+            out.write(data.decode())
+        else:
+            out.write(data)
+        out.flush()
+
+
+class ThreadedWriter(object):
+    """
+    Hand messages written from any thread to a single writer thread, which
+    batches them with a `BatchWriter`.
+    """
+
+    def __init__(self, writer: BatchWriter):
+        self.writer = writer
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='gor-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, *chunks: bytes):
+        self.queue.put((False, chunks))
+
+    def write_payload(self, payload: bytes):
+        self.queue.put((True, payload))
+
+    def _run(self):
+        writer = self.writer
+        while True:
+            try:
+                item = self.queue.get(timeout=writer.timeout())
+            except queue.Empty:
+                writer.flush_if_due()
+                continue
+            if item is None:
+                writer.flush()
+                return
+            is_payload, data = item
+            if is_payload:
+                writer.write_payload(data)
+            else:
+                writer.write(*data)
+
+    def close(self):
+        """
+        Write out everything queued so far and stop the writer thread
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+class SequencedWriter(BatchWriter):
+    """
+    Worker side writer which frames the output of every message with the
+    sequence number of that message, `seq`, and hands whole batches to a
+    channel read by the parent process.
+    """
+
+    def __init__(self, channel, *args, **kwargs):
+        super(SequencedWriter, self).__init__(*args, **kwargs)
+        self.channel = channel
+        self.seq = 0
+        self.last_seq = None
+
+    def write(self, *chunks: bytes):
+        size = sum(len(c) for c in chunks)
+        self.last_seq = self.seq
+        super(SequencedWriter, self).write(RESULT_HEADER.pack(self.seq, size), *chunks)
+
+    def write_payload(self, payload: bytes):
+        self.write(binascii.hexlify(payload), b'\n')
+
+    def write_stats(self, data: bytes):
+        self.chunks.extend((RESULT_HEADER.pack(STATS_SEQ, len(data)), data))
+        self._queued()
+
+    def _write_out(self, data: bytes):
+        self.channel.put(data)
+
+
+def iter_results(batch: bytes):
+    """
+    :return: an iterator over the ``(seq, data)`` results of a batch written
+        by `SequencedWriter`
+    """
+    view = memoryview(batch)
+    pos = 0
+    while pos < len(batch):
+        seq, size = RESULT_HEADER.unpack_from(batch, pos)
+        pos += RESULT_HEADER.size
+        yield seq, view[pos:pos + size]
+        pos += size
+
+
+class Reassembler(object):
+    """
+    Collect ``(seq, data)`` results from several workers into one
+    `BatchWriter`, only whole messages are ever written. With `ordered` the
+    results are written in sequence order, if more than `window` results
+    are waiting for a missing one the gap is skipped.
+    """
+
+    def __init__(self, writer: BatchWriter, ordered: bool = False, window: int = 1024):
+        self.writer = writer
+        self.ordered = ordered
+        self.window = window
+        self.next_seq = 0
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def add(self, results):
+        """
+        :param results: an iterable of ``(seq, data)``, data being bytes or a
+            tuple of chunks, empty for a message which produced no output
+        """
+        with self.lock:
+            if not self.ordered:
+                for seq, data in results:
+                    self._write(data)
+                return
+            for seq, data in results:
+                if seq < self.next_seq:
+                    # the gap was skipped already
+                    self._write(data)
+                else:
+                    self.results[seq] = data
+            self._drain()
+
+    def _write(self, data):
+        if isinstance(data, tuple):
+            if data:
+                self.writer.write(*data)
+        elif data:
+            self.writer.write(data)
+
+    def _drain(self):
+        pending = self.results
+        while pending:
+            data = pending.pop(self.next_seq, None)
+            if data is None:
+                if len(pending) <= self.window:
+                    return
+                self.next_seq = min(pending)
+                continue
+            self.next_seq += 1
+            self._write(data)
+
+    def timeout(self):
+        with self.lock:
+            return self.writer.timeout()
+
+    def flush_if_due(self):
+        with self.lock:
+            self.writer.flush_if_due()
+
+    def close(self):
+        """
+        Write out every pending result, in order, and flush
+        """
+        with self.lock:
+            for seq in sorted(self.results):
+                self._write(self.results[seq])
+            self.results = {}
+            self.writer.flush()
@@ -0,0 +1,12 @@
+# coding: utf-8
+
+
+def fail_odd(proxy, msg, **kwargs):
+    """
+    Modify every request and fail on the ones with an odd id, whose output is
+    expected to be the original message
+    """
+    msg.http = msg.http.replace(b'GET', b'PUT')
+    if int(msg.id) % 2:
+        raise RuntimeError('callback failed')
+    return msg
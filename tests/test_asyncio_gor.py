@@ -1,13 +1,18 @@
 # coding: utf-8
 
 import io
+import os
 import sys
+import time
+import asyncio
 import binascii
 import unittest
 import threading
 
 from gor.middleware import AsyncioGor
 
+from .helpers import fail_odd
+
 
 class Counter(object):
     def __init__(self):
@@ -27,6 +32,11 @@ def _incr_received(proxy, msg, **kwargs):
     kwargs['passby']['received'].increment()
 
 
+async def _fail_odd_async(proxy, msg, **kwargs):
+    await asyncio.sleep(0)
+    return fail_odd(proxy, msg, **kwargs)
+
+
 class TestAsyncioGor(unittest.TestCase):
 
     def setUp(self):
@@ -70,3 +80,145 @@ class TestAsyncioGor(unittest.TestCase):
         self._proxy_coroutine(passby)
         self.assertEqual(passby['received'].count(), 5)
         sys.stdin = old_stdin
+
+    def test_run_split_chunks(self):
+        old_stdin = sys.stdin
+        passby = {'received': Counter()}
+        payload = "\n".join([
+            binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n').decode("utf-8"),
+            binascii.hexlify(b'2 2 3\nHTTP/1.1 200 OK\r\n\r\n').decode("utf-8"),
+            binascii.hexlify(b'2 3 3\nHTTP/1.1 200 OK\r\n\r\n').decode("utf-8"),
+        ]) + "\n"
+        sys.stdin = io.StringIO(payload)
+        proxy = AsyncioGor(read_size=7)
+        proxy.on('message', _incr_received, passby=passby)
+        proxy.run()
+        self.assertEqual(passby['received'].count(), 3)
+        sys.stdin = old_stdin
+
+    def test_run_async_callbacks(self):
+        old_stdin = sys.stdin
+        events = []
+
+        async def on_message(proxy, msg, **kwargs):
+            await asyncio.sleep(0.05 if msg.type == '1' else 0)
+            events.append((msg.type, msg.id))
+
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(20)]
+        lines += [binascii.hexlify(b'2 %d 3\nHTTP/1.1 200 OK\r\n\r\n' % i) for i in range(20)]
+        sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+        proxy = AsyncioGor(max_inflight=40)
+        proxy.on('message', on_message)
+        started = time.monotonic()
+        proxy.run()
+        elapsed = time.monotonic() - started
+        sys.stdin = old_stdin
+
+        self.assertEqual(len(events), 40)
+        self.assertLess(elapsed, 20 * 0.05)
+        for i in range(20):
+            self.assertLess(events.index(('1', str(i))), events.index(('2', str(i))))
+
+    def _run_overflow(self, policy):
+        old_stdin = sys.stdin
+        received = []
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(20)]
+        sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+        proxy = AsyncioGor(concurrency=1, queue_size=2, overflow=policy)
+        proxy.on('request', lambda proxy, msg, **kwargs: received.append(int(msg.id)))
+        proxy.run()
+        sys.stdin = old_stdin
+        return proxy, received
+
+    def test_overflow_drop_newest(self):
+        proxy, received = self._run_overflow('drop_newest')
+        self.assertEqual(received[:2], [0, 1])
+        self.assertGreater(proxy.overflow.dropped, 0)
+        self.assertEqual(len(received) + proxy.overflow.dropped, 20)
+
+    def test_overflow_drop_oldest(self):
+        proxy, received = self._run_overflow('drop_oldest')
+        self.assertEqual(received[-2:], [18, 19])
+        self.assertGreater(proxy.overflow.dropped, 0)
+        self.assertEqual(len(received) + proxy.overflow.dropped, 20)
+
+    def test_overflow_block(self):
+        proxy, received = self._run_overflow('block')
+        self.assertEqual(received, list(range(20)))
+        self.assertEqual(proxy.overflow.dropped, 0)
+        self.assertGreater(proxy.overflow.delayed, 0)
+
+    def test_run_bad_meta(self):
+        lines = [binascii.hexlify(b'1 \xff\xfe 3\nGET / HTTP/1.1\r\n\r\n'),
+                 binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n')]
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = AsyncioGor()
+            proxy.stderr = io.StringIO()
+            proxy.on('request', lambda proxy, msg, **kwargs: None)
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        self.assertEqual(output.splitlines(), lines[1:])
+
+    def test_reader_error_raised(self):
+        class BrokenInput(io.RawIOBase):
+            def readable(self):
+                return True
+
+            def read(self, n=-1):
+                raise OSError('input went away')
+
+        proxy = AsyncioGor(input=BrokenInput())
+        self.assertRaises(OSError, proxy.run)
+
+    def test_callback_error(self):
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(10)]
+        # failed messages go through unmodified
+        expected = [binascii.hexlify(binascii.unhexlify(l).replace(b'GET', b'PUT')) if i % 2 == 0 else l
+                    for i, l in enumerate(lines)]
+        for callback in (fail_odd, _fail_odd_async):
+            old_stdin, old_stdout = sys.stdin, sys.stdout
+            sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+            sys.stdout = io.TextIOWrapper(io.BytesIO())
+            try:
+                proxy = AsyncioGor()
+                proxy.on('request', callback)
+                proxy.run()
+                output = sys.stdout.buffer.getvalue()
+            finally:
+                sys.stdin, sys.stdout = old_stdin, old_stdout
+            self.assertEqual(sorted(output.splitlines()), sorted(expected))
+
+    def test_expire_while_idle(self):
+        evicted = threading.Event()
+        read_fd, write_fd = os.pipe()
+        proxy = AsyncioGor(input=os.fdopen(read_fd, 'rb'), output=io.BytesIO(), channel_ttl=0.05,
+                           expire_interval=0.01, on_channel_evict=lambda chan, channels: evicted.set())
+        proxy.on('response', _incr_received, idx='7', passby={'received': Counter()})
+
+        def run():
+            proxy.run()
+            proxy.io_loop.close()
+
+        runner = threading.Thread(target=run, daemon=True)
+        runner.start()
+        try:
+            # nothing is read nor registered, the channel expires on the timer
+            self.assertTrue(evicted.wait(5))
+        finally:
+            os.close(write_fd)
+            runner.join(10)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(proxy.chan_container.evicted, 1)
+
+    def test_emit_rejects_coroutines(self):
+        async def on_message(proxy, msg, **kwargs):
+            return msg
+
+        self.gor.on('message', on_message)
+        req = self.gor.parse_message(binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n'))
+        self.assertRaises(TypeError, self.gor.emit, req)
@@ -0,0 +1,111 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import binascii
+import tempfile
+import unittest
+
+from gor.autoscale import Autoscaler, HashRing, StickyRouter
+from gor.middleware import MultiProcessGor
+
+
+class ScriptedAutoscaler(Autoscaler):
+
+    def __init__(self, decisions, **kwargs):
+        super(ScriptedAutoscaler, self).__init__(interval=0, **kwargs)
+        self.decisions = list(decisions)
+
+    def decide(self, workers, depth, latency=None, now=None):
+        return self.decisions.pop(0) if self.decisions else 0
+
+
+def _log_pid(proxy, msg, **kwargs):
+    with open(os.environ['GOR_TEST_PID_LOG'], 'a') as f:
+        f.write('%s %d\n' % (msg.id, os.getpid()))
+
+
+class TestAutoscale(unittest.TestCase):
+
+    def test_ring_moves_few_keys(self):
+        ring = HashRing(range(4))
+        keys = [hash(str(i)) & 0xFFFFFFFF for i in range(4000)]
+        before = [ring.get(k) for k in keys]
+        ring.add(4)
+        after = [ring.get(k) for k in keys]
+        moved = sum(a != b for a, b in zip(before, after))
+        self.assertTrue(all(b == 4 for a, b in zip(before, after) if a != b))
+        self.assertLess(moved, 4000 * 0.35)
+        ring.remove(4)
+        self.assertEqual([ring.get(k) for k in keys], before)
+        self.assertEqual(len(ring), 4)
+        self.assertNotIn(4, ring)
+
+    def test_sticky_router(self):
+        router = StickyRouter(HashRing([0]), ttl=10)
+        router.tick(0)
+        self.assertEqual(router.route('a', '1'), 0)
+        self.assertEqual(router.route('b', '1'), 0)
+        router.ring.add(1)
+        router.ring.remove(0)
+        # pinned ids stay on their worker until all their messages went through
+        self.assertEqual(router.route('a', '2'), 0)
+        self.assertEqual(router.pinned(0), 2)
+        self.assertEqual(router.route('a', '3'), 0)
+        self.assertEqual(router.pinned(0), 1)
+        self.assertEqual(router.route('c', '1'), 1)
+        router.tick(11)
+        self.assertEqual(router.pinned(0), 0)
+        self.assertEqual(router.route('b', '2'), 1)
+
+    def test_decide(self):
+        scaler = Autoscaler(min_workers=1, max_workers=3, cooldown=10, up_depth=100, down_depth=5,
+                            up_latency=0.5)
+        self.assertEqual(scaler.decide(2, 200, now=0), 1)
+        # cooling down
+        self.assertEqual(scaler.decide(3, 200, now=5), 0)
+        # at max_workers
+        self.assertEqual(scaler.decide(3, 200, now=20), 0)
+        self.assertEqual(scaler.decide(2, 0, latency=1.0, now=30), 1)
+        self.assertEqual(scaler.decide(3, 0, latency=0.01, now=40), -1)
+        self.assertEqual(scaler.decide(1, 0, now=60), 0)
+        self.assertRaises(ValueError, Autoscaler, min_workers=4, max_workers=2)
+
+    def test_resize_keeps_id_affinity(self):
+        lines = []
+        for i in range(60):
+            for t, first in ((1, b'GET / HTTP/1.1'), (2, b'HTTP/1.1 200 OK'), (3, b'HTTP/1.1 200 OK')):
+                lines.append(binascii.hexlify(b'%d %d 3\n%s\r\n\r\n' % (t, i, first)))
+        # interleave the messages of consecutive ids
+        lines = lines[::2] + lines[1::2]
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ['GOR_TEST_PID_LOG'] = os.path.join(tmp, 'pids')
+            try:
+                scaler = ScriptedAutoscaler([1, 1, -1, 0, -1, 1, -1], min_workers=1, max_workers=4)
+                proxy = MultiProcessGor(concurrency=2, autoscale=scaler, read_size=len(lines[0]) * 6)
+                proxy.on('message', _log_pid)
+                proxy.run()
+                output = sys.stdout.buffer.getvalue()
+            finally:
+                sys.stdin, sys.stdout = old_stdin, old_stdout
+            with open(os.environ.pop('GOR_TEST_PID_LOG')) as f:
+                logged = [line.split() for line in f]
+        self.assertEqual(sorted(output.splitlines()), sorted(lines))
+        # the whole pool is forked upfront, resizing moves workers in and
+        # out of the ring
+        self.assertEqual(len(proxy.workers), 4)
+        self.assertTrue(proxy.parked)
+        pids = {}
+        for _id, pid in logged:
+            pids.setdefault(_id, set()).add(pid)
+        self.assertEqual(len(pids), 60)
+        self.assertTrue(all(len(p) == 1 for p in pids.values()))
+        self.assertGreater(len(set.union(*pids.values())), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# coding: utf-8
+
+import gzip
+import zlib
+import unittest
+
+from gor.body import iter_body, iter_chunked
+
+
+def chunked(data: bytes, size: int) -> bytes:
+    parts = [b'%x\r\n%s\r\n' % (len(data[i:i + size]), data[i:i + size]) for i in range(0, len(data), size)]
+    return b''.join(parts) + b'0\r\n\r\n'
+
+
+class TestBody(unittest.TestCase):
+
+    def setUp(self):
+        self.data = b''.join(b'line %d\n' % i for i in range(5000))
+
+    def test_iter_chunked(self):
+        body = b'HEAD' + chunked(self.data, 1000)
+        pieces = list(iter_chunked(body, 4))
+        self.assertEqual(len(pieces), (len(self.data) + 999) // 1000)
+        self.assertEqual(b''.join(pieces), self.data)
+
+    def test_iter_chunked_extension_and_truncation(self):
+        pieces = list(iter_chunked(b'4;name=v\r\nWiki\r\n6\r\npedia'))
+        self.assertEqual([bytes(p) for p in pieces], [b'Wiki', b'pedia'])
+
+    def test_gzip_without_transfer_encoding(self):
+        body = gzip.compress(self.data)
+        self.assertEqual(b''.join(iter_body(body, content_encoding='gzip')), self.data)
+
+    def test_gzip_chunked_pieces(self):
+        body = chunked(gzip.compress(self.data), 512)
+        pieces = list(iter_body(body, content_encoding='gzip', transfer_encoding='Chunked', chunk_size=4096))
+        self.assertTrue(all(len(p) <= 4096 for p in pieces))
+        self.assertEqual(b''.join(pieces), self.data)
+
+    def test_deflate(self):
+        self.assertEqual(b''.join(iter_body(zlib.compress(self.data), content_encoding='deflate')), self.data)
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        body = raw.compress(self.data) + raw.flush()
+        self.assertEqual(b''.join(iter_body(body, content_encoding='deflate')), self.data)
+
+    def test_unsupported_encoding_passthrough(self):
+        self.assertEqual(b''.join(iter_body(b'\x0b\x01raw', content_encoding='br')), b'\x0b\x01raw')
+
+    def test_max_size(self):
+        body = gzip.compress(self.data)
+        with self.assertRaises(ValueError):
+            b''.join(iter_body(body, content_encoding='gzip', chunk_size=1024, max_size=10000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+import sys
+import unittest
+import threading
+
+from gor.base import Gor, GorMessage
+from gor.callback import SimpleCallbackContainer
+
+
+def _record(proxy, msg, **kwargs):
+    kwargs['seen'].append(msg.id)
+
+
+def _message(msg_type, msg_id):
+    return GorMessage.from_payload(b'%s %s 3\nGET / HTTP/1.1\r\n\r\n' % (msg_type, msg_id))
+
+
+class TestCallbackContainer(unittest.TestCase):
+
+    def test_once(self):
+        gor = Gor(SimpleCallbackContainer())
+        seen = []
+        gor.on('response', _record, idx='1', once=True, seen=seen)
+        gor.on('response', _record, idx='2', seen=seen)
+        for _ in range(2):
+            gor.emit(_message(b'2', b'1'))
+            gor.emit(_message(b'2', b'2'))
+        self.assertEqual(seen, ['1', '2', '2'])
+        self.assertNotIn('response#1', gor.chan_container.ch)
+        self.assertNotIn('response#1', gor.chan_container.expiry)
+
+    def test_max_channels(self):
+        evicted = []
+        container = SimpleCallbackContainer(
+            max_channels=2, on_channel_evict=lambda chan, channels: evicted.append(chan))
+        gor = Gor(container)
+        seen = []
+        gor.on('request', _record, seen=seen)
+        gor.on('response', _record, idx='1', seen=seen)
+        gor.emit(_message(b'2', b'1'))
+        gor.on('response', _record, idx='2', seen=seen)
+        gor.on('response', _record, idx='3', seen=seen)
+        gor.on('response', _record, idx='4', seen=seen)
+        self.assertEqual(sorted(container.ch), ['request', 'response#3', 'response#4'])
+        self.assertEqual(container.expired, 2)
+        self.assertEqual(container.evicted, 1)
+        self.assertEqual(evicted, ['response#2'])
+
+    def test_ttl(self):
+        container = SimpleCallbackContainer(channel_ttl=10)
+        gor = Gor(container)
+        gor.on('response', _record, idx='1', seen=[])
+        container.expire(container.expiry['response#1'][0] + 5)
+        self.assertIn('response#1', container.ch)
+        container.expire(container.expiry['response#1'][0] + 11)
+        self.assertNotIn('response#1', container.ch)
+        self.assertEqual(container.evicted, 1)
+
+    def test_off(self):
+        gor = Gor(SimpleCallbackContainer())
+        gor.on('response', _record, idx='1', seen=[])
+        gor.off('response', idx='1')
+        self.assertEqual(gor.chan_container.ch, {})
+        self.assertEqual(len(gor.chan_container.expiry), 0)
+
+    def test_threads(self):
+        evicted = []
+        container = SimpleCallbackContainer(
+            max_channels=50, on_channel_evict=lambda chan, channels: evicted.append(chan))
+        gor = Gor(container)
+        seen = []
+
+        def run(worker):
+            for i in range(500):
+                _id = b'%d-%d' % (worker, i)
+                gor.on('response', _record, idx=_id.decode(), once=True, seen=seen)
+                if i % 2:
+                    gor.emit(_message(b'2', _id))
+
+        threads = [threading.Thread(target=run, args=(w,)) for w in range(4)]
+        interval = sys.getswitchinterval()
+        # switch threads as often as possible to expose races
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        # every channel either fired once, was evicted, or is still registered
+        self.assertEqual(len(container.expiry), len(container.ch))
+        self.assertEqual(container.evicted, len(evicted))
+        self.assertGreaterEqual(container.expired, container.evicted)
+        self.assertEqual(len(seen) + container.evicted + len(container.ch), 2000)
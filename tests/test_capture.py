@@ -0,0 +1,142 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import time
+import binascii
+import tempfile
+import unittest
+
+from gor.capture import CaptureReader, CaptureWriter, record, replay
+from gor.middleware import AsyncioGor, MultiProcessGor, ThreadPoolGor
+
+from .helpers import fail_odd
+
+
+def payloads(count: int = 30, step: int = 10 ** 6):
+    return [b'%d %d %d 0\nGET /%d HTTP/1.1\r\n\r\n' % (i % 3 + 1, i // 3, 1600000000000000000 + i * step, i)
+            for i in range(count)]
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'traffic.gorcap')
+        self.payloads = payloads()
+        self.hex = b''.join(binascii.hexlify(p) + b'\n' for p in self.payloads)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_record_and_read(self):
+        self.assertEqual(record(self.path, io.BytesIO(self.hex)), 30)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 30)
+            self.assertEqual(bytes(reader[4]), self.payloads[4])
+            self.assertEqual(reader.find_id('5'), 15)
+            self.assertEqual(reader.find_time(1600000000000000000 + 7 * 10 ** 6 - 1), 7)
+            self.assertEqual(reader.stream(28).read(), self.hex.split(b'\n', 28)[28])
+
+    def test_read_payloads(self):
+        record(self.path, io.BytesIO(self.hex))
+        with CaptureReader(self.path) as reader:
+            stream = reader.stream(2, 12, batch=4)
+            batches = []
+            while True:
+                batch = stream.read_payloads()
+                if batch is None:
+                    break
+                batches.append(batch)
+            self.assertEqual([len(offsets) for _, offsets in batches], [4, 4, 2])
+            self.assertEqual([buf[start:end] for buf, offsets in batches for start, end in offsets],
+                             self.payloads[2:12])
+            # the hex stream is read in pieces of any size
+            stream = reader.stream(batch=7)
+            self.assertEqual(b''.join(iter(lambda: stream.read(100), b'')), self.hex)
+
+    def test_rebuild_index(self):
+        with CaptureWriter(self.path) as writer:
+            for payload in self.payloads:
+                writer.write(payload)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # drop the index and cut the last record short, as after a crash
+        with open(self.path, 'wb') as f:
+            f.write(data[:writer.offset - 3])
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 29)
+            self.assertEqual(bytes(reader[28]), self.payloads[28])
+
+    def test_not_a_capture(self):
+        with open(self.path, 'wb') as f:
+            f.write(self.hex)
+        self.assertRaises(ValueError, CaptureReader, self.path)
+
+    def test_paced_stream(self):
+        record(self.path, io.BytesIO(self.hex))
+        with CaptureReader(self.path) as reader:
+            stream = reader.stream(speed=0.5)
+            started = time.monotonic()
+            data = b''
+            while True:
+                chunk = stream.read(1024)
+                if not chunk:
+                    break
+                data += chunk
+            # 29ms of traffic at half speed
+            self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(data, self.hex)
+
+    def test_record_from_middleware(self):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO(self.hex.decode())
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            AsyncioGor(record=self.path).run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        self.assertEqual(sorted(output.splitlines()), sorted(self.hex.splitlines()))
+        with CaptureReader(self.path) as reader:
+            self.assertEqual([bytes(reader[i]) for i in range(len(reader))], self.payloads)
+
+    def _replay(self, proxy, **kwargs):
+        record(self.path, io.BytesIO(self.hex))
+        old_stdout = sys.stdout
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            replay(proxy, self.path, **kwargs)
+            return sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+    def test_replay_asyncio(self):
+        output = self._replay(AsyncioGor(), start_id='3', count=6)
+        self.assertEqual(sorted(output.splitlines()), sorted(binascii.hexlify(p) for p in self.payloads[9:15]))
+
+    def test_replay_sampled(self):
+        proxy = AsyncioGor(sampling={'rate': 0.5})
+        proxy.on('message', lambda proxy, msg, **kwargs: msg)
+        output = self._replay(proxy)
+        self.assertEqual(sorted(output.splitlines()), sorted(binascii.hexlify(p) for p in self.payloads))
+        self.assertGreater(proxy.sampler.skipped, 0)
+
+    def test_replay_callback_error(self):
+        # failed messages go through as recorded, not as the callback left them
+        expected = [p.replace(b'GET', b'PUT') if i % 3 == 0 and i // 3 % 2 == 0 else p
+                    for i, p in enumerate(self.payloads)]
+        for proxy in (AsyncioGor(), ThreadPoolGor(concurrency=2)):
+            proxy.on('request', fail_odd)
+            output = self._replay(proxy)
+            self.assertEqual(sorted(output.splitlines()), sorted(binascii.hexlify(p) for p in expected))
+
+    def test_replay_multiprocess(self):
+        proxy = MultiProcessGor(concurrency=2, ordered=True, compare={})
+        output = self._replay(proxy, start_time=1600000000000000000 + 20 * 10 ** 6)
+        self.assertEqual(output.splitlines(), [binascii.hexlify(p) for p in self.payloads[20:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
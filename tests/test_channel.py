@@ -0,0 +1,83 @@
+# coding: utf-8
+
+import queue
+import unittest
+import multiprocessing
+
+from gor.channel import RingBuffer, QueueChannel, make_channel, shared_memory
+
+
+def _consume(channel, results):
+    total = 0
+    while True:
+        data = channel.get()
+        if not data:
+            break
+        total += len(data)
+    results.put(total)
+
+
+@unittest.skipIf(shared_memory is None, 'shared memory requires python 3.8+')
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = RingBuffer(1024)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_put_get(self):
+        self.ring.put(b'hello', b', ', b'world')
+        self.ring.put(b'')
+        self.assertEqual(len(self.ring), 2)
+        self.assertEqual(self.ring.get(), b'hello, world')
+        self.assertEqual(self.ring.get(), b'')
+        self.assertEqual(len(self.ring), 0)
+        self.assertRaises(queue.Empty, self.ring.get, 0.01)
+
+    def test_wrap_around(self):
+        for i in range(100):
+            data = bytes([i]) * (37 + i % 50)
+            self.ring.put(data)
+            self.assertEqual(self.ring.get(), data)
+
+    def test_skip_oldest(self):
+        for i in range(3):
+            self.ring.put(b'%d' % i)
+        self.ring.skip_oldest()
+        self.assertEqual(len(self.ring), 2)
+        self.assertEqual(self.ring.get(), b'0')
+        self.assertTrue(self.ring.should_skip())
+        self.assertEqual(self.ring.get(), b'1')
+        self.assertFalse(self.ring.should_skip())
+        self.assertEqual(len(self.ring), 1)
+        self.ring.wait_below(2)
+
+    def test_fragments(self):
+        data = bytes(range(256)) * 3
+        self.ring.put(data)
+        self.assertEqual(self.ring.get(), data)
+
+    def test_back_pressure(self):
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=_consume, args=(self.ring, results))
+        consumer.start()
+        total = 0
+        for i in range(500):
+            data = b'x' * (1 + i % 300)
+            self.ring.put(data)
+            total += len(data)
+        self.ring.put(b'')
+        consumer.join()
+        self.assertEqual(results.get(), total)
+
+
+class TestQueueChannel(unittest.TestCase):
+
+    def test_put_get(self):
+        channel = make_channel('queue')
+        self.assertIsInstance(channel, QueueChannel)
+        channel.put(b'hello', b'world')
+        self.assertEqual(channel.get(), b'helloworld')
+        self.assertRaises(queue.Empty, channel.get, 0.01)
@@ -0,0 +1,30 @@
+# coding: utf-8
+
+import binascii
+import unittest
+
+from gor.codec import decode_lines, encode_payloads, split_lines
+
+
+class TestCodec(unittest.TestCase):
+
+    payloads = [b'1 2 3\nGET / HTTP/1.1\r\n\r\n', b'2 2 3\nHTTP/1.1 200 OK\r\n\r\n', b'3 2 3\nHTTP/1.1 200 OK\r\n\r\n']
+
+    def test_decode_lines(self):
+        chunk = b'\n'.join(binascii.hexlify(p) for p in self.payloads) + b'\r\n'
+        lines, buf, offsets = decode_lines(chunk)
+        self.assertEqual([buf[start:end] for start, end in offsets], self.payloads)
+        self.assertEqual([bytes(line) for line in lines], [binascii.hexlify(p) for p in self.payloads])
+
+        self.assertRaises(ValueError, decode_lines, b'123\n45\n')
+        self.assertRaises(ValueError, decode_lines, b'zz\n')
+
+    def test_encode_payloads(self):
+        encoded = encode_payloads(self.payloads)
+        self.assertEqual(encoded, b''.join(binascii.hexlify(p) + b'\n' for p in self.payloads))
+        self.assertEqual(encode_payloads([]), b'')
+
+    def test_split_lines(self):
+        self.assertEqual(split_lines(b'', b'ab'), (b'', b'ab'))
+        self.assertEqual(split_lines(b'ab', b'c\nd'), (b'abc\n', b'd'))
+        self.assertEqual(split_lines(b'd', b'e\n'), (b'de\n', b''))
@@ -0,0 +1,110 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import gzip
+import json
+import binascii
+import tempfile
+import unittest
+
+from gor.base import GorMessage
+from gor.compare import Comparator, json_diff
+from gor.middleware import AsyncioGor
+
+
+def response(_type: str, _id: str, status: bytes = b'200 OK', body: bytes = b'', headers=()) -> GorMessage:
+    head = b''.join(b'%s: %s\r\n' % (name, value) for name, value in headers)
+    return GorMessage.from_payload(b'%s %s 1 1\nHTTP/1.1 %s\r\n%s\r\n%s' % (
+        _type.encode(), _id.encode(), status, head, body))
+
+
+JSON = (b'Content-Type', b'application/json')
+
+
+class TestComparator(unittest.TestCase):
+
+    def test_match(self):
+        comparator = Comparator()
+        comparator.add(response('2', 'a', body=b'same'))
+        self.assertEqual(comparator.counts['compared'], 0)
+        comparator.add(response('3', 'a', body=b'same'))
+        self.assertEqual(comparator.counts['match'], 1)
+        self.assertEqual(len(comparator.store), 0)
+
+    def test_status_and_headers(self):
+        comparator = Comparator(headers=['X-Version'])
+        comparator.add(response('3', 'a', status=b'500 Internal Server Error', headers=[(b'X-Version', b'2')]))
+        comparator.add(response('2', 'a', headers=[(b'X-Version', b'1')]))
+        result, = comparator.samples
+        self.assertEqual(result['status'], ['200', '500'])
+        self.assertEqual(result['headers'], {'X-Version': ['1', '2']})
+
+    def test_gzip_body_equal_after_decoding(self):
+        body = b'{"a": 1}' * 100
+        result = Comparator().compare(
+            response('2', 'a', body=gzip.compress(body), headers=[(b'Content-Encoding', b'gzip')]),
+            response('3', 'a', body=body))
+        self.assertNotIn('body', result)
+
+    def test_json_diff_ignored_fields(self):
+        comparator = Comparator(ignore_fields=['ts', 'data.id'])
+        self.assertEqual(comparator.compare(
+            response('2', 'a', headers=[JSON], body=b'{"ts": 1, "data": {"id": 1, "name": "x"}}'),
+            response('3', 'a', headers=[JSON], body=b'{"ts": 2, "data": {"id": 2, "name": "x"}}')), {'id': 'a'})
+        result = comparator.compare(
+            response('2', 'b', headers=[JSON], body=b'{"data": {"items": [1, 2], "name": "x"}}'),
+            response('3', 'b', headers=[JSON], body=b'{"data": {"items": [1, 3], "name": "y"}}'))
+        self.assertEqual(result['body'], [
+            {'path': 'data.items.1', 'response': 2, 'replay': 3},
+            {'path': 'data.name', 'response': 'x', 'replay': 'y'},
+        ])
+
+    def test_raw_body_diff(self):
+        result = Comparator().compare(response('2', 'a', body=b'abcdef'), response('3', 'a', body=b'abcxef!'))
+        self.assertEqual(result['body'], {'size': [6, 7], 'offset': 3})
+
+    def test_unpaired_eviction(self):
+        comparator = Comparator(max_pending=2)
+        for i in range(4):
+            comparator.add(response('2', str(i)))
+        self.assertEqual(list(comparator.store.entries), ['2', '3'])
+        self.assertEqual(comparator.counts['unpaired'], 2)
+
+    def test_json_diff_lists(self):
+        self.assertEqual(json_diff([1, {'a': 1}], [1, {'a': 1}, 3]),
+                         [{'path': 'length', 'response': 2, 'replay': 3}])
+        self.assertEqual(json_diff({'a': 1}, {'a': 1.0}), [{'path': 'a', 'response': 1, 'replay': 1.0}])
+
+
+class TestGorCompare(unittest.TestCase):
+
+    def test_run_report(self):
+        payloads = [
+            b'1 1 1 1\nGET / HTTP/1.1\r\n\r\n',
+            b'2 1 1 1\nHTTP/1.1 200 OK\r\n\r\nok',
+            b'3 1 1 1\nHTTP/1.1 200 OK\r\n\r\nok',
+            b'2 2 1 1\nHTTP/1.1 200 OK\r\n\r\nok',
+            b'3 2 1 1\nHTTP/1.1 404 Not Found\r\n\r\n',
+        ]
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'diff.jsonl')
+            try:
+                proxy = AsyncioGor(compare={'report_path': path})
+                proxy.run()
+            finally:
+                sys.stdin, sys.stdout = old_stdin, old_stdout
+            with open(path) as f:
+                reports = [json.loads(line) for line in f]
+        self.assertEqual(proxy.comparator.counts['compared'], 2)
+        self.assertEqual(proxy.comparator.counts['match'], 1)
+        self.assertEqual([r['id'] for r in reports], ['2'])
+        self.assertEqual(reports[0]['status'], ['200', '404'])
+
+
+if __name__ == '__main__':
+    unittest.main()
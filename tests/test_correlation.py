@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import threading
+import binascii
+import unittest
+
+from gor.base import GorMessage
+from gor.correlation import CorrelationStore, PartSummary
+from gor.middleware import ThreadPoolGor
+
+
+def message(_type: str, _id: str, http: bytes = b'HTTP/1.1 200 OK\r\n\r\nbody') -> GorMessage:
+    return GorMessage.from_payload(b'%s %s 1 1\n%s' % (_type.encode(), _id.encode(), http))
+
+
+class TestCorrelationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.fired = []
+
+    def _callback(self, gor, entry):
+        self.fired.append(entry)
+
+    def test_complete(self):
+        store = CorrelationStore(self._callback)
+        store.add(message('1', 'a', b'GET / HTTP/1.1\r\n\r\n'))
+        store.add(message('2', 'a'))
+        self.assertEqual(self.fired, [])
+        store.add(message('3', 'a'))
+        entry, = self.fired
+        self.assertTrue(entry.complete)
+        self.assertEqual(sorted(entry.parts), ['replay', 'request', 'response'])
+        self.assertEqual(entry.parts['response'].http_status, '200')
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.bytes, 0)
+
+    def test_selected_parts_and_summary(self):
+        store = CorrelationStore(self._callback, parts=('request', 'replay'), keep='summary', headers=['Host'])
+        store.add(message('1', 'a', b'GET /x HTTP/1.1\r\nHost: h\r\n\r\n'))
+        store.add(message('2', 'a'))
+        store.add(message('3', 'a'))
+        entry, = self.fired
+        request = entry.parts['request']
+        self.assertIsInstance(request, PartSummary)
+        self.assertEqual(request.first_line, ('GET', '/x'))
+        self.assertEqual(request.headers, {'Host': 'h'})
+        self.assertEqual(entry.parts['replay'].body_size, 4)
+
+    def test_ttl(self):
+        store = CorrelationStore(self._callback, ttl=10)
+        store.add(message('2', 'a'))
+        store.expire(store.entries['a'].created + 5)
+        self.assertEqual(self.fired, [])
+        store.expire(store.entries['a'].created + 10)
+        entry, = self.fired
+        self.assertFalse(entry.complete)
+        self.assertEqual(list(entry.parts), ['response'])
+        self.assertEqual(store.counts['expired'], 1)
+
+    def test_lru_eviction(self):
+        store = CorrelationStore(self._callback, max_entries=2, fire_partial=False)
+        store.add(message('2', 'a'))
+        store.add(message('2', 'b'))
+        store.add(message('1', 'a', b'GET / HTTP/1.1\r\n\r\n'))
+        store.add(message('2', 'c'))
+        # b is the least recently updated entry
+        self.assertEqual(list(store.entries), ['a', 'c'])
+        self.assertEqual(store.counts['evicted'], 1)
+        self.assertEqual(self.fired, [])
+
+    def test_ttl_after_update(self):
+        store = CorrelationStore(self._callback, ttl=10)
+        store.add(message('2', 'a'))
+        store.add(message('2', 'b'))
+        created = store.entries['a'].created
+        entry = store.entries['a']
+        # a recently updated entry does not hide the expired ones behind it
+        entry.updated = created + 8
+        store.entries.move_to_end('a')
+        store.expire(created + 12)
+        self.assertEqual([e.id for e in self.fired], ['b'])
+        store.expire(created + 18)
+        self.assertEqual([e.id for e in self.fired], ['b', 'a'])
+
+    def test_memory_budget(self):
+        body = b'x' * 1000
+        store = CorrelationStore(self._callback, max_bytes=3000)
+        for i in range(5):
+            store.add(message('2', str(i), b'HTTP/1.1 200 OK\r\n\r\n' + body))
+        self.assertLessEqual(store.bytes, 3000)
+        self.assertEqual(len(self.fired), 5 - len(store))
+
+    def test_gor_correlate(self):
+        payloads = [b'1 1 1 1\nGET / HTTP/1.1\r\n\r\n', b'2 1 1 1\nHTTP/1.1 200 OK\r\n\r\n',
+                    b'3 1 1 1\nHTTP/1.1 502 Bad Gateway\r\n\r\n', b'2 2 1 1\nHTTP/1.1 200 OK\r\n\r\n']
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = ThreadPoolGor()
+            proxy.correlate(self._callback, keep='summary')
+            proxy.run()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        self.assertEqual([(e.id, e.complete) for e in self.fired], [('1', True), ('2', False)])
+        self.assertEqual(self.fired[0].parts['replay'].first_line, ('HTTP/1.1', '502'))
+
+    def test_gor_expire_while_idle(self):
+        fired = threading.Event()
+        read_fd, write_fd = os.pipe()
+        proxy = ThreadPoolGor(input=os.fdopen(read_fd, 'rb'), output=io.BytesIO(), expire_interval=0.01)
+        proxy.correlate(lambda gor, entry: fired.set(), ttl=0.05)
+        runner = threading.Thread(target=proxy.run)
+        runner.start()
+        os.write(write_fd, binascii.hexlify(b'2 1 1 1\nHTTP/1.1 200 OK\r\n\r\n') + b'\n')
+        # the input stays open, the entry is fired by the engine timer
+        self.assertTrue(fired.wait(5))
+        os.close(write_fd)
+        runner.join()
+        self.assertEqual(proxy.correlations[0].counts['expired'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
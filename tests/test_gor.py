@@ -1,9 +1,12 @@
 # coding: utf-8
 
+import io
+import pickle
 import binascii
+import gzip
 import unittest
 
-from gor.base import Gor, decode_chunked
+from gor.base import Gor, GorMessage, decode_chunked
 from gor.callback import SimpleCallbackContainer
 
 
@@ -27,6 +30,97 @@ class TestCommon(unittest.TestCase):
         for k, v in expected.items():
             self.assertEqual(getattr(message, k, None), v)
 
+    def test_message_lazy_accessors(self):
+        payload = b'1 2 3\nGET /test?a=1 HTTP/1.1\r\nHost: localhost\r\n\r\nhello'
+        message = GorMessage.from_payload(payload)
+        self.assertIs(message.payload, payload)
+        self.assertEqual(message.http_method, 'GET')
+        self.assertEqual(message.http_path, '/test?a=1')
+        self.assertEqual(message.http_body, b'hello')
+        self.assertEqual(bytes(message.http_body_view), b'hello')
+        self.assertEqual(message.raw_meta, '1 2 3')
+
+        message.http = b'HTTP/1.1 404 Not Found\r\n\r\n'
+        self.assertEqual(message.http_status, '404')
+        self.assertEqual(message.http_body, b'')
+        self.assertEqual(message.payload, b'1 2 3\nHTTP/1.1 404 Not Found\r\n\r\n')
+
+        message.raw_meta = '2 2 4'
+        self.assertEqual(message.payload, b'2 2 4\nHTTP/1.1 404 Not Found\r\n\r\n')
+
+    def test_message_pickle(self):
+        message = self.gor.parse_message(binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n'))
+        restored = pickle.loads(pickle.dumps(message))
+        self.assertEqual(restored.id, '2')
+        self.assertEqual(restored.meta, ['1', '2', '3'])
+        self.assertEqual(restored.http, b'GET / HTTP/1.1\r\n\r\n')
+
+    def test_parse_messages(self):
+        lines = [
+            binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n'),
+            binascii.hexlify(b'2 2 3\nHTTP/1.1 200 OK\r\n\r\n'),
+        ]
+        messages = self.gor.parse_messages(b'\n'.join(lines) + b'\n')
+        self.assertEqual([m.type for m in messages], ['1', '2'])
+        self.assertEqual([bytes(m.raw_line) for m in messages], lines)
+        self.assertEqual(messages[1].http, b'HTTP/1.1 200 OK\r\n\r\n')
+
+        self.gor.stderr = io.StringIO()
+        messages = self.gor.parse_messages(lines[0] + b'\nzz\n' + lines[1])
+        self.assertEqual([m.type for m in messages], ['1', '2'])
+
+    def test_detach(self):
+        lines = [binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\nHost: a\r\n\r\nhello'),
+                 binascii.hexlify(b'2 2 3\nHTTP/1.1 200 OK\r\n\r\n')]
+        first, second = self.gor.parse_messages(b'\n'.join(lines))
+        self.assertEqual(first.http_method, 'GET')
+        self.assertIs(first.detach(), first)
+        self.assertIsInstance(first.raw_line, bytes)
+        self.assertEqual(first.raw_line, lines[0])
+        self.assertEqual(first.payload, b'1 2 3\nGET / HTTP/1.1\r\nHost: a\r\n\r\nhello')
+        self.assertEqual(first.http_body, b'hello')
+        self.assertEqual(first.headers.get('Host'), 'a')
+        second.detach()
+        self.assertEqual(second.http_status, '200')
+        self.assertEqual(second.http_body, b'')
+        self.assertEqual(len(second._buf), len(second.payload))
+
+    def test_emit_passthrough(self):
+        out = io.BytesIO()
+        self.gor.writer.stream = out
+        line = binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n').upper()
+        self.gor.emit(self.gor.parse_message(line + b'\n'))
+        self.gor.on('response', lambda proxy, msg, **kwargs: None)
+        self.gor.emit(self.gor.parse_message(line))
+        self.gor.writer.flush()
+        self.assertEqual(out.getvalue(), line + b'\n' + line + b'\n')
+
+        # callbacks which leave the message untouched, returning it or not
+        self.gor.on('request', lambda proxy, msg, **kwargs: None)
+        self.gor.on('request', lambda proxy, msg, **kwargs: msg)
+        self.gor.emit(self.gor.parse_message(line))
+        self.gor.writer.flush()
+        self.assertEqual(out.getvalue()[2 * len(line) + 2:], line + b'\n')
+
+    def test_emit_modified(self):
+        out = io.BytesIO()
+        self.gor.writer.stream = out
+        line = binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n').upper()
+
+        def rewrite(proxy, msg, **kwargs):
+            msg.http = proxy.set_http_header(msg.http, 'X-Test', '1')
+            return msg
+
+        self.gor.on('request', rewrite)
+        self.gor.emit(self.gor.parse_message(line))
+        self.gor.writer.flush()
+        self.assertEqual(binascii.unhexlify(out.getvalue().strip()),
+                         b'1 2 3\nGET / HTTP/1.1\r\nX-Test: 1\r\n\r\n')
+
+        message = self.gor.parse_message(line)
+        message.raw_meta = '1 2 4'
+        self.assertIsNone(message.raw_line)
+
     def test_http_method(self):
         payload = b'GET /test HTTP/1.1\r\n\r\n'
         method = self.gor.http_method(payload)
@@ -129,6 +223,7 @@ class TestCommon(unittest.TestCase):
         self.assertEqual(cookie, 'a=b')
         cookie = self.gor.http_cookie(payload, 'nope')
         self.assertIsNone(cookie)
+        self.assertIsNone(self.gor.http_cookie(b'GET / HTTP/1.1\r\n\r\n', 'test'))
 
     def test_set_http_cookie(self):
         payload = b'GET / HTTP/1.1\r\nCookie: a=b; test=zxc\r\n\r\n'
@@ -136,6 +231,8 @@ class TestCommon(unittest.TestCase):
         self.assertEqual(new_payload, b'GET / HTTP/1.1\r\nCookie: a=b; test=111\r\n\r\n')
         new_payload = self.gor.set_http_cookie(payload, 'new', 'one%3d%3d--test')
         self.assertEqual(new_payload, b'GET / HTTP/1.1\r\nCookie: a=b; test=zxc; new=one%3d%3d--test\r\n\r\n')
+        new_payload = self.gor.set_http_cookie(b'GET / HTTP/1.1\r\n\r\n', 'test', '111')
+        self.assertEqual(new_payload, b'GET / HTTP/1.1\r\nCookie: test=111\r\n\r\n')
 
     def test_delete_http_cookie(self):
         payload = b'GET / HTTP/1.1\r\nCookie: a=b; test=zxc\r\n\r\n'
@@ -155,6 +252,14 @@ class TestCommon(unittest.TestCase):
         plain_body = self.gor.decompress_gzip_body(plain_payload)
         self.assertEqual(plain_body.decode(), expected)
 
+    def test_decompress_gzip_body_without_transfer_encoding(self):
+        body = b'{"code": "1"}' * 100
+        payload = b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\n\r\n' + gzip.compress(body)
+        self.assertEqual(self.gor.decompress_gzip_body(payload), body)
+        self.assertEqual(b''.join(self.gor.iter_http_body(payload, chunk_size=100)), body)
+        with self.assertRaises(ValueError):
+            self.gor.decompress_gzip_body(payload, max_size=100)
+
     def test_decode_chunked(self):
         data = b'4\r\nWiki\r\n6\r\npedia \r\nE\r\nin \r\n\r\nchunks.\r\n0\r\n\r\n'
         decoded = decode_chunked(data)
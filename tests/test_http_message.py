@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import unittest
+
+from gor.base import Gor
+from gor.callback import SimpleCallbackContainer
+from gor.http_message import HeaderIndex, HttpMessage
+
+
+class TestHeaderIndex(unittest.TestCase):
+
+    payload = b'GET / HTTP/1.1\r\nHost: localhost\r\nX-Dup: 1\r\nx-dup: 2\r\nContent-Length: 5\r\n\r\nhello'
+
+    def test_lookup(self):
+        index = HeaderIndex(self.payload)
+        self.assertEqual(index.get('host'), 'localhost')
+        self.assertEqual(index.get('HOST'), 'localhost')
+        self.assertEqual(index.get('x-dup'), '1')
+        self.assertIsNone(index.get('Cookie'))
+        self.assertIn('content-length', index)
+        header = index.find('Host')
+        self.assertEqual(self.payload[header.start:header.end], b'Host: localhost\r\n')
+
+    def test_body_is_not_indexed(self):
+        index = HeaderIndex(b'POST / HTTP/1.1\r\nHost: a\r\n\r\nkey: value\r\n')
+        self.assertIsNone(index.get('key'))
+
+    def test_edit(self):
+        index = HeaderIndex(self.payload)
+        self.assertIs(index.to_bytes(), self.payload)
+        index.set('host', 'example.com')
+        index.set('X-New', 'a')
+        index.set('X-New2', 'b')
+        index.delete('X-Dup')
+        index.delete('Content-Length')
+        index.set('X-New2', 'c')
+        self.assertEqual(index.get('x-dup'), '2')
+        self.assertEqual(
+            index.to_bytes(),
+            b'GET / HTTP/1.1\r\nX-New2: c\r\nX-New: a\r\nHost: example.com\r\nx-dup: 2\r\n\r\nhello')
+        index.delete('X-New')
+        self.assertEqual(
+            index.to_bytes(),
+            b'GET / HTTP/1.1\r\nX-New2: c\r\nHost: example.com\r\nx-dup: 2\r\n\r\nhello')
+
+
+class TestHttpMessage(unittest.TestCase):
+
+    payload = b'GET /test?a=1 HTTP/1.1\r\nUser-Agent: Python\r\nCookie: a=b; test=zxc\r\nContent-Length: 5\r\n\r\nhello'
+
+    def test_no_edit(self):
+        req = HttpMessage(self.payload)
+        self.assertIs(req.to_bytes(), self.payload)
+        self.assertEqual(req.method, 'GET')
+        self.assertEqual(req.path, '/test?a=1')
+        self.assertEqual(req.path_param('a'), ['1'])
+        self.assertEqual(req.cookie('test'), 'zxc')
+        self.assertEqual(req.header('user-agent'), 'Python')
+        self.assertEqual(req.body, b'hello')
+
+    def test_matches_gor_helpers(self):
+        gor = Gor(SimpleCallbackContainer())
+        expected = self.payload
+        expected = gor.set_http_path(expected, b'/v2/test?a=1')
+        expected = gor.set_http_path_param(expected, 'b', '2')
+        expected = gor.set_http_header(expected, 'User-Agent', 'Gor')
+        expected = gor.set_http_header(expected, 'X-Test', '1')
+        expected = gor.delete_http_cookie(expected, 'a')
+        expected = gor.set_http_cookie(expected, 'test', '111')
+        expected = gor.set_http_body(expected, b'hello, world!')
+
+        req = HttpMessage(self.payload)
+        req.path = '/v2' + req.path
+        req.set_path_param('b', '2')
+        req.set_header('User-Agent', 'Gor')
+        req.set_header('X-Test', '1')
+        req.delete_cookie('a')
+        req.set_cookie('test', '111')
+        req.body = b'hello, world!'
+        self.assertEqual(req.to_bytes(), expected)
+
+    def test_status(self):
+        resp = HttpMessage(b'HTTP/1.1 200 OK\r\n\r\n')
+        resp.status = '404'
+        resp.delete_header('Content-Length')
+        self.assertEqual(resp.to_bytes(), b'HTTP/1.1 404 OK\r\n\r\n')
@@ -2,12 +2,16 @@
 
 import io
 import sys
+import time
 import binascii
 import unittest
+import threading
 import multiprocessing
 
 from gor.middleware import MultiProcessGor
 
+from .helpers import fail_odd
+
 
 class Counter(object):
     def __init__(self, lock):
@@ -34,6 +38,18 @@ def _incr_received(proxy, msg, **kwargs):
         counters[h].increment()
 
 
+def _slow_even(proxy, msg, **kwargs):
+    if int(msg.id) % 2 == 0:
+        time.sleep(0.01)
+    if int(msg.id) % 5 == 0:
+        msg.http = msg.http.replace(b'GET', b'PUT')
+        return msg
+
+
+def _on_request(proxy, msg, **kwargs):
+    proxy.on('response', _incr_received, idx=msg.id, passby=kwargs['passby'])
+
+
 class TestMultiProcessGor(unittest.TestCase):
 
     def setUp(self):
@@ -42,14 +58,21 @@ class TestMultiProcessGor(unittest.TestCase):
     def tearDown(self):
         pass
 
-    def _proxy_coroutine(self, passby):
-        proxy = MultiProcessGor()
+    def _proxy_coroutine(self, passby, **kwargs):
+        proxy = MultiProcessGor(**kwargs)
         proxy.on('message', _incr_received, passby=passby)
         proxy.on('request', _incr_received, passby=passby)
         proxy.on('response', _incr_received, idx='2', passby=passby)
         proxy.run()
 
     def test_run(self):
+        self._run()
+
+    def test_run_queue_channel(self):
+        self._run(channel='queue')
+
+    def _run(self, **kwargs):
+        counter.val.value = 0
         old_stdin = sys.stdin
         passby = {'counter': hash(counter)}
         payload = "\n".join([
@@ -58,6 +81,120 @@ class TestMultiProcessGor(unittest.TestCase):
             binascii.hexlify(b'2 3 3\nHTTP/1.1 200 OK\r\n\r\n').decode("utf-8"),
         ])
         sys.stdin = io.StringIO(payload)
-        self._proxy_coroutine(passby)
+        self._proxy_coroutine(passby, **kwargs)
         self.assertEqual(counter.value, 5)
         sys.stdin = old_stdin
+
+    def test_run_per_id_chain(self):
+        counter.val.value = 0
+        old_stdin = sys.stdin
+        passby = {'counter': hash(counter)}
+        payload = "\n".join([
+            binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i).decode("utf-8") for i in range(10)
+        ] + [
+            binascii.hexlify(b'2 %d 3\nHTTP/1.1 200 OK\r\n\r\n' % i).decode("utf-8") for i in range(10)
+        ])
+        sys.stdin = io.StringIO(payload)
+        proxy = MultiProcessGor(concurrency=3)
+        proxy.on('request', _on_request, passby=passby)
+        proxy.run()
+        self.assertEqual(counter.value, 10)
+        self.assertEqual(len(proxy.chan_container.ch), 1)
+        sys.stdin = old_stdin
+
+    def test_run_ordered(self):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        payloads = [b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i for i in range(40)]
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = MultiProcessGor(concurrency=4, ordered=True)
+            proxy.on('request', _slow_even)
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        expected = [p.replace(b'GET', b'PUT') if i % 5 == 0 else p for i, p in enumerate(payloads)]
+        self.assertEqual(output.splitlines(), [binascii.hexlify(p) for p in expected])
+
+    def test_run_ordered_rules(self):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        payloads = [b'1 %d 3\nGET /%s HTTP/1.1\r\n\r\n' % (i, b'static' if i % 3 else b'api') for i in range(30)]
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            rules = [{'match': {'path_prefix': '/static'}, 'action': 'pass'}]
+            proxy = MultiProcessGor(concurrency=4, ordered=True, rules=rules)
+            proxy.on('request', _slow_even)
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        expected = [p.replace(b'GET', b'PUT') if i % 15 == 0 else p for i, p in enumerate(payloads)]
+        self.assertEqual(output.splitlines(), [binascii.hexlify(p) for p in expected])
+
+    def test_run_callback_error(self):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        payloads = [b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i for i in range(20)]
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = MultiProcessGor(concurrency=2, ordered=True)
+            proxy.on('request', fail_odd)
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        # failed messages go through unmodified
+        expected = [p.replace(b'GET', b'PUT') if i % 2 == 0 else p for i, p in enumerate(payloads)]
+        self.assertEqual(output.splitlines(), [binascii.hexlify(p) for p in expected])
+
+    def test_passthrough_flushed_while_idle(self):
+        line = binascii.hexlify(b'1 1 3\nGET / HTTP/1.1\r\n\r\n')
+        closed = threading.Event()
+
+        class HeldInput(io.RawIOBase):
+            # one line, then the input stays open until `closed` is set
+            lines = [line + b'\n']
+
+            def readable(self):
+                return True
+
+            def read(self, n=-1):
+                if self.lines:
+                    return self.lines.pop()
+                closed.wait()
+                return b''
+
+        output = io.BytesIO()
+        proxy = MultiProcessGor(concurrency=2, input=HeldInput(), output=output)
+        runner = threading.Thread(target=proxy.run)
+        runner.start()
+        # no callback, the parent passes the line through and flushes it on
+        # the latency bound, no worker result wakes a collector up
+        deadline = time.monotonic() + 5
+        while not output.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        written = output.getvalue()
+        closed.set()
+        runner.join()
+        self.assertEqual(written, line + b'\n')
+
+    def test_run_overflow_drop_oldest(self):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        payloads = [b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i for i in range(40)]
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = MultiProcessGor(concurrency=2, ordered=True, queue_size=2, overflow='drop_oldest')
+            proxy.on('request', _slow_even)
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        ids = [int(binascii.unhexlify(line).split(b' ')[1]) for line in output.splitlines()]
+        self.assertGreater(proxy.overflow.dropped, 0)
+        self.assertEqual(len(ids), 40 - proxy.overflow.dropped)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(ids[-1], 39)
+
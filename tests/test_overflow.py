@@ -0,0 +1,27 @@
+# coding: utf-8
+
+import unittest
+
+from gor.overflow import OverflowPolicy, BLOCK, DROP_NEWEST, DROP_OLDEST
+from gor.stats import Stats
+
+
+class TestOverflowPolicy(unittest.TestCase):
+
+    def test_policies(self):
+        self.assertEqual(OverflowPolicy('block').on_full(), BLOCK)
+        self.assertEqual(OverflowPolicy('drop_newest').on_full(), DROP_NEWEST)
+        self.assertEqual(OverflowPolicy('drop_oldest').on_full(), DROP_OLDEST)
+        self.assertRaises(ValueError, OverflowPolicy, 'explode')
+
+    def test_sample(self):
+        policy = OverflowPolicy('sample', sample=4)
+        policy.stats = Stats()
+        actions = [policy.on_full() for _ in range(8)]
+        self.assertEqual(actions.count(BLOCK), 2)
+        self.assertEqual((policy.dropped, policy.delayed), (6, 2))
+        self.assertEqual(policy.stats.counters, {'overflow.dropped': 6, 'overflow.delayed': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import json
+import binascii
+import tempfile
+import unittest
+
+from gor.base import GorMessage
+from gor.rules import RuleSet, DROP, PASS
+from gor.middleware import AsyncioGor
+
+
+RULES = [
+    {'match': {'method': ['OPTIONS', 'HEAD']}, 'action': 'drop'},
+    {'match': {'path_prefix': '/static/'}, 'action': 'pass'},
+    {'match': {'path_prefix': '/api/v1/', 'header': {'X-Debug': {'present': True}}},
+     'action': 'rewrite',
+     'rewrite': {'path_prefix': ['/api/v1/', '/api/v2/'], 'delete_header': ['X-Debug']}},
+    {'match': {'path_prefix': '/api/', 'query': {'dry': '1'}}, 'action': 'drop'},
+    {'match': {'type': 'response', 'header': {'Content-Type': {'prefix': 'image/'}}}, 'action': 'drop'},
+]
+
+
+def message(payload: bytes) -> GorMessage:
+    msg = GorMessage.from_payload(payload)
+    msg.raw_line = binascii.hexlify(payload)
+    return msg
+
+
+class TestRuleSet(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet(RULES)
+
+    def test_method_and_prefix(self):
+        self.assertEqual(self.rules.apply(message(b'1 1 1\nHEAD / HTTP/1.1\r\n\r\n')), DROP)
+        self.assertEqual(self.rules.apply(message(b'1 1 1\nGET /static/a.js HTTP/1.1\r\n\r\n')), PASS)
+        self.assertIsNone(self.rules.apply(message(b'1 1 1\nGET /home HTTP/1.1\r\n\r\n')))
+
+    def test_falls_through_to_later_rule(self):
+        msg = message(b'1 1 1\nGET /api/v1/users?dry=1 HTTP/1.1\r\n\r\n')
+        self.assertEqual(self.rules.match(msg), self.rules.rules[3])
+        self.assertEqual(self.rules.apply(msg), DROP)
+        self.assertIsNone(self.rules.apply(message(b'1 1 1\nGET /api/v1/users?dry=0 HTTP/1.1\r\n\r\n')))
+
+    def test_rewrite(self):
+        msg = message(b'1 1 1\nGET /api/v1/users HTTP/1.1\r\nX-Debug: 1\r\nHost: a\r\n\r\n')
+        self.assertIsNone(self.rules.apply(msg))
+        self.assertEqual(msg.http, b'GET /api/v2/users HTTP/1.1\r\nHost: a\r\n\r\n')
+        self.assertIsNone(msg.raw_line)
+
+    def test_response_rule(self):
+        self.assertEqual(self.rules.apply(message(b'2 1 1\nHTTP/1.1 200 OK\r\nContent-Type: image/png\r\n\r\n')), DROP)
+        self.assertIsNone(self.rules.apply(message(b'2 1 1\nHTTP/1.1 200 OK\r\n\r\n')))
+        self.assertIsNone(self.rules.apply(message(b'3 1 1\nHTTP/1.1 200 OK\r\nContent-Type: image/png\r\n\r\n')))
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rules.json')
+            with open(path, 'w') as f:
+                json.dump({'rules': RULES}, f)
+            rules = RuleSet.load(path)
+        self.assertEqual(len(rules.rules), len(RULES))
+
+    def test_invalid_action(self):
+        with self.assertRaises(ValueError):
+            RuleSet([{'action': 'explode'}])
+
+
+class TestGorRules(unittest.TestCase):
+
+    def test_run(self):
+        received = []
+        payloads = [
+            b'1 1 1\nOPTIONS / HTTP/1.1\r\n\r\n',
+            b'1 2 1\nGET /static/a.js HTTP/1.1\r\n\r\n',
+            b'1 3 1\nGET /api/v1/x HTTP/1.1\r\nX-Debug: 1\r\n\r\n',
+            b'1 4 1\nGET /home HTTP/1.1\r\n\r\n',
+        ]
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO("\n".join(binascii.hexlify(p).decode() for p in payloads))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = AsyncioGor(rules=RULES)
+            proxy.on('request', lambda proxy, msg, **kwargs: received.append(msg.id))
+            proxy.run()
+            output = sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+        self.assertEqual(sorted(received), ['3', '4'])
+        self.assertEqual(sorted(output.splitlines()), sorted([
+            binascii.hexlify(payloads[1]),
+            binascii.hexlify(b'1 3 1\nGET /api/v2/x HTTP/1.1\r\n\r\n'),
+            binascii.hexlify(payloads[3]),
+        ]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# coding: utf-8
+
+import io
+import sys
+import zlib
+import binascii
+import unittest
+
+from gor.sampling import Sampler, TokenBucket, read_head
+from gor.middleware import AsyncioGor, MultiProcessGor
+
+
+def line(_type: int, _id: int, path: bytes = b'/') -> bytes:
+    if _type == 1:
+        http = b'GET %s HTTP/1.1\r\nHost: a\r\n\r\n' % path
+    else:
+        http = b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n'
+    return binascii.hexlify(b'%d %d 1 0\n%s' % (_type, _id, http))
+
+
+def _mark(proxy, msg, **kwargs):
+    msg.http = msg.http.replace(b'GET', b'PUT')
+    return msg
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(2, burst=3)
+        self.assertEqual([bucket.take(0) for _ in range(4)], [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+        bucket.charge(0.5)
+        self.assertFalse(bucket.take(1.0))
+        self.assertTrue(bucket.take(1.5))
+
+    def test_read_head(self):
+        self.assertEqual(read_head(line(1, 7, b'/api/x')), (b'1', b'7', b'/api/x'))
+        self.assertEqual(read_head(line(3, 7)), (b'3', b'7', None))
+        self.assertRaises(ValueError, read_head, binascii.hexlify(b'garbage'))
+
+    def test_rate_keeps_ids_together(self):
+        sampler = Sampler(rate=0.25)
+        kept = {}
+        for i in range(400):
+            for t in (1, 2, 3):
+                kept.setdefault(i, set()).add(sampler.keep(line(t, i)))
+        self.assertTrue(all(len(k) == 1 for k in kept.values()))
+        ratio = sum(k == {True} for k in kept.values()) / 400.0
+        self.assertAlmostEqual(ratio, 0.25, delta=0.08)
+        self.assertEqual(kept[5], {zlib.crc32(b'5') % 10000 < 2500})
+        self.assertEqual(sampler.skipped, 3 * sum(k == {False} for k in kept.values()))
+
+    def test_rate_limits(self):
+        sampler = Sampler(paths={'/api/': [1, 2], '/api/slow': 0}, max_rate=100, burst=5)
+        sampler.tick(0)
+        self.assertEqual([sampler.keep(line(1, i, b'/api/x')) for i in range(3)], [True, True, False])
+        self.assertFalse(sampler.keep(line(1, 3, b'/api/slow/1')))
+        # responses follow the decision taken for their request
+        self.assertTrue(sampler.keep(line(2, 0)))
+        self.assertFalse(sampler.keep(line(2, 2)))
+        # the global cap of 5 messages at once
+        self.assertTrue(sampler.keep(line(1, 4, b'/other')))
+        self.assertTrue(sampler.keep(line(1, 5, b'/other')))
+        self.assertFalse(sampler.keep(line(1, 6, b'/other')))
+        sampler.tick(1)
+        self.assertTrue(sampler.keep(line(1, 7, b'/api/x')))
+        self.assertEqual(sampler.limited, 4)
+
+    def _run(self, impl, lines, **kwargs):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO(b'\n'.join(lines).decode())
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy = impl(**kwargs)
+            proxy.on('request', _mark)
+            proxy.run()
+            return proxy, sys.stdout.buffer.getvalue().splitlines()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+
+    def test_unsampled_pass_through(self):
+        lines = [line(1 + i % 3, i // 3) for i in range(90)]
+        proxy, output = self._run(MultiProcessGor, lines, concurrency=2, ordered=True, sampling={'rate': 0.5})
+        kept = [zlib.crc32(b'%d' % (i // 3)) % 10000 < 5000 for i in range(90)]
+        expected = [binascii.hexlify(binascii.unhexlify(l).replace(b'GET', b'PUT')) if k and i % 3 == 0 else l
+                    for i, (l, k) in enumerate(zip(lines, kept))]
+        self.assertEqual(output, expected)
+        self.assertEqual(proxy.sampler.skipped, kept.count(False))
+
+    def test_rules_apply_to_unsampled(self):
+        lines = [line(1, i, b'/drop' if i % 4 == 0 else b'/keep') for i in range(80)]
+        rules = [{'match': {'path_prefix': '/drop'}, 'action': 'drop'},
+                 {'match': {'path_prefix': '/keep'}, 'action': 'rewrite',
+                  'rewrite': {'set_header': {'X-Rule': '1'}}}]
+        for impl, kwargs in ((AsyncioGor, {}), (MultiProcessGor, {'concurrency': 2, 'ordered': True})):
+            proxy, output = self._run(impl, lines, rules=rules, sampling={'rate': 0.5}, **kwargs)
+            output = [binascii.unhexlify(l) for l in output]
+            self.assertGreater(proxy.sampler.skipped, 0)
+            # no message matching the drop rule gets out, every other one
+            # is rewritten, dispatched or not
+            self.assertEqual(len(output), 60)
+            self.assertFalse(any(b'/drop' in o for o in output))
+            self.assertTrue(all(b'X-Rule: 1' in o for o in output))
+            self.assertEqual(sum(b'PUT' in o for o in output),
+                             sum(zlib.crc32(b'%d' % i) % 10000 < 5000 for i in range(80) if i % 4))
+
+    def test_asyncio_sampling(self):
+        lines = [line(1, i) for i in range(30)]
+        proxy, output = self._run(AsyncioGor, lines, sampling={'max_rate': 1, 'burst': 10})
+        self.assertEqual(sum(b'PUT' in binascii.unhexlify(l) for l in output), 10)
+        self.assertEqual(len(output), 30)
+        self.assertEqual(proxy.sampler.limited, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
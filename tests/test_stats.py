@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import io
+import os
+import json
+import pickle
+import tempfile
+import unittest
+
+from gor.stats import Histogram, Stats, StatsReporter, merge_snapshots, percentile
+from gor.writer import SequencedWriter, iter_results, STATS_SEQ
+
+
+class ListChannel(object):
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, data):
+        self.items.append(data)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_histogram_percentile(self):
+        hist = Histogram()
+        for _ in range(99):
+            hist.record(0.000010)
+        hist.record(0.010)
+        snap = hist.snapshot()
+        self.assertEqual(snap['count'], 100)
+        self.assertEqual(percentile(snap, 50), 15.0)
+        self.assertEqual(percentile(snap, 100), 16383.0)
+        self.assertAlmostEqual(snap['max'], 0.010)
+
+    def test_merge_snapshots(self):
+        a, b = Stats(), Stats()
+        a.incr('messages', 2)
+        b.incr('messages', 3)
+        a.observe('parse', 0.001)
+        b.observe('parse', 0.002)
+        b.gauge('queue.0', lambda: 7)
+        merged = merge_snapshots([a.snapshot(), b.snapshot()])
+        self.assertEqual(merged['counters'], {'messages': 5})
+        self.assertEqual(merged['histograms']['parse']['count'], 2)
+        self.assertEqual(merged['gauges'], {'queue.0': 7})
+
+    def test_reporter_stream(self):
+        stats = Stats()
+        stats.incr('messages', 4)
+        stats.observe('callback.request', 0.0001)
+        stream = io.StringIO()
+        reporter = StatsReporter(stats, 60, stream=stream)
+        reporter.update({'pid': -1, 'counters': {'messages': 1}, 'histograms': {}, 'gauges': {}})
+        reporter.report()
+        out = stream.getvalue()
+        self.assertIn('5 messages', out)
+        self.assertIn('callback.request', out)
+
+    def test_reporter_json_file(self):
+        stats = Stats()
+        stats.incr('messages')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stats.json')
+            reporter = StatsReporter(stats, 60, path=path)
+            reporter.start()
+            reporter.stop()
+            with open(path) as f:
+                summary = json.load(f)
+        self.assertEqual(summary['counters']['messages'], 1)
+
+    def test_worker_snapshot_framing(self):
+        channel = ListChannel()
+        writer = SequencedWriter(channel, batch_size=10)
+        writer.seq = 3
+        writer.write(b'out\n')
+        stats = Stats()
+        stats.incr('messages')
+        writer.write_stats(pickle.dumps(stats.snapshot()))
+        writer.flush()
+        results = list(iter_results(channel.items[0]))
+        self.assertEqual(results[0][0], 3)
+        self.assertEqual(results[1][0], STATS_SEQ)
+        self.assertEqual(pickle.loads(results[1][1])['counters'], {'messages': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# coding: utf-8
+
+import io
+import os
+import sys
+import time
+import binascii
+import unittest
+import threading
+
+from gor.middleware import ThreadPoolGor
+
+from .helpers import fail_odd
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self):
+        with self._lock:
+            self.value += 1
+
+    def count(self):
+        with self._lock:
+            return self.value
+
+
+def _incr_received(proxy, msg, **kwargs):
+    kwargs['passby']['received'].increment()
+
+
+def _slow_request(proxy, msg, **kwargs):
+    time.sleep(0.05)
+    proxy.on('response', _incr_received, idx=msg.id, once=True, passby=kwargs['passby'])
+
+
+class TestThreadPoolGor(unittest.TestCase):
+
+    def _run(self, proxy, lines):
+        old_stdin, old_stdout = sys.stdin, sys.stdout
+        sys.stdin = io.StringIO("\n".join(line.decode("utf-8") for line in lines))
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            proxy.run()
+            return sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdin, sys.stdout = old_stdin, old_stdout
+
+    def test_run(self):
+        passby = {'received': Counter()}
+        proxy = ThreadPoolGor()
+        proxy.on('message', _incr_received, passby=passby)
+        proxy.on('request', _incr_received, passby=passby)
+        proxy.on('response', _incr_received, idx='2', passby=passby)
+        lines = [
+            binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n'),
+            binascii.hexlify(b'2 2 3\nHTTP/1.1 200 OK\r\n\r\n'),
+            binascii.hexlify(b'2 3 3\nHTTP/1.1 200 OK\r\n\r\n'),
+        ]
+        output = self._run(proxy, lines)
+        self.assertEqual(passby['received'].count(), 5)
+        self.assertEqual(sorted(output.splitlines()), sorted(lines))
+
+    def test_run_blocking_callbacks(self):
+        passby = {'received': Counter()}
+        proxy = ThreadPoolGor(concurrency=8)
+        proxy.on('request', _slow_request, passby=passby)
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(16)]
+        lines += [binascii.hexlify(b'2 %d 3\nHTTP/1.1 200 OK\r\n\r\n' % i) for i in range(16)]
+        started = time.monotonic()
+        output = self._run(proxy, lines)
+        self.assertLess(time.monotonic() - started, 16 * 0.05)
+        self.assertEqual(passby['received'].count(), 16)
+        self.assertEqual(len(output.splitlines()), 32)
+
+    def test_run_bad_meta(self):
+        proxy = ThreadPoolGor()
+        proxy.stderr = io.StringIO()
+        proxy.on('request', lambda proxy, msg, **kwargs: None)
+        lines = [binascii.hexlify(b'1 \xff\xfe 3\nGET / HTTP/1.1\r\n\r\n'),
+                 binascii.hexlify(b'1 2 3\nGET / HTTP/1.1\r\n\r\n')]
+        output = self._run(proxy, lines)
+        # the faulty line is reported and skipped, the next one goes through
+        self.assertEqual(output.splitlines(), lines[1:])
+        self.assertIn('Error while parsing', proxy.stderr.getvalue())
+
+    def test_callback_error(self):
+        proxy = ThreadPoolGor()
+        proxy.on('request', fail_odd)
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(10)]
+        output = self._run(proxy, lines)
+        # failed messages go through unmodified
+        expected = [binascii.hexlify(binascii.unhexlify(l).replace(b'GET', b'PUT')) if i % 2 == 0 else l
+                    for i, l in enumerate(lines)]
+        self.assertEqual(sorted(output.splitlines()), sorted(expected))
+
+    def test_expire_while_idle(self):
+        evicted = threading.Event()
+        read_fd, write_fd = os.pipe()
+        proxy = ThreadPoolGor(input=os.fdopen(read_fd, 'rb'), output=io.BytesIO(), channel_ttl=0.05,
+                              expire_interval=0.01, on_channel_evict=lambda chan, channels: evicted.set())
+        proxy.on('response', _incr_received, idx='7', passby={'received': Counter()})
+        runner = threading.Thread(target=proxy.run, daemon=True)
+        runner.start()
+        try:
+            # nothing is read nor registered, the channel expires on the timer
+            self.assertTrue(evicted.wait(5))
+        finally:
+            os.close(write_fd)
+            runner.join(10)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(proxy.chan_container.evicted, 1)
+
+    def test_overflow_drop_newest(self):
+        received = Counter()
+
+        def on_request(proxy, msg, **kwargs):
+            time.sleep(0.005)
+            received.increment()
+
+        lines = [binascii.hexlify(b'1 %d 3\nGET / HTTP/1.1\r\n\r\n' % i) for i in range(50)]
+        proxy = ThreadPoolGor(concurrency=1, queue_size=1, overflow='drop_newest')
+        proxy.on('request', on_request)
+        self._run(proxy, lines)
+        self.assertGreater(proxy.overflow.dropped, 0)
+        self.assertEqual(received.count() + proxy.overflow.dropped, 50)
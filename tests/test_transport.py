@@ -0,0 +1,162 @@
+# coding: utf-8
+
+import os
+import time
+import socket
+import binascii
+import tempfile
+import threading
+import unittest
+
+from gor import transport
+from gor.transport import FanOut, FdOutput, SocketOutput, open_input, open_output, parse_spec
+from gor.middleware import AsyncioGor, ThreadPoolGor
+
+
+def hex_lines(count: int = 20) -> bytes:
+    return b''.join(binascii.hexlify(b'1 %d 1 0\nGET /%d HTTP/1.1\r\n\r\n' % (i, i)) + b'\n'
+                    for i in range(count))
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def test_parse_spec(self):
+        self.assertEqual(parse_spec(None), ('stdio', None))
+        self.assertEqual(parse_spec('-'), ('stdio', None))
+        self.assertEqual(parse_spec('unix:/tmp/gor.sock'), ('unix', '/tmp/gor.sock'))
+        self.assertEqual(parse_spec('fifo:/tmp/gor'), ('fifo', '/tmp/gor'))
+        self.assertEqual(parse_spec('/tmp/traffic.gor'), ('file', '/tmp/traffic.gor'))
+        self.assertIsNone(open_input('-'))
+        self.assertIsNone(open_output(None))
+
+    def test_writev_partial(self):
+        sent = []
+
+        def send(bufs):
+            # accept at most 3 bytes per call
+            data = b''.join(bytes(b) for b in bufs)[:3]
+            sent.append(data)
+            return len(data)
+
+        transport._writev_all(send, -1, [b'abcd', b'', b'ef', b'ghijk'])
+        self.assertEqual(b''.join(sent), b'abcdefghijk')
+
+    def test_file_output(self):
+        output = open_output(self.path('out.gor'))
+        self.assertIsInstance(output, FdOutput)
+        output.writev([b'ab', b'cd'])
+        output.write(b'\n')
+        output.close()
+        with open(self.path('out.gor'), 'rb') as f:
+            self.assertEqual(f.read(), b'abcd\n')
+
+    def test_socket_output(self):
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        data = [os.urandom(1000) for _ in range(500)]
+        received = []
+        reader = threading.Thread(target=lambda: received.append(b.makefile('rb').read()))
+        reader.start()
+        output = SocketOutput(a)
+        output.writev(data)
+        a.shutdown(socket.SHUT_WR)
+        reader.join()
+        a.close()
+        b.close()
+        self.assertEqual(received[0], b''.join(data))
+
+    def test_socket_per_middleware(self):
+        path = self.path('gor.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(4)
+        gors = [ThreadPoolGor(input='unix:' + path, output='unix:' + path) for _ in range(2)]
+        conns = [server.accept()[0] for _ in range(2)]
+        # input and output of one middleware share a connection, the two
+        # middlewares do not
+        sockets = [gor._transport_output.sock for gor in gors]
+        self.assertEqual([list(gor._sockets.values()) for gor in gors], [[sock] for sock in sockets])
+        self.assertIsNot(sockets[0], sockets[1])
+        for gor in gors:
+            gor.input.close()
+            gor._close_output()
+        for conn in conns:
+            conn.close()
+        server.close()
+
+    def test_file_to_file(self):
+        with open(self.path('in.gor'), 'wb') as f:
+            f.write(hex_lines())
+        gor = ThreadPoolGor(input='file:' + self.path('in.gor'), output=self.path('out.gor'))
+        gor.run()
+        with open(self.path('out.gor'), 'rb') as f:
+            # messages of different ids may be reordered by the pool
+            self.assertEqual(sorted(f.read().splitlines()), sorted(hex_lines().splitlines()))
+
+    def test_fifo(self):
+        path = self.path('in.fifo')
+        os.mkfifo(path)
+
+        def feed():
+            with open(path, 'wb') as f:
+                f.write(hex_lines())
+
+        writer = threading.Thread(target=feed)
+        writer.start()
+        AsyncioGor(input='fifo:' + path, output=self.path('out.gor')).run()
+        writer.join()
+        with open(self.path('out.gor'), 'rb') as f:
+            self.assertEqual(sorted(f.read().splitlines()), sorted(hex_lines().splitlines()))
+
+    def test_fan_out(self):
+        path = self.path('gor.sock')
+        data = hex_lines(200)
+        with open(self.path('in.gor'), 'wb') as f:
+            f.write(data)
+        fanout = FanOut(path, 2)
+        stdin = open(self.path('in.gor'), 'rb')
+        stdout = open(self.path('out.gor'), 'wb')
+        # daemon threads and bounded joins, a broken middleware fails the
+        # test instead of leaving FanOut waiting for its clients forever
+        server = threading.Thread(target=fanout.run, args=(stdin, stdout), daemon=True)
+        server.start()
+        deadline = time.monotonic() + 10
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            server.join(0.01)
+        seen = []
+
+        def callback(proxy, msg, **kwargs):
+            seen.append(msg.id)
+            return msg
+
+        gors, middlewares = [], []
+        for impl in (AsyncioGor, ThreadPoolGor):
+            gor = impl(input='unix:' + path, output='unix:' + path)
+            gor.on('request', callback)
+            gors.append(gor)
+            middlewares.append(threading.Thread(target=gor.run, daemon=True))
+        for thread in middlewares:
+            thread.start()
+        for thread in middlewares + [server]:
+            thread.join(30)
+            self.assertFalse(thread.is_alive())
+        gors[0].io_loop.close()
+        stdin.close()
+        stdout.close()
+        with open(self.path('out.gor'), 'rb') as f:
+            self.assertEqual(sorted(f.read().splitlines()), sorted(data.splitlines()))
+        self.assertEqual(sorted(seen, key=int), [str(i) for i in range(200)])
+
+
+if __name__ == '__main__':
+    unittest.main()
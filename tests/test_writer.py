@@ -0,0 +1,91 @@
+# coding: utf-8
+
+import io
+import time
+import unittest
+
+from gor.writer import BatchWriter, Reassembler, SequencedWriter, iter_results
+
+
+class TestBatchWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+
+    def _written(self):
+        return self.stream.buffer.getvalue()
+
+    def test_flush_by_size(self):
+        writer = BatchWriter(self.stream, batch_size=3, max_latency_us=10 ** 7)
+        writer.write(b'a\n')
+        writer.write(b'b\n')
+        self.assertEqual(self._written(), b'')
+        self.assertEqual(writer.pending, 2)
+        writer.write(b'c\n')
+        self.assertEqual(self._written(), b'a\nb\nc\n')
+        self.assertEqual(writer.pending, 0)
+        self.assertIsNone(writer.timeout())
+
+    def test_flush_by_latency(self):
+        writer = BatchWriter(self.stream, batch_size=100, max_latency_us=1000)
+        writer.write(b'a\n')
+        writer.flush_if_due()
+        self.assertEqual(self._written(), b'')
+        self.assertLessEqual(writer.timeout(), 0.001)
+        time.sleep(0.002)
+        writer.flush_if_due()
+        self.assertEqual(self._written(), b'a\n')
+
+    def test_flush_text_stream(self):
+        stream = io.StringIO()
+        writer = BatchWriter(stream, batch_size=100)
+        writer.write(b'a\n')
+        writer.flush()
+        self.assertEqual(stream.getvalue(), 'a\n')
+
+
+class _ListChannel(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, *parts):
+        self.items.append(b''.join(parts))
+
+
+class TestReassembler(unittest.TestCase):
+
+    def setUp(self):
+        self.out = io.BytesIO()
+        self.writer = BatchWriter(self.out, batch_size=1000)
+
+    def test_sequenced_writer(self):
+        channel = _ListChannel()
+        writer = SequencedWriter(channel, batch_size=1000)
+        writer.seq = 3
+        writer.write(b'ab', b'\n')
+        writer.seq = 5
+        writer.write_payload(b'\x01')
+        writer.seq = 6
+        writer.write()
+        writer.flush()
+        results = [(seq, bytes(data)) for seq, data in iter_results(channel.items[0])]
+        self.assertEqual(results, [(3, b'ab\n'), (5, b'01\n'), (6, b'')])
+
+    def test_unordered(self):
+        output = Reassembler(self.writer)
+        output.add([(1, b'b\n'), (0, b'a\n')])
+        output.close()
+        self.assertEqual(self.out.getvalue(), b'b\na\n')
+
+    def test_ordered(self):
+        output = Reassembler(self.writer, ordered=True, window=2)
+        output.add([(1, b'b\n'), (2, b'')])
+        self.assertEqual(self.writer.pending, 0)
+        output.add([(0, (b'a', b'\n'))])
+        output.add([(4, b'e\n'), (5, b'f\n')])
+        self.assertEqual(self.writer.pending, 2)
+        # seq 3 is skipped once more than two results wait for it
+        output.add([(6, b'g\n')])
+        output.add([(3, b'd\n'), (8, b'i\n')])
+        output.close()
+        self.assertEqual(self.out.getvalue(), b'a\nb\ne\nf\ng\nd\ni\n')